@@ -5,13 +5,27 @@ from django.conf import settings
 from hashids import Hashids
 
 
+_hashers = {}
+
+
+def get_hasher(min_length=None):
+    """
+    Hashids builds its shuffled alphabets on construction, so keep one instance per min length.
+    """
+    if min_length is None:
+        min_length = settings.ID_HASH_MIN_LENGTH
+    if min_length not in _hashers:
+        _hashers[min_length] = Hashids(salt=settings.SECRET_KEY, min_length=min_length)
+    return _hashers[min_length]
+
+
 def to_hash(pk):
-    id_hash = Hashids(salt=settings.SECRET_KEY, min_length=12)
+    id_hash = get_hasher(12)
     return id_hash.encode(pk)
 
 
 def to_pk(hash_string):
-    id_hash = Hashids(salt=settings.SECRET_KEY, min_length=12)
+    id_hash = get_hasher(12)
     pk = id_hash.decode(hash_string)
     if len(pk):
         return pk[0]
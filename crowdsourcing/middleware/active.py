@@ -1,9 +1,7 @@
-from django.utils import timezone
+from crowdsourcing.utils import buffer_timestamp
 
 
 class CustomActiveViewMiddleware():
     def process_view(self, request, callback, callback_args, callback_kwargs):
         if not request.user.is_anonymous() and request.path == '/':
-            userprofile = request.user.profile
-            userprofile.last_active = timezone.now()
-            userprofile.save()
+            buffer_timestamp('last_active', request.user.id)
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.3 on 2018-01-08 21:14
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crowdsourcing', '0013_auto_20171212_0049'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='taskworkerresult',
+            index_together=set([('updated_at', 'id')]),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.3 on 2018-01-11 18:42
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('crowdsourcing', '0014_taskworkerresult_feed_index'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='workerprojectscore',
+            unique_together=set([('worker', 'project_group_id')]),
+        ),
+        migrations.RunSQL('''
+            INSERT INTO crowdsourcing_workerprojectscore (created_at, updated_at, project_group_id, worker_id, mu,
+                                                          sigma)
+              SELECT
+                now(),
+                now(),
+                project_group_id,
+                worker_id,
+                mu,
+                sigma
+              FROM (
+                     SELECT DISTINCT ON (p.group_id, tw.worker_id)
+                       p.group_id project_group_id,
+                       tw.worker_id,
+                       mw.mu,
+                       mw.sigma
+                     FROM crowdsourcing_matchworker mw
+                       INNER JOIN crowdsourcing_match m ON m.id = mw.match_id
+                       INNER JOIN crowdsourcing_taskworker tw ON tw.id = mw.task_worker_id
+                       INNER JOIN crowdsourcing_task t ON t.id = tw.task_id
+                       INNER JOIN crowdsourcing_project p ON p.id = t.project_id
+                     WHERE m.status = 2 AND mw.mu IS NOT NULL AND mw.sigma IS NOT NULL
+                     ORDER BY p.group_id, tw.worker_id, m.submitted_at DESC NULLS LAST
+                   ) latest
+            ON CONFLICT (worker_id, project_group_id) DO NOTHING;
+        ''', migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.3 on 2018-01-12 10:05
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('crowdsourcing', '0015_workerprojectscore_unique'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RawRatingFeedbackBounds',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('project_group_id', models.IntegerField()),
+                ('min_weight', models.FloatField(null=True)),
+                ('max_weight', models.FloatField(null=True)),
+                ('requester', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='raw_feedback_bounds', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='rawratingfeedbackbounds',
+            unique_together=set([('requester', 'project_group_id')]),
+        ),
+    ]
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.3 on 2018-01-15 14:21
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('crowdsourcing', '0016_rawratingfeedbackbounds'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProjectGroupRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('project_group_id', models.IntegerField(unique=True)),
+                ('completed', models.IntegerField(default=0)),
+                ('awaiting_review', models.IntegerField(default=0)),
+                ('checked_out', models.IntegerField(default=0)),
+                ('open_tasks', models.IntegerField(default=0)),
+                ('total', models.IntegerField(default=0)),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='project_rollups', to=settings.AUTH_USER_MODEL)),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='crowdsourcing.Project')),
+            ],
+        ),
+        migrations.RunSQL('''
+            INSERT INTO crowdsourcing_projectgrouprollup (created_at, updated_at, project_group_id, project_id, owner_id,
+                                                          completed, awaiting_review, checked_out, open_tasks, total)
+              SELECT
+                now(),
+                now(),
+                p_max.group_id,
+                p_max.id,
+                p0.owner_id,
+                sum(completed),
+                sum(awaiting_review),
+                sum(checked_out),
+                greatest((p0.repetition * count(DISTINCT task_id)) - sum(completed) -
+                         sum(awaiting_review), 0) - sum(checked_out),
+                p0.repetition * count(DISTINCT task_id)
+              FROM (
+                     SELECT
+                       p.group_id,
+                       t.group_id task_id,
+                       CASE WHEN tw.status in (1, 5)
+                         THEN 1
+                       ELSE 0 END checked_out,
+                       CASE WHEN tw.status = 3
+                         THEN 1
+                       ELSE 0 END completed,
+                       CASE WHEN tw.status = 2
+                         THEN 1
+                       ELSE 0 END awaiting_review
+                     FROM crowdsourcing_project p
+                       LEFT OUTER JOIN crowdsourcing_task t ON t.project_id = p.id
+                         AND t.deleted_at IS NULL and t.exclude_at is null
+                       LEFT OUTER JOIN crowdsourcing_taskworker tw ON tw.task_id = t.id
+                     WHERE p.deleted_at IS NULL AND is_review = FALSE) c
+                INNER JOIN (SELECT
+                              group_id,
+                              max(id) id
+                            FROM crowdsourcing_project
+                            GROUP BY group_id) p_max
+                  ON c.group_id = p_max.group_id
+                INNER JOIN crowdsourcing_project p0 ON p0.id = p_max.id
+              GROUP BY p_max.group_id, p_max.id, p0.owner_id, p0.repetition;
+        ''', migrations.RunSQL.noop),
+    ]
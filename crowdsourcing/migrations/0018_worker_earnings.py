@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.3 on 2018-01-16 11:47
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('crowdsourcing', '0017_projectgrouprollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WorkerDailyEarnings',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('day', models.DateField()),
+                ('submitted', models.IntegerField(default=0)),
+                ('accepted', models.IntegerField(default=0)),
+                ('earned', models.DecimalField(decimal_places=2, default=0, max_digits=19)),
+                ('worker', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_earnings', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='WorkerEarnings',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('earned', models.DecimalField(decimal_places=2, default=0, max_digits=19)),
+                ('awaiting_payment', models.DecimalField(decimal_places=2, default=0, max_digits=19)),
+                ('tasks_completed', models.IntegerField(default=0)),
+                ('worker', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='earnings', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='WorkerProjectEarnings',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('active', models.IntegerField(default=0)),
+                ('returned', models.IntegerField(default=0)),
+                ('in_progress', models.IntegerField(default=0)),
+                ('accepted', models.IntegerField(default=0)),
+                ('submitted', models.IntegerField(default=0)),
+                ('paid_count', models.IntegerField(default=0)),
+                ('amount_paid', models.DecimalField(decimal_places=2, default=0, max_digits=19)),
+                ('expected_payout_amount', models.DecimalField(decimal_places=2, default=0, max_digits=19)),
+                ('earned', models.DecimalField(decimal_places=2, default=0, max_digits=19)),
+                ('awaiting_payment', models.DecimalField(decimal_places=2, default=0, max_digits=19)),
+                ('expires_at', models.DateTimeField(null=True)),
+                ('last_submitted_at', models.DateTimeField(null=True)),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='crowdsourcing.Project')),
+                ('worker', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='project_earnings', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='workerprojectearnings',
+            unique_together=set([('worker', 'project')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='workerdailyearnings',
+            unique_together=set([('worker', 'day')]),
+        ),
+        migrations.RunSQL('''
+            INSERT INTO crowdsourcing_workerprojectearnings (created_at, updated_at, worker_id, project_id, active,
+                                                             returned, in_progress, accepted, submitted, paid_count,
+                                                             amount_paid, expected_payout_amount, earned,
+                                                             awaiting_payment, expires_at, last_submitted_at)
+              SELECT
+                now(),
+                now(),
+                tw.worker_id,
+                t.project_id,
+                sum(CASE WHEN tw.status NOT IN (6, 7) THEN 1 ELSE 0 END),
+                sum(CASE WHEN tw.status = 5 THEN 1 ELSE 0 END),
+                sum(CASE WHEN tw.status = 1 THEN 1 ELSE 0 END),
+                sum(CASE WHEN tw.status = 3 THEN 1 ELSE 0 END),
+                sum(CASE WHEN tw.status = 2 THEN 1 ELSE 0 END),
+                sum(CASE WHEN tw.status NOT IN (6, 7) AND tw.is_paid IS TRUE THEN 1 ELSE 0 END),
+                coalesce(sum(CASE WHEN tw.status = 3 THEN coalesce(t.price, p.price) ELSE 0 END), 0),
+                coalesce(sum(CASE WHEN tw.status NOT IN (6, 7) THEN coalesce(t.price, p.price) ELSE 0 END), 0),
+                coalesce(sum(CASE WHEN tw.is_paid IS TRUE THEN p.price ELSE 0 END), 0),
+                coalesce(sum(CASE WHEN tw.status = 3 AND tw.is_paid IS FALSE THEN p.price ELSE 0 END), 0),
+                min(CASE WHEN tw.status NOT IN (6, 7)
+                  THEN coalesce(tw.started_at, tw.created_at) + coalesce(p.timeout, INTERVAL '24 hour') END),
+                max(CASE WHEN tw.status NOT IN (6, 7) THEN tw.submitted_at END)
+              FROM crowdsourcing_taskworker tw
+                INNER JOIN crowdsourcing_task t ON tw.task_id = t.id
+                INNER JOIN crowdsourcing_project p ON p.id = t.project_id
+              GROUP BY tw.worker_id, t.project_id;
+
+            INSERT INTO crowdsourcing_workerearnings (created_at, updated_at, worker_id, earned, awaiting_payment,
+                                                      tasks_completed)
+              SELECT now(), now(), worker_id, sum(earned), sum(awaiting_payment), sum(accepted + submitted)
+              FROM crowdsourcing_workerprojectearnings
+              GROUP BY worker_id;
+
+            INSERT INTO crowdsourcing_workerdailyearnings (created_at, updated_at, worker_id, day, submitted, accepted,
+                                                           earned)
+              SELECT
+                now(),
+                now(),
+                tw.worker_id,
+                tw.submitted_at :: DATE,
+                sum(CASE WHEN tw.status IN (2, 3) THEN 1 ELSE 0 END),
+                sum(CASE WHEN tw.status = 3 THEN 1 ELSE 0 END),
+                coalesce(sum(CASE WHEN tw.status = 3 THEN coalesce(t.price, p.price) ELSE 0 END), 0)
+              FROM crowdsourcing_taskworker tw
+                INNER JOIN crowdsourcing_task t ON tw.task_id = t.id
+                INNER JOIN crowdsourcing_project p ON p.id = t.project_id
+              WHERE tw.submitted_at IS NOT NULL
+              GROUP BY tw.worker_id, tw.submitted_at :: DATE;
+        ''', migrations.RunSQL.noop),
+    ]
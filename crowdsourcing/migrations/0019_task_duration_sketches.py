@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.3 on 2018-01-22 11:05
+from __future__ import unicode_literals
+
+from django.conf import settings
+import django.contrib.postgres.fields
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('crowdsourcing', '0018_worker_earnings'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaskDurationSketch',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('project_group_id', models.IntegerField(unique=True)),
+                ('counts', django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), size=None)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='WorkerTaskDurationSketch',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('project_group_id', models.IntegerField()),
+                ('counts', django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), size=None)),
+                ('worker', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='task_duration_sketches', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='workertaskdurationsketch',
+            unique_together=set([('worker', 'project_group_id')]),
+        ),
+        migrations.RunSQL('''
+            WITH durations AS (
+                SELECT
+                  tw.worker_id,
+                  p.group_id,
+                  least(greatest(ceil(8 * log(2, greatest(extract(EPOCH FROM tw.submitted_at - tw.created_at),
+                                                          1) :: NUMERIC)), 0), 160) :: INT + 1 bucket,
+                  count(*) :: INT n
+                FROM crowdsourcing_taskworker tw
+                  INNER JOIN crowdsourcing_task t ON tw.task_id = t.id
+                  INNER JOIN crowdsourcing_project p ON p.id = t.project_id
+                WHERE tw.submitted_at IS NOT NULL AND tw.status IN (2, 3)
+                GROUP BY tw.worker_id, p.group_id, bucket
+            )
+            INSERT INTO crowdsourcing_workertaskdurationsketch (created_at, updated_at, worker_id, project_group_id,
+                                                               counts)
+              SELECT
+                now(),
+                now(),
+                k.worker_id,
+                k.group_id,
+                array_agg(coalesce(d.n, 0) ORDER BY b.bucket)
+              FROM (SELECT DISTINCT worker_id, group_id FROM durations) k
+                CROSS JOIN generate_series(1, 161) b(bucket)
+                LEFT OUTER JOIN durations d
+                  ON d.worker_id = k.worker_id AND d.group_id = k.group_id AND d.bucket = b.bucket
+              GROUP BY k.worker_id, k.group_id;
+
+            INSERT INTO crowdsourcing_taskdurationsketch (created_at, updated_at, project_group_id, counts)
+              SELECT
+                now(),
+                now(),
+                project_group_id,
+                array_agg(n ORDER BY i)
+              FROM (
+                     SELECT
+                       s.project_group_id,
+                       u.i,
+                       sum(u.n) :: INT n
+                     FROM crowdsourcing_workertaskdurationsketch s
+                       CROSS JOIN unnest(s.counts) WITH ORDINALITY u(n, i)
+                     GROUP BY s.project_group_id, u.i
+                   ) buckets
+              GROUP BY project_group_id;
+        ''', migrations.RunSQL.noop),
+    ]
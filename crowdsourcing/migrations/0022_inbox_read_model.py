@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.3 on 2018-01-29 10:37
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('crowdsourcing', '0021_bot_stream'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='conversation',
+            name='last_message',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='crowdsourcing.Message'),
+        ),
+        migrations.AddField(
+            model_name='conversationrecipient',
+            name='unread_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunSQL('''
+            UPDATE crowdsourcing_conversation c
+            SET last_message_id = m.id
+            FROM (
+                   SELECT DISTINCT ON (conversation_id)
+                     conversation_id,
+                     id
+                   FROM crowdsourcing_message
+                   ORDER BY conversation_id, created_at DESC, id DESC
+                 ) m
+            WHERE m.conversation_id = c.id;
+
+            UPDATE crowdsourcing_conversationrecipient cr
+            SET unread_count = u.unread
+            FROM (
+                   SELECT
+                     m.conversation_id,
+                     mr.recipient_id,
+                     count(*) unread
+                   FROM crowdsourcing_messagerecipient mr
+                     INNER JOIN crowdsourcing_message m ON m.id = mr.message_id
+                   WHERE mr.status < 3 AND m.sender_id <> mr.recipient_id
+                   GROUP BY m.conversation_id, mr.recipient_id
+                 ) u
+            WHERE u.conversation_id = cr.conversation_id AND u.recipient_id = cr.recipient_id;
+        ''', migrations.RunSQL.noop),
+    ]
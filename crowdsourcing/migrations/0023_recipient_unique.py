@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.3 on 2018-01-30 15:52
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('crowdsourcing', '0022_inbox_read_model'),
+    ]
+
+    operations = [
+        migrations.RunSQL('''
+            DELETE FROM crowdsourcing_conversationrecipient cr
+            USING crowdsourcing_conversationrecipient kept
+            WHERE kept.conversation_id = cr.conversation_id AND kept.recipient_id = cr.recipient_id
+                  AND kept.id < cr.id;
+
+            DELETE FROM crowdsourcing_messagerecipient mr
+            USING crowdsourcing_messagerecipient kept
+            WHERE kept.message_id = mr.message_id AND kept.recipient_id = mr.recipient_id AND kept.id < mr.id;
+        ''', migrations.RunSQL.noop),
+        migrations.AlterUniqueTogether(
+            name='conversationrecipient',
+            unique_together=set([('conversation', 'recipient')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='messagerecipient',
+            unique_together=set([('message', 'recipient')]),
+        ),
+    ]
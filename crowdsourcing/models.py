@@ -266,6 +266,8 @@ class UserPreferences(TimeStampable):
     login_alerts = models.SmallIntegerField(default=0)
     auto_accept = models.BooleanField(default=False)
     new_tasks_notifications = models.BooleanField(default=True)
+    bot_stream_batch_size = models.IntegerField(null=True, blank=True)
+    bot_stream_window = models.IntegerField(default=10)
     aux_attributes = JSONField(default={})
 
 
@@ -663,6 +665,9 @@ class TaskWorkerResult(TimeStampable, Archivable):
     attachment = models.ForeignKey('FileResponse', null=True)
     template_item = models.ForeignKey(TemplateItem, related_name='+')
 
+    class Meta:
+        index_together = (('updated_at', 'id'),)
+
 
 class FileResponse(TimeStampable):
     file = models.FileField(upload_to='responses/%Y/%m/%d/')
@@ -677,6 +682,9 @@ class WorkerProjectScore(TimeStampable):
     mu = models.FloatField(default=25.000)
     sigma = models.FloatField(default=8.333)
 
+    class Meta:
+        unique_together = ('worker', 'project_group_id')
+
 
 class WorkerMatchScore(TimeStampable):
     worker = models.ForeignKey(TaskWorker, related_name='match_scores')
@@ -780,6 +788,16 @@ class RawRatingFeedback(TimeStampable):
         index_together = ('requester', 'worker', 'task', 'is_excluded')
 
 
+class RawRatingFeedbackBounds(TimeStampable):
+    requester = models.ForeignKey(User, related_name='raw_feedback_bounds')
+    project_group_id = models.IntegerField()
+    min_weight = models.FloatField(null=True)
+    max_weight = models.FloatField(null=True)
+
+    class Meta:
+        unique_together = ('requester', 'project_group_id')
+
+
 class BoomerangLog(TimeStampable):
     object_id = models.PositiveIntegerField()
     object_type = models.CharField(max_length=8, default='project')
@@ -792,6 +810,7 @@ class Conversation(TimeStampable, Archivable):
     subject = models.CharField(max_length=64)
     sender = models.ForeignKey(User, related_name='conversations')
     recipients = models.ManyToManyField(User, through='ConversationRecipient')
+    last_message = models.ForeignKey('Message', related_name='+', null=True, on_delete=models.SET_NULL)
 
 
 class ConversationRecipient(TimeStampable, Archivable):
@@ -809,6 +828,10 @@ class ConversationRecipient(TimeStampable, Archivable):
     recipient = models.ForeignKey(User)
     conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE)
     status = models.SmallIntegerField(choices=STATUS, default=STATUS_OPEN)
+    unread_count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('conversation', 'recipient')
 
 
 class Message(TimeStampable, Archivable):
@@ -835,6 +858,9 @@ class MessageRecipient(TimeStampable, Archivable):
     delivered_at = models.DateTimeField(blank=True, null=True)
     read_at = models.DateTimeField(blank=True, null=True)
 
+    class Meta:
+        unique_together = ('message', 'recipient')
+
 
 class EmailNotification(TimeStampable):
     # use updated_at to check last notification sent
@@ -981,3 +1007,71 @@ class WorkerBonus(TimeStampable):
 class ProjectPreview(TimeStampable):
     project = models.ForeignKey('Project')
     user = models.ForeignKey(User)
+
+
+class ProjectGroupRollup(TimeStampable):
+    project_group_id = models.IntegerField(unique=True)
+    project = models.ForeignKey('Project', related_name='+')
+    owner = models.ForeignKey(User, related_name='project_rollups')
+    completed = models.IntegerField(default=0)
+    awaiting_review = models.IntegerField(default=0)
+    checked_out = models.IntegerField(default=0)
+    open_tasks = models.IntegerField(default=0)
+    total = models.IntegerField(default=0)
+
+
+class WorkerProjectEarnings(TimeStampable):
+    worker = models.ForeignKey(User, related_name='project_earnings')
+    project = models.ForeignKey('Project', related_name='+')
+    active = models.IntegerField(default=0)
+    returned = models.IntegerField(default=0)
+    in_progress = models.IntegerField(default=0)
+    accepted = models.IntegerField(default=0)
+    submitted = models.IntegerField(default=0)
+    paid_count = models.IntegerField(default=0)
+    amount_paid = models.DecimalField(decimal_places=2, max_digits=19, default=0)
+    expected_payout_amount = models.DecimalField(decimal_places=2, max_digits=19, default=0)
+    earned = models.DecimalField(decimal_places=2, max_digits=19, default=0)
+    awaiting_payment = models.DecimalField(decimal_places=2, max_digits=19, default=0)
+    expires_at = models.DateTimeField(null=True)
+    last_submitted_at = models.DateTimeField(null=True)
+
+    class Meta:
+        unique_together = ('worker', 'project')
+
+
+class WorkerEarnings(TimeStampable):
+    worker = models.OneToOneField(User, related_name='earnings')
+    earned = models.DecimalField(decimal_places=2, max_digits=19, default=0)
+    awaiting_payment = models.DecimalField(decimal_places=2, max_digits=19, default=0)
+    tasks_completed = models.IntegerField(default=0)
+
+
+class WorkerDailyEarnings(TimeStampable):
+    worker = models.ForeignKey(User, related_name='daily_earnings')
+    day = models.DateField()
+    submitted = models.IntegerField(default=0)
+    accepted = models.IntegerField(default=0)
+    earned = models.DecimalField(decimal_places=2, max_digits=19, default=0)
+
+    class Meta:
+        unique_together = ('worker', 'day')
+
+
+class TaskDurationSketch(TimeStampable):
+    project_group_id = models.IntegerField(unique=True)
+    counts = ArrayField(models.IntegerField())
+
+
+class WorkerTaskDurationSketch(TimeStampable):
+    worker = models.ForeignKey(User, related_name='task_duration_sketches')
+    project_group_id = models.IntegerField()
+    counts = ArrayField(models.IntegerField())
+
+    class Meta:
+        unique_together = ('worker', 'project_group_id')
+
+
+class OutboxEvent(TimeStampable):
+    kind = models.CharField(max_length=16)
+    payload = JSONField()
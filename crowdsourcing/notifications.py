@@ -0,0 +1,127 @@
+"""
+Websocket notifications published through redis pipelines.
+
+RedisPublisher sends a PUBLISH and a SETEX per channel for every message, each its own round trip. A Notifier
+collects messages, merges the audiences of messages with the same facility and body, and sends the whole lot on
+flush() through one pipeline, split every NOTIFICATION_PIPELINE_SIZE commands. Messages recorded by requests go
+through crowdsourcing.outbox and are grouped per drained batch, i.e. over a window of OUTBOX_DRAIN_SECONDS.
+The channel names and expiry follow ws4redis, so subscribers see the same messages RedisPublisher would send.
+
+Requesters whose bots can't keep up with a message per submission register an aggregated bot stream. Their
+submissions are appended to a redis list instead, and crowdsourcing.tasks.flush_bot_streams publishes them as
+BATCH messages of bot_stream_batch_size submissions, or whatever arrived within bot_stream_window seconds.
+The setting lives on UserPreferences, the bot_streams hash only caches it and is filled again from the database.
+"""
+import json
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from ws4redis import settings as ws4redis_settings
+from ws4redis.publisher import redis_connection_pool, StrictRedis
+from ws4redis.redis_store import RedisStore
+
+from crowdsourcing.models import UserPreferences
+from crowdsourcing.redis import RedisProvider
+
+
+class Notifier(object):
+    def __init__(self):
+        self._messages = OrderedDict()
+        self._streams = []
+
+    def add(self, facility, message, users=None, broadcast=False):
+        """
+        Queue a message, message is the serialized string and users are User objects or usernames
+        """
+        audience = self._messages.setdefault((facility, message), {'users': OrderedDict(), 'broadcast': False})
+        for user in users or []:
+            audience['users'][getattr(user, 'username', user)] = True
+        audience['broadcast'] = audience['broadcast'] or broadcast
+        return self
+
+    def stream(self, user_id, submission):
+        """
+        Queue a submission for the aggregated bot stream of requester user_id
+        """
+        self._streams.append((user_id, submission))
+        return self
+
+    def __len__(self):
+        return len(self._messages) + len(self._streams)
+
+    def _commands(self):
+        prefix = RedisStore.get_prefix()
+        for (facility, message), audience in self._messages.items():
+            if audience['broadcast']:
+                yield '{prefix}broadcast:{facility}'.format(prefix=prefix, facility=facility), message
+            for username in audience['users']:
+                yield '{prefix}user:{0}:{facility}'.format(username, prefix=prefix, facility=facility), message
+
+    def flush(self):
+        expire = ws4redis_settings.WS4REDIS_EXPIRE
+        pipeline = StrictRedis(connection_pool=redis_connection_pool).pipeline(transaction=False)
+        pending = 0
+        now = time.time()
+        for user_id, submission in self._streams:
+            pipeline.rpush(bot_stream_key(user_id), json.dumps([now, submission]))
+            pipeline.sadd(settings.BOT_STREAMS_DIRTY_KEY, user_id)
+            pending += 1
+            if pending == settings.NOTIFICATION_PIPELINE_SIZE:
+                pipeline.execute()
+                pending = 0
+        for channel, message in self._commands():
+            pipeline.publish(channel, message)
+            if expire > 0:
+                pipeline.setex(channel, expire, message)
+            pending += 1
+            if pending == settings.NOTIFICATION_PIPELINE_SIZE:
+                pipeline.execute()
+                pending = 0
+        if pending:
+            pipeline.execute()
+        self._messages.clear()
+        self._streams = []
+
+
+def publish(facility, message, users=None, broadcast=False):
+    Notifier().add(facility, message, users=users, broadcast=broadcast).flush()
+
+
+def publish_bulk(facility, messages):
+    """
+    Publish (users, message) pairs, e.g. a personalised message to each of thousands of workers, holding at most
+    NOTIFICATION_PIPELINE_SIZE distinct messages in memory at a time.
+    """
+    notifier = Notifier()
+    for users, message in messages:
+        notifier.add(facility, message, users=users)
+        if len(notifier) == settings.NOTIFICATION_PIPELINE_SIZE:
+            notifier.flush()
+    notifier.flush()
+
+
+def bot_stream_key(user_id):
+    return 'bot_stream:{}'.format(user_id)
+
+
+def set_bot_stream(user_id, batch_size, window):
+    """
+    Cache the bot stream setting of a requester's UserPreferences, a batch_size of None goes back to a message per
+    submission and is cached too, so requesters who haven't opted in don't hit the database on every submission
+    """
+    stream = [batch_size, window] if batch_size else None
+    RedisProvider().set_hash(settings.BOT_STREAMS_KEY, user_id, json.dumps(stream))
+    return stream
+
+
+def get_bot_stream(user_id):
+    """
+    (batch_size, window) of the requester's aggregated bot stream, None when they haven't registered one
+    """
+    value = RedisProvider().get_status(settings.BOT_STREAMS_KEY, user_id)
+    if value is not None:
+        return json.loads(value)
+    preferences = UserPreferences.objects.filter(user_id=user_id).values_list('bot_stream_batch_size',
+                                                                              'bot_stream_window').first()
+    return set_bot_stream(user_id, *(preferences or (None, None)))
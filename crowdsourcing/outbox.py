@@ -0,0 +1,36 @@
+"""
+Side effects of a request, celery tasks to queue and websocket messages to publish, recorded as rows in the
+request's own transaction. crowdsourcing.tasks.drain_outbox sends them in batches once they are committed, so
+nothing is sent for a transaction that rolls back and the request doesn't wait on redis or the broker.
+"""
+from crowdsourcing.models import OutboxEvent
+
+KIND_TASK = 'task'
+KIND_PUBLISH = 'publish'
+KIND_STREAM = 'stream'
+
+
+def delay(task, *args, **kwargs):
+    """
+    Record a call of a celery task, e.g. outbox.delay(update_worker_cache, [worker_id], constants.TASK_SUBMITTED)
+    """
+    OutboxEvent.objects.create(kind=KIND_TASK, payload={'task': task.name, 'args': args, 'kwargs': kwargs})
+
+
+def publish(facility, message, users=None, broadcast=False):
+    """
+    Record a ws4redis message, message is the serialized string and users are User objects or usernames
+    """
+    OutboxEvent.objects.create(kind=KIND_PUBLISH, payload={
+        'facility': facility,
+        'message': message,
+        'users': [getattr(u, 'username', u) for u in users or []],
+        'broadcast': broadcast
+    })
+
+
+def stream(user_id, submission):
+    """
+    Record a submission for the aggregated bot stream of requester user_id, see notifications.set_bot_stream
+    """
+    OutboxEvent.objects.create(kind=KIND_STREAM, payload={'user': user_id, 'submission': submission})
@@ -12,7 +12,7 @@ from rest_framework import serializers
 from crowdsourcing.exceptions import daemo_error
 from crowdsourcing.models import StripeAccount, StripeCustomer, StripeTransfer, StripeCharge, StripeRefund, \
     StripeTransferReversal, WorkerBonus
-from crowdsourcing.utils import is_discount_eligible
+from crowdsourcing.utils import is_discount_eligible, mark_worker_earnings_dirty
 
 
 class Stripe(object):
@@ -301,6 +301,7 @@ class Stripe(object):
         task_worker.is_paid = True
         task_worker.paid_at = timezone.now()
         task_worker.save()
+        mark_worker_earnings_dirty([(task_worker.worker_id, task_worker.task.project_id)])
         # TODO fix balance bug
         if source_charge is None:
             return 'NO_CHARGE_FOUND'
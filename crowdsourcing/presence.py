@@ -0,0 +1,36 @@
+"""
+Who is online, a redis sorted set of user ids scored by the time of their last heartbeat, see UserViewSet.online.
+A user is online for PRESENCE_TIMEOUT_SECONDS after a heartbeat, every heartbeat also trims the members that timed
+out so the set only holds the users seen within the timeout.
+"""
+import time
+
+from django.conf import settings
+
+from crowdsourcing.redis import RedisProvider
+
+
+def heartbeat(user_id):
+    now = time.time()
+    pipeline = RedisProvider().pipeline(transaction=False)
+    pipeline.zadd(settings.PRESENCE_KEY, now, user_id)
+    pipeline.zremrangebyscore(settings.PRESENCE_KEY, '-inf', now - settings.PRESENCE_TIMEOUT_SECONDS)
+    pipeline.execute()
+
+
+def are_online(user_ids):
+    """
+    {user id: is online} for user_ids, read in one round trip
+    """
+    user_ids = list(set(user_ids))
+    if not len(user_ids):
+        return {}
+    since = time.time() - settings.PRESENCE_TIMEOUT_SECONDS
+    pipeline = RedisProvider().pipeline(transaction=False)
+    for user_id in user_ids:
+        pipeline.zscore(settings.PRESENCE_KEY, user_id)
+    return {user_id: score is not None and score >= since for user_id, score in zip(user_ids, pipeline.execute())}
+
+
+def is_online(user_id):
+    return are_online([user_id])[user_id]
@@ -6,7 +6,25 @@ class RedisProvider(object):
         self._connection = StrictRedis(connection_pool=redis_connection_pool)
 
     def set(self, key, value, expire=None):
-        return self._connection.set(name=key, value=value)
+        return self._connection.set(name=key, value=value, ex=expire)
+
+    def incr(self, key):
+        return self._connection.incr(key)
+
+    def delete(self, *keys):
+        return self._connection.delete(*keys)
+
+    def rename(self, key, new_key):
+        return self._connection.rename(key, new_key)
+
+    def lock(self, key, timeout):
+        return self._connection.lock(key, timeout=timeout, blocking_timeout=0)
+
+    def script(self, source):
+        return self._connection.register_script(source)
+
+    def pipeline(self, transaction=True):
+        return self._connection.pipeline(transaction=transaction)
 
     def get(self, key):
         return self._connection.get(name=key)
@@ -23,11 +41,14 @@ class RedisProvider(object):
     def set_scan(self, key, match=None):
         return self._connection.sscan_iter(name=key, match=match)
 
-    def set_add(self, key, values):
-        return self._connection.sadd(key, values)
+    def set_add(self, key, *values):
+        return self._connection.sadd(key, *values)
+
+    def set_random(self, key, count):
+        return self._connection.srandmember(key, count)
 
-    def set_remove(self, key, values):
-        return self._connection.srem(key, values)
+    def set_remove(self, key, *values):
+        return self._connection.srem(key, *values)
 
     def set_hash(self, key, id, value):
         return self._connection.hset(key, id, value)
@@ -53,6 +74,12 @@ class RedisProvider(object):
     def hincrby(self, name, key, amount=1):
         return self._connection.hincrby(name, key, amount)
 
+    def zrangebyscore(self, name, min, max):
+        return self._connection.zrangebyscore(name, min, max)
+
+    def zrem(self, name, *values):
+        return self._connection.zrem(name, *values)
+
     def smembers(self, name):
         return self._connection.smembers(name)
 
@@ -1,11 +1,34 @@
+from collections import OrderedDict
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Manager, prefetch_related_objects
 from rest_framework import serializers
+from rest_framework.relations import MANY_RELATION_KWARGS
+
+
+class BatchListSerializer(serializers.ListSerializer):
+    """
+    A ListSerializer that lets its child resolve batched fields for every instance
+    on the page at once before the rows are serialized one by one.
+    """
+
+    def to_representation(self, data):
+        iterable = list(data.all() if isinstance(data, Manager) else data)
+        self.child.load_batches(iterable)
+        return super(BatchListSerializer, self).to_representation(iterable)
 
 
 class DynamicFieldsModelSerializer(serializers.ModelSerializer):
     """
     A ModelSerializer that takes an additional `fields` argument that
     controls which fields should be displayed.
+
+    Subclasses can map field names to batch resolvers in `batch_resolvers`, a resolver takes the
+    list of instances and returns a dict of values keyed by instance pk. When serialized with
+    a BatchListSerializer each resolver of a requested field runs once per page and the field
+    reads its value back with `get_batched`.
     """
+    batch_resolvers = {}
 
     def __init__(self, *args, **kwargs):
         # Don't pass the 'fields' arg up to the superclass
@@ -13,6 +36,7 @@ class DynamicFieldsModelSerializer(serializers.ModelSerializer):
 
         # Instantiate the superclass normally
         super(DynamicFieldsModelSerializer, self).__init__(*args, **kwargs)
+        self._batches = {}
 
         if fields is not None:
             # Drop any fields that are not specified in the `fields` argument.
@@ -20,3 +44,71 @@ class DynamicFieldsModelSerializer(serializers.ModelSerializer):
             existing = set(self.fields.keys())
             for field_name in existing - allowed:
                 self.fields.pop(field_name)
+
+    def load_batches(self, instances):
+        self._batches = {}
+        if not len(instances):
+            return
+        resolved = {}
+        for field_name, resolver in self.batch_resolvers.items():
+            if field_name not in self.fields:
+                continue
+            if resolver not in resolved:
+                resolved[resolver] = getattr(self, resolver)(instances)
+            self._batches[field_name] = resolved[resolver]
+
+        # nested serializers of a single related object are batched over the related objects of the page
+        for field in self.fields.values():
+            if isinstance(field, DynamicFieldsModelSerializer) and self._is_forward_relation(instances[0], field):
+                prefetch_related_objects(instances, field.source)
+                field.load_batches([getattr(instance, field.source) for instance in instances
+                                    if getattr(instance, field.source) is not None])
+
+    @staticmethod
+    def _is_forward_relation(instance, field):
+        if len(field.source_attrs) != 1:
+            return False
+        try:
+            model_field = instance._meta.get_field(field.source)
+        except FieldDoesNotExist:
+            return False
+        return model_field.concrete and (model_field.many_to_one or model_field.one_to_one)
+
+    def is_batched(self, field_name):
+        return field_name in self._batches
+
+    def get_batched(self, field_name, obj, default=None):
+        return self._batches[field_name].get(obj.pk, default)
+
+
+class BulkManyRelatedField(serializers.ManyRelatedField):
+    """
+    A many relation of primary keys that looks up all of the given keys with one query instead of one per item
+    """
+
+    def to_internal_value(self, data):
+        if isinstance(data, type('')) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail('empty')
+        pks = []
+        for item in data:
+            try:
+                pks.append(int(item))
+            except (TypeError, ValueError):
+                self.child_relation.fail('incorrect_type', data_type=type(item).__name__)
+        instances = self.child_relation.get_queryset().in_bulk(pks)
+        for pk in pks:
+            if pk not in instances:
+                self.child_relation.fail('does_not_exist', pk_value=pk)
+        return [instances[pk] for pk in OrderedDict.fromkeys(pks)]
+
+
+class BulkPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_kwargs = {'child_relation': cls(*args, **kwargs)}
+        for key in kwargs.keys():
+            if key in MANY_RELATION_KWARGS:
+                list_kwargs[key] = kwargs[key]
+        return BulkManyRelatedField(**list_kwargs)
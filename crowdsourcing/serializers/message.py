@@ -1,12 +1,13 @@
 from django.contrib.auth.models import User
-from django.db.models import Q
-from django.utils import timezone
+from django.db import connection, transaction
+from django.db.models import prefetch_related_objects
 from rest_framework import serializers
 
-from crowdsourcing import models
+from crowdsourcing import models, presence
 from crowdsourcing.models import Conversation, Message, ConversationRecipient, MessageRecipient
 from crowdsourcing.redis import RedisProvider
-from crowdsourcing.serializers.dynamic import DynamicFieldsModelSerializer
+from crowdsourcing.serializers.dynamic import DynamicFieldsModelSerializer, BatchListSerializer, \
+    BulkPrimaryKeyRelatedField
 from crowdsourcing.utils import get_relative_time
 
 
@@ -21,12 +22,38 @@ class MessageSerializer(DynamicFieldsModelSerializer):
         read_only_fields = ('created_at', 'updated_at', 'sender')
 
     def create(self, **kwargs):
-        message = Message.objects.create(sender=kwargs['sender'], **self.validated_data)
-
-        for recipient in message.conversation.recipients.all():
-            message_recipient, created = MessageRecipient.objects.get_or_create(recipient=recipient, message=message)
-            message_recipient.delivered_at = timezone.now()
-            message_recipient.save()
+        with transaction.atomic():
+            message = Message.objects.create(sender=kwargs['sender'], **self.validated_data)
+
+            # deliver to every recipient of the conversation and count it as unread for all but the sender
+            # noinspection SqlResolve
+            query = '''
+                WITH recipients AS (
+                    UPDATE crowdsourcing_conversationrecipient
+                    SET unread_count = unread_count + CASE WHEN recipient_id = %(sender_id)s THEN 0 ELSE 1 END
+                    WHERE conversation_id = %(conversation_id)s
+                    RETURNING recipient_id
+                )
+                INSERT INTO crowdsourcing_messagerecipient (created_at, updated_at, message_id, recipient_id, status,
+                                                            delivered_at)
+                  SELECT DISTINCT
+                    now(),
+                    now(),
+                    %(message_id)s,
+                    recipient_id,
+                    %(status)s,
+                    now()
+                  FROM recipients
+                ON CONFLICT (message_id, recipient_id) DO NOTHING;
+            '''
+            cursor = connection.cursor()
+            cursor.execute(query, {'sender_id': message.sender_id, 'conversation_id': message.conversation_id,
+                                   'message_id': message.id, 'status': MessageRecipient.STATUS_SENT})
+            cursor.close()
+
+            # the inbox read model, see ConversationSerializer
+            Conversation.objects.filter(id=message.conversation_id).update(last_message=message,
+                                                                           updated_at=message.created_at)
         return message
 
     def get_time_relative(self, obj):
@@ -38,17 +65,28 @@ class MessageSerializer(DynamicFieldsModelSerializer):
 
 class ConversationSerializer(DynamicFieldsModelSerializer):
     recipient_names = serializers.SerializerMethodField()
-    recipients = serializers.PrimaryKeyRelatedField(queryset=User.objects.all(), many=True)
+    recipients = BulkPrimaryKeyRelatedField(queryset=User.objects.all(), many=True)
     # messages = MessageSerializer(many=True, read_only=True)
     sender = serializers.StringRelatedField()
     is_sender_online = serializers.SerializerMethodField()
     last_message = serializers.SerializerMethodField()
+    unread_count = serializers.SerializerMethodField()
+
+    batch_resolvers = {
+        'is_sender_online': 'resolve_is_sender_online',
+        'unread_count': 'resolve_unread_count'
+    }
 
     class Meta:
         model = models.Conversation
+        list_serializer_class = BatchListSerializer
         fields = ('id', 'subject', 'sender', 'created_at', 'updated_at', 'recipients', 'last_message',
-                  'recipient_names', 'is_sender_online')
-        read_only_fields = ('created_at', 'updated_at', 'sender', 'is_sender_online')
+                  'recipient_names', 'is_sender_online', 'unread_count')
+        read_only_fields = ('created_at', 'updated_at', 'sender', 'is_sender_online', 'unread_count')
+
+    def load_batches(self, instances):
+        prefetch_related_objects(instances, 'sender', 'last_message', 'recipients')
+        super(ConversationSerializer, self).load_batches(instances)
 
     def create(self, **kwargs):
         recipients = self.validated_data.pop('recipients')
@@ -61,12 +99,27 @@ class ConversationSerializer(DynamicFieldsModelSerializer):
             return recipient_obj.first().conversation
 
         conversation = Conversation.objects.create(sender=kwargs['sender'], **self.validated_data)
-        usernames = []
         recipients.append(self.context['request'].user)
-
-        for recipient in recipients:
-            ConversationRecipient.objects.get_or_create(conversation=conversation, recipient=recipient)
-            usernames.append(recipient.username)
+        usernames = [recipient.username for recipient in recipients]
+
+        # noinspection SqlResolve
+        query = '''
+            INSERT INTO crowdsourcing_conversationrecipient (created_at, updated_at, conversation_id, recipient_id,
+                                                             status, unread_count)
+              SELECT
+                now(),
+                now(),
+                %(conversation_id)s,
+                recipient_id,
+                %(status)s,
+                0
+              FROM unnest(%(recipient_ids)s :: INT[]) recipient_id
+            ON CONFLICT (conversation_id, recipient_id) DO NOTHING;
+        '''
+        cursor = connection.cursor()
+        cursor.execute(query, {'conversation_id': conversation.id, 'status': ConversationRecipient.STATUS_OPEN,
+                               'recipient_ids': [recipient.id for recipient in recipients]})
+        cursor.close()
 
         provider = RedisProvider()
         key = provider.build_key('conversation', conversation.id)
@@ -77,35 +130,62 @@ class ConversationSerializer(DynamicFieldsModelSerializer):
 
     def get_recipient_names(self, obj):
         if obj is not None:
-            return obj.recipients.values_list('username', flat=True).filter(
-                ~Q(username=self.context.get('request').user))
+            return [r.username for r in obj.recipients.all() if r.id != self.context.get('request').user.id]
         return []
 
-    @staticmethod
-    def get_last_message(obj):
-        return MessageSerializer(instance=obj.messages.order_by('-created_at').first(),
-                                 fields=('body', 'created_at', 'time_relative')).data
+    def get_last_message(self, obj):
+        return MessageSerializer(instance=obj.last_message, fields=('body', 'created_at', 'time_relative')).data
+
+    def get_unread_count(self, obj):
+        if self.is_batched('unread_count'):
+            return self.get_batched('unread_count', obj, 0)
+        return ConversationRecipient.objects.filter(conversation=obj, recipient=self.context.get('request').user) \
+            .values_list('unread_count', flat=True).first() or 0
+
+    def resolve_unread_count(self, instances):
+        return dict(ConversationRecipient.objects.filter(conversation_id__in=[c.id for c in instances],
+                                                         recipient=self.context.get('request').user)
+                    .values_list('conversation_id', 'unread_count'))
 
     def get_is_sender_online(self, obj):
-        if obj and obj.sender:
-            provider = RedisProvider()
-            return provider.get_status('online', obj.sender.id) > 0
+        if self.is_batched('is_sender_online'):
+            return self.get_batched('is_sender_online', obj)
+        if obj and obj.sender_id:
+            return presence.is_online(obj.sender_id)
         return False
 
+    @staticmethod
+    def resolve_is_sender_online(instances):
+        online = presence.are_online([c.sender_id for c in instances if c.sender_id])
+        return {c.id: online.get(c.sender_id, False) for c in instances}
+
 
 class CommentSerializer(DynamicFieldsModelSerializer):
     sender_alias = serializers.SerializerMethodField()
     posted_time = serializers.SerializerMethodField()
 
+    batch_resolvers = {
+        'sender_alias': 'resolve_sender_alias'
+    }
+
     class Meta:
         model = models.Comment
+        list_serializer_class = BatchListSerializer
         fields = ('id', 'sender', 'body', 'parent', 'deleted_at', 'created_at',
                   'updated_at', 'sender_alias', 'posted_time')
         read_only_fields = ('sender', 'sender_alias', 'posted_time')
 
     def get_sender_alias(self, obj):
+        if self.is_batched('sender_alias'):
+            return self.get_batched('sender_alias', obj)
         return obj.sender.profile.handle
 
+    @staticmethod
+    def resolve_sender_alias(instances):
+        handles = dict(models.UserProfile.objects.filter(user_id__in=set([c.sender_id for c in instances]))
+                       .values_list('user_id', 'handle'))
+        return {c.id: handles.get(c.sender_id) for c in instances}
+
     def get_posted_time(self, obj):
         from crowdsourcing.utils import get_time_delta
         delta = get_time_delta(obj.created_at)
@@ -122,19 +202,14 @@ class RedisMessageSerializer(serializers.Serializer):
 
 
 class ConversationRecipientSerializer(DynamicFieldsModelSerializer):
-    conversation = serializers.SerializerMethodField()
+    conversation = ConversationSerializer(read_only=True)
 
     class Meta:
         model = models.ConversationRecipient
+        list_serializer_class = BatchListSerializer
         fields = ('status', 'id', 'recipient', 'conversation',)
 
     def update(self, *args, **kwargs):
         self.instance.status = self.validated_data.get('status', self.instance.status)
         self.instance.save()
         return self.instance
-
-    def get_conversation(self, obj):
-        if obj is not None:
-            return ConversationSerializer(instance=obj.conversation, context=self.context
-                                          ).data
-        return None
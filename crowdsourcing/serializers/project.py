@@ -3,20 +3,20 @@ from decimal import Decimal
 
 import numpy as np
 from django.db import transaction
-from django.db.models import Q, F
+from django.db.models import Q, F, Count
 from django.utils import timezone
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 
 from crowdsourcing import models
 from crowdsourcing.crypto import to_hash
-from crowdsourcing.serializers.dynamic import DynamicFieldsModelSerializer
+from crowdsourcing.serializers.dynamic import DynamicFieldsModelSerializer, BatchListSerializer
 from crowdsourcing.serializers.file import BatchFileSerializer
 from crowdsourcing.serializers.message import CommentSerializer
 from crowdsourcing.serializers.task import TaskSerializer, TaskCommentSerializer
 from crowdsourcing.serializers.template import TemplateSerializer, TemplateItemSerializer
 from crowdsourcing.tasks import update_project_boomerang
-from crowdsourcing.utils import generate_random_id
+from crowdsourcing.utils import generate_random_id, mark_mturk_hits_dirty
 from crowdsourcing.utils import hash_task
 from crowdsourcing.validators.project import ProjectValidator
 
@@ -61,8 +61,16 @@ class ProjectSerializer(DynamicFieldsModelSerializer):
     last_submitted_at = serializers.DateTimeField(required=False)
     template_id = serializers.IntegerField(required=False, allow_null=True)
 
+    batch_resolvers = {
+        'total_tasks': 'resolve_total_tasks',
+        'revisions': 'resolve_revisions',
+        'review_price': 'resolve_review_price',
+        'has_review': 'resolve_review_price',
+    }
+
     class Meta:
         model = models.Project
+        list_serializer_class = BatchListSerializer
         fields = ('id', 'name', 'description', 'status', 'repetition', 'deadline', 'timeout', 'template',
                   'batch_files', 'deleted_at', 'created_at', 'updated_at', 'price', 'has_data_set',
                   'data_set_location', 'total_tasks', 'file_id', 'age', 'is_micro', 'is_prototype', 'has_review',
@@ -85,11 +93,17 @@ class ProjectSerializer(DynamicFieldsModelSerializer):
         data = super(ProjectSerializer, self).to_representation(instance)
         task_time = int(instance.task_time.total_seconds() / 60) if instance.task_time is not None else None
         timeout = int(instance.timeout.total_seconds() / 60) if instance.timeout is not None else None
-        review_project = models.Project.objects.filter(parent_id=instance.group_id, is_review=True,
-                                                       deleted_at__isnull=True).first()
-        if review_project is not None:
-            review_price = review_project.price
-            data.update({'review_price': review_price})
+        review_field = 'review_price' if 'review_price' in self.fields else 'has_review'
+        if self.is_batched(review_field):
+            review_price = self.get_batched(review_field, instance)
+            if review_price is not None:
+                data.update({'review_price': review_price})
+        elif review_field in self.fields:
+            review_project = models.Project.objects.filter(parent_id=instance.group_id, is_review=True,
+                                                           deleted_at__isnull=True).first()
+            if review_project is not None:
+                review_price = review_project.price
+                data.update({'review_price': review_price})
         # data.update({'has_review': review_project is not None})
         data.update({'task_time': task_time, 'timeout': timeout})
         data.update({'price': instance.price})
@@ -209,10 +223,33 @@ class ProjectSerializer(DynamicFieldsModelSerializer):
         else:
             return get_relative_time(model.published_at)
 
-    @staticmethod
-    def get_total_tasks(obj):
+    def get_total_tasks(self, obj):
+        if self.is_batched('total_tasks'):
+            return self.get_batched('total_tasks', obj, 0)
         return obj.tasks.all().count()
 
+    @staticmethod
+    def resolve_total_tasks(instances):
+        counts = models.Task.objects.values('project_id').filter(
+            project_id__in=[p.id for p in instances]).annotate(count=Count('id'))
+        return {c['project_id']: c['count'] for c in counts}
+
+    @staticmethod
+    def resolve_revisions(instances):
+        revisions = {}
+        for group_id, project_id in models.Project.objects.active().filter(
+                group_id__in=set([p.group_id for p in instances])).order_by('id').values_list('group_id', 'id'):
+            revisions.setdefault(group_id, []).append(project_id)
+        return {p.id: revisions.get(p.group_id, []) for p in instances}
+
+    @staticmethod
+    def resolve_review_price(instances):
+        review_projects = models.Project.objects.values('parent_id', 'price').filter(
+            parent_id__in=set([p.group_id for p in instances]), is_review=True, deleted_at__isnull=True) \
+            .order_by('parent_id', 'id').distinct('parent_id')
+        prices = {r['parent_id']: r['price'] for r in review_projects}
+        return {p.id: prices.get(p.group_id) for p in instances}
+
     @staticmethod
     def get_has_comments(obj):
         return obj.comments.count() > 0
@@ -352,6 +389,10 @@ class ProjectSerializer(DynamicFieldsModelSerializer):
         if status == models.Project.STATUS_IN_PROGRESS and not self.instance.is_paid:
             self.pay(amount_due)
         self.instance.save()
+        if self.instance.post_mturk:
+            # the reconciler only sees the project as in progress once this is committed
+            tasks = models.Task.objects.filter(project=self.instance, exclude_at__isnull=True, deleted_at__isnull=True)
+            transaction.on_commit(lambda: mark_mturk_hits_dirty(tasks.values_list('group_id', flat=True)))
 
     @staticmethod
     def get_relaunch(obj):
@@ -436,8 +477,9 @@ class ProjectSerializer(DynamicFieldsModelSerializer):
         # else:
         #     raise ValidationError('Error in payment')
 
-    @staticmethod
-    def get_revisions(obj):
+    def get_revisions(self, obj):
+        if self.is_batched('revisions'):
+            return self.get_batched('revisions', obj, [])
         return models.Project.objects.active().filter(group_id=obj.group_id).order_by('id').values_list('id',
                                                                                                         flat=True)
 
@@ -535,6 +577,7 @@ class ProjectCommentSerializer(DynamicFieldsModelSerializer):
     comment = CommentSerializer(fields=('id', 'body', 'sender_alias'))
 
     class Meta:
+        list_serializer_class = BatchListSerializer
         model = models.ProjectComment
         fields = ('id', 'project', 'comment', 'ready_for_launch')
         read_only_fields = ('project',)
@@ -1,20 +1,24 @@
 from __future__ import division
 
 import ast
+import copy
 from operator import itemgetter
 
+from django.conf import settings
 from django.db import transaction
-from django.db.models import Q
+from django.db.models import Q, Count, prefetch_related_objects
 from django.utils import timezone
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 
 from crowdsourcing import models
-from crowdsourcing.serializers.dynamic import DynamicFieldsModelSerializer
+from crowdsourcing.crypto import get_hasher
+from crowdsourcing.serializers.dynamic import DynamicFieldsModelSerializer, BatchListSerializer
 from crowdsourcing.serializers.message import CommentSerializer
-from crowdsourcing.serializers.template import TemplateSerializer
+from crowdsourcing.serializers.template import get_compiled_template
 from crowdsourcing.tasks import create_tasks
-from crowdsourcing.utils import get_template_string, hash_task
+from crowdsourcing.utils import get_template_string, render_template_segments, hash_task, \
+    mark_project_rollups_dirty, mark_worker_earnings_dirty
 from crowdsourcing.validators.task import ItemValidator
 
 
@@ -89,8 +93,16 @@ class TaskWorkerSerializer(DynamicFieldsModelSerializer):
     expected = serializers.SerializerMethodField()
     task_group_id = serializers.SerializerMethodField()
 
+    batch_resolvers = {
+        'worker_rating': 'resolve_worker_rating',
+        'expected': 'resolve_expected',
+        'has_comments': 'resolve_has_comments',
+        'return_feedback': 'resolve_return_feedback',
+    }
+
     class Meta:
         model = models.TaskWorker
+        list_serializer_class = BatchListSerializer
         fields = ('id', 'task', 'worker', 'status', 'created_at', 'updated_at',
                   'worker_alias', 'worker_rating', 'results',
                   'updated_delta', 'requester_alias', 'project_data', 'is_paid',
@@ -100,6 +112,70 @@ class TaskWorkerSerializer(DynamicFieldsModelSerializer):
                             'return_feedback', 'task_data', 'expected', 'task_group_id', 'submitted_at',
                             'approved_at', 'project_template', 'attempt')
 
+    def load_batches(self, instances):
+        lookups = ['task__project']
+        if 'worker_alias' in self.fields:
+            lookups.append('worker__profile')
+        if 'requester_alias' in self.fields:
+            lookups.append('task__project__owner__profile')
+        if 'results' in self.fields:
+            lookups.append('results__template_item')
+        prefetch_related_objects(instances, *lookups)
+        super(TaskWorkerSerializer, self).load_batches(instances)
+
+    @staticmethod
+    def resolve_expected(instances):
+        counts = models.TaskWorker.objects.values('task_id').filter(
+            task_id__in=set([tw.task_id for tw in instances]),
+            status__in=[models.TaskWorker.STATUS_ACCEPTED, models.TaskWorker.STATUS_SUBMITTED]
+        ).annotate(count=Count('id'))
+        counts = {c['task_id']: c['count'] for c in counts}
+        return {tw.id: max(counts.get(tw.task_id, 0), tw.task.project.repetition) for tw in instances}
+
+    @staticmethod
+    def resolve_has_comments(instances):
+        commented = set(models.TaskComment.objects.filter(task_id__in=set([tw.task_id for tw in instances]))
+                        .values_list('task_id', flat=True))
+        return {tw.id: tw.task_id in commented for tw in instances}
+
+    @staticmethod
+    def resolve_return_feedback(instances):
+        feedback = models.ReturnFeedback.objects.filter(task_worker_id__in=[tw.id for tw in instances]) \
+            .order_by('task_worker_id', '-created_at').distinct('task_worker_id')
+        feedback = {f.task_worker_id: f for f in feedback}
+        return {tw.id: ReturnFeedbackSerializer(feedback.get(tw.id)).data for tw in instances}
+
+    @staticmethod
+    def resolve_worker_rating(instances):
+        owner_ids = set([tw.task.project.owner_id for tw in instances])
+        worker_ids = set([tw.worker_id for tw in instances])
+        task_ratings = {}
+        ratings = models.Rating.objects.values('id', 'weight', 'origin_id', 'target_id', 'task_id') \
+            .filter(origin_id__in=owner_ids, target_id__in=worker_ids,
+                    task_id__in=set([tw.task_id for tw in instances]),
+                    origin_type=models.Rating.RATING_REQUESTER) \
+            .order_by('origin_id', 'target_id', 'task_id', '-updated_at') \
+            .distinct('origin_id', 'target_id', 'task_id')
+        for r in ratings:
+            task_ratings[(r['origin_id'], r['target_id'], r['task_id'])] = {'id': r['id'], 'weight': r['weight']}
+
+        missing = [tw for tw in instances if (tw.task.project.owner_id, tw.worker_id, tw.task_id) not in task_ratings]
+        latest_ratings = {}
+        if len(missing):
+            ratings = models.Rating.objects.values('id', 'weight', 'origin_id', 'target_id') \
+                .filter(origin_id__in=set([tw.task.project.owner_id for tw in missing]),
+                        target_id__in=set([tw.worker_id for tw in missing])) \
+                .order_by('origin_id', 'target_id', '-updated_at').distinct('origin_id', 'target_id')
+            for r in ratings:
+                latest_ratings[(r['origin_id'], r['target_id'])] = {'id': r['id'], 'weight': r['weight']}
+
+        worker_ratings = {}
+        for tw in instances:
+            owner_id = tw.task.project.owner_id
+            worker_ratings[tw.id] = task_ratings.get((owner_id, tw.worker_id, tw.task_id),
+                                                     latest_ratings.get((owner_id, tw.worker_id)))
+        return worker_ratings
+
     def create(self, **kwargs):
         project = kwargs['project']
         skipped = False
@@ -222,11 +298,13 @@ class TaskWorkerSerializer(DynamicFieldsModelSerializer):
         if task_worker is None:
             return {}, 204
         models.TaskWorkerSession.objects.create(task_worker=task_worker, started_at=timezone.now())
+        mark_project_rollups_dirty([project])
+        mark_worker_earnings_dirty([(kwargs['worker'].id, project)])
         return task_worker, 200
 
     @staticmethod
     def get_project_template(obj):
-        return TemplateSerializer(instance=obj.task.project.template).data
+        return copy.deepcopy(get_compiled_template(obj.task.project.template)['data'])
 
     @staticmethod
     def check_task_qualification(instance):
@@ -259,14 +337,18 @@ class TaskWorkerSerializer(DynamicFieldsModelSerializer):
     def get_worker_alias(obj):
         return obj.worker.profile.handle
 
-    @staticmethod
-    def get_worker_rating(obj):
-        rating = models.Rating.objects.values('id', 'weight') \
-            .filter(origin_id=obj.task.project.owner_id, target_id=obj.worker_id, task_id=obj.task_id,
-                    origin_type=models.Rating.RATING_REQUESTER).order_by('-updated_at').first()
-        if rating is None:
+    def get_worker_rating(self, obj):
+        if self.is_batched('worker_rating'):
+            rating = self.get_batched('worker_rating', obj)
+            rating = dict(rating) if rating is not None else None
+        else:
             rating = models.Rating.objects.values('id', 'weight') \
-                .filter(origin_id=obj.task.project.owner_id, target_id=obj.worker_id).order_by('-updated_at').first()
+                .filter(origin_id=obj.task.project.owner_id, target_id=obj.worker_id, task_id=obj.task_id,
+                        origin_type=models.Rating.RATING_REQUESTER).order_by('-updated_at').first()
+            if rating is None:
+                rating = models.Rating.objects.values('id', 'weight') \
+                    .filter(origin_id=obj.task.project.owner_id, target_id=obj.worker_id) \
+                    .order_by('-updated_at').first()
         if rating is None:
             rating = {
                 'id': None,
@@ -291,12 +373,14 @@ class TaskWorkerSerializer(DynamicFieldsModelSerializer):
         return {'id': obj.task.project.id, 'name': obj.task.project.name, 'price': obj.task.project.price,
                 'discussion_link': obj.task.project.discussion_link}
 
-    @staticmethod
-    def get_has_comments(obj):
+    def get_has_comments(self, obj):
+        if self.is_batched('has_comments'):
+            return self.get_batched('has_comments', obj)
         return obj.task.comments.count() > 0
 
-    @staticmethod
-    def get_return_feedback(obj):
+    def get_return_feedback(self, obj):
+        if self.is_batched('return_feedback'):
+            return self.get_batched('return_feedback', obj)
         return ReturnFeedbackSerializer(obj.return_feedback.first()).data
 
     @staticmethod
@@ -307,8 +391,9 @@ class TaskWorkerSerializer(DynamicFieldsModelSerializer):
     def get_task_group_id(obj):
         return obj.task.group_id
 
-    @staticmethod
-    def get_expected(obj):
+    def get_expected(self, obj):
+        if self.is_batched('expected'):
+            return self.get_batched('expected', obj)
         return max(models.TaskWorker.objects.filter(task_id=obj.task_id,
                                                     status__in=[models.TaskWorker.STATUS_ACCEPTED,
                                                                 models.TaskWorker.STATUS_SUBMITTED]).count(),
@@ -326,6 +411,7 @@ class TaskCommentSerializer(DynamicFieldsModelSerializer):
     comment = CommentSerializer()
 
     class Meta:
+        list_serializer_class = BatchListSerializer
         model = models.TaskComment
         fields = ('id', 'task', 'comment')
         read_only_fields = ('task',)
@@ -394,21 +480,20 @@ class TaskSerializer(DynamicFieldsModelSerializer):
 
     def get_template(self, obj, return_type='full'):
         task_worker = None
-        if return_type == 'full':
-            template = TemplateSerializer(instance=obj.project.template, many=False).data
-        else:
-            template = \
-                TemplateSerializer(instance=obj.project.template, many=False, fields=('id', 'items')).data
+        compiled = get_compiled_template(obj.project.template)
+        template = copy.deepcopy(compiled['data'])
+        if return_type != 'full':
+            template.pop('name', None)
         data = obj.data
         if 'task_worker' in self.context:
             task_worker = self.context['task_worker']
-        for item in template['items']:
+        for item, segments in zip(template['items'], compiled['segments']):
             aux_attrib = item['aux_attributes']
             if 'src' in aux_attrib:
-                aux_attrib['src'] = get_template_string(aux_attrib['src'], data)[0]
+                aux_attrib['src'] = render_template_segments(segments['src'], data)[0]
 
             if 'question' in aux_attrib:
-                return_value, has_variables = get_template_string(aux_attrib['question']['value'], data)
+                return_value, has_variables = render_template_segments(segments['question'], data)
                 aux_attrib['question']['value'] = return_value
                 aux_attrib['question']['is_static'] = not has_variables
 
@@ -428,15 +513,15 @@ class TaskSerializer(DynamicFieldsModelSerializer):
                                 "position": index + 1
                             }
                         )
-                for option in aux_attrib['options']:
-                    option['value'] = get_template_string(option['value'], data)[0]
+                    for option in aux_attrib['options']:
+                        option['value'] = get_template_string(option['value'], data)[0]
+                else:
+                    for option, option_segments in zip(aux_attrib['options'], segments['options']):
+                        option['value'] = render_template_segments(option_segments, data)[0]
 
             if item['type'] == 'iframe':
-                from django.conf import settings
-                from hashids import Hashids
-                identifier = Hashids(salt=settings.SECRET_KEY, min_length=settings.ID_HASH_MIN_LENGTH)
                 if hasattr(task_worker, 'id'):
-                    item['identifier'] = identifier.encode(task_worker.id, task_worker.task.id, item['id'])
+                    item['identifier'] = get_hasher().encode(task_worker.id, task_worker.task.id, item['id'])
                 else:
                     item['identifier'] = 'READ_ONLY'
                 item['daemo_post_url'] = settings.SITE_HOST + '/api/done/'
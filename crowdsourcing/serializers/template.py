@@ -1,11 +1,14 @@
 import copy
+from collections import OrderedDict
 
+from django.conf import settings
+from django.utils import timezone
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 
 from crowdsourcing import models
 from crowdsourcing.serializers.dynamic import DynamicFieldsModelSerializer
-from crowdsourcing.utils import create_copy
+from crowdsourcing.utils import create_copy, compile_template_string
 
 
 class TemplateItemSerializer(DynamicFieldsModelSerializer):
@@ -22,8 +25,19 @@ class TemplateItemSerializer(DynamicFieldsModelSerializer):
         if item.type in ['radio', 'checkbox', 'select_list', 'file_upload', 'text']:
             item.role = models.TemplateItem.ROLE_INPUT
         item.save()
+        self.touch_template(item.template_id)
         return item
 
+    def update(self, instance, validated_data):
+        item = super(TemplateItemSerializer, self).update(instance, validated_data)
+        self.touch_template(item.template_id)
+        return item
+
+    @staticmethod
+    def touch_template(template_id):
+        # compiled templates are cached per template revision, which is tracked by the template's updated_at
+        models.Template.objects.filter(id=template_id).update(updated_at=timezone.now())
+
     @staticmethod
     def create_revision(instance, template):
         instance.template = template
@@ -36,6 +50,7 @@ class TemplateItemSerializer(DynamicFieldsModelSerializer):
             if item.predecessor is not None:
                 item.predecessor = items.filter(group_id=item.predecessor.group_id).first()
                 item.save()
+        TemplateItemSerializer.touch_template(template.id)
 
 
 class TemplateSerializer(DynamicFieldsModelSerializer):
@@ -152,6 +167,42 @@ class TemplateSerializer(DynamicFieldsModelSerializer):
         return template
 
 
+_compiled_templates = OrderedDict()
+
+
+def _compile_item(item):
+    aux_attrib = item['aux_attributes']
+    segments = {}
+    if 'src' in aux_attrib:
+        segments['src'] = compile_template_string(aux_attrib['src'])
+    if 'question' in aux_attrib:
+        segments['question'] = compile_template_string(aux_attrib['question']['value'])
+    if 'options' in aux_attrib:
+        segments['options'] = [compile_template_string(option['value']) for option in aux_attrib['options']]
+    return segments
+
+
+def get_compiled_template(template):
+    """
+    Serialize a template and parse the variables out of its items once per template revision.
+
+    Returns a dict with the serialized template under `data`, which callers must copy before modifying,
+    and the parsed segments of each item under `segments`. Entries are kept in a per process LRU.
+    """
+    compiled = _compiled_templates.pop(template.id, None)
+    if compiled is None or compiled['revision'] != template.updated_at:
+        data = copy.deepcopy(TemplateSerializer(instance=template).data)
+        compiled = {
+            'revision': template.updated_at,
+            'data': data,
+            'segments': [_compile_item(item) for item in data['items']]
+        }
+    _compiled_templates[template.id] = compiled
+    while len(_compiled_templates) > settings.TEMPLATE_RENDER_CACHE_SIZE:
+        _compiled_templates.popitem(last=False)
+    return compiled
+
+
 class TemplateItemPropertiesSerializer(serializers.ModelSerializer):
     class Meta:
         model = models.TemplateItemProperties
@@ -14,6 +14,7 @@ from crowdsourcing import constants
 from crowdsourcing import models
 from crowdsourcing.discourse import DiscourseClient
 from crowdsourcing.emails import send_password_reset_email, send_activation_email
+from crowdsourcing.notifications import set_bot_stream
 from crowdsourcing.serializers.dynamic import DynamicFieldsModelSerializer
 from crowdsourcing.serializers.payment import FinancialAccountSerializer
 from crowdsourcing.serializers.utils import AddressSerializer, CurrencySerializer, LanguageSerializer, \
@@ -375,11 +376,15 @@ class UserPreferencesSerializer(serializers.ModelSerializer):
     currency = CurrencySerializer(required=False)
     language = LanguageSerializer(required=False)
     auto_accept = serializers.BooleanField(required=False)
+    bot_stream_batch_size = serializers.IntegerField(required=False, allow_null=True, min_value=1,
+                                                     max_value=settings.BOT_STREAM_MAX_BATCH_SIZE)
+    bot_stream_window = serializers.IntegerField(required=False, min_value=1,
+                                                 max_value=settings.BOT_STREAM_MAX_WINDOW)
 
     class Meta:
         model = models.UserPreferences
         fields = ('user', 'language', 'currency', 'login_alerts', 'auto_accept', 'new_tasks_notifications',
-                  'aux_attributes')
+                  'bot_stream_batch_size', 'bot_stream_window', 'aux_attributes')
 
     def create(self, **kwargs):
         currency_data = self.validated_data.pop('currency')
@@ -403,5 +408,9 @@ class UserPreferencesSerializer(serializers.ModelSerializer):
         self.instance.auto_accept = self.validated_data.get('auto_accept', self.instance.auto_accept)
         self.instance.new_tasks_notifications = self.validated_data.get('new_tasks_notifications',
                                                                         self.instance.new_tasks_notifications)
+        self.instance.bot_stream_batch_size = self.validated_data.get('bot_stream_batch_size',
+                                                                      self.instance.bot_stream_batch_size)
+        self.instance.bot_stream_window = self.validated_data.get('bot_stream_window', self.instance.bot_stream_window)
         self.instance.save()
+        set_bot_stream(self.instance.user_id, self.instance.bot_stream_batch_size, self.instance.bot_stream_window)
         return self.instance
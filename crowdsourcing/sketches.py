@@ -0,0 +1,37 @@
+"""
+Log bucketed histograms of task durations.
+
+A sketch is a fixed length list of counts, bucket i holds the durations in (2 ** ((i - 1) / SCALE), 2 ** (i / SCALE)]
+seconds, bucket 0 everything up to a second and the last bucket everything above 2 ** MAX_EXPONENT seconds. Sketches
+merge and subtract bucket by bucket, and a quantile read back from one is within half a bucket, about 4.5%, of the
+exact value. The buckets are filled in SQL by crowdsourcing.tasks.record_task_duration.
+"""
+from __future__ import division
+
+SCALE = 8
+MAX_EXPONENT = 20
+NUM_BUCKETS = SCALE * MAX_EXPONENT + 1
+
+
+def empty():
+    return [0] * NUM_BUCKETS
+
+
+def subtract(counts, other):
+    return [max(a - b, 0) for a, b in zip(counts or empty(), other or empty())]
+
+
+def quantile(counts, q):
+    """
+    Seconds at quantile q of the sketch, the geometric middle of the bucket holding that rank, None when empty.
+    """
+    total = sum(counts or [])
+    if not total:
+        return None
+    rank = q * (total - 1)
+    seen = 0
+    for i, count in enumerate(counts):
+        seen += count
+        if seen > rank:
+            return 2 ** (max(i - 0.5, 0) / SCALE)
+    return 2 ** MAX_EXPONENT
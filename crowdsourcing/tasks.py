@@ -1,6 +1,7 @@
 from __future__ import division
 
 import json
+import time
 from collections import OrderedDict
 from datetime import timedelta
 from decimal import Decimal, ROUND_UP
@@ -11,17 +12,15 @@ from django.contrib.auth.models import User
 from django.db import connection, transaction
 from django.db.models import F, Q
 from django.utils import timezone
-from ws4redis.publisher import RedisPublisher
-from ws4redis.redis_store import RedisMessage
 
 import constants
-from crowdsourcing import models
+from crowdsourcing import models, notifications, outbox, sketches
 from crowdsourcing.crypto import to_hash
 from crowdsourcing.emails import send_notifications_email, send_new_tasks_email, send_task_returned_email, \
     send_task_rejected_email, send_project_completed
 from crowdsourcing.payment import Stripe
 from crowdsourcing.redis import RedisProvider
-from crowdsourcing.utils import hash_task
+from crowdsourcing.utils import hash_task, mark_project_rollups_dirty, mark_worker_earnings_dirty
 from csp.celery import app as celery_app
 from mturk.tasks import get_provider
 
@@ -37,6 +36,7 @@ def _expire_returned_tasks():
             FROM (
                    SELECT
                      tw.id,
+                     t.project_id,
                      CASE WHEN EXTRACT(DOW FROM now()) <= %(dow)s
                        THEN tw.returned_at + INTERVAL %(exp_days)s
                      ELSE tw.returned_at END returned_at
@@ -48,7 +48,7 @@ def _expire_returned_tasks():
         UPDATE crowdsourcing_taskworker tw_up SET status=%(expired)s, updated_at=now()
             FROM task_workers
             WHERE task_workers.id=tw_up.id
-            RETURNING tw_up.id, tw_up.worker_id
+            RETURNING tw_up.id, tw_up.worker_id, task_workers.project_id
 
     '''
     cursor = connection.cursor()
@@ -69,6 +69,8 @@ def _expire_returned_tasks():
         task_workers.append({'id': w[0]})
     refund_task.delay(task_workers)
     update_worker_cache.delay(worker_list, constants.TASK_EXPIRED)
+    mark_project_rollups_dirty([w[2] for w in workers])
+    mark_worker_earnings_dirty([(w[1], w[2]) for w in workers])
     return 'SUCCESS'
 
 
@@ -92,7 +94,7 @@ def expire_tasks():
                 UPDATE crowdsourcing_taskworker tw_up SET status=%(expired)s
             FROM taskworkers
             WHERE taskworkers.id=tw_up.id
-            RETURNING tw_up.id, tw_up.worker_id
+            RETURNING tw_up.id, tw_up.worker_id, taskworkers.project_id
         '''
     cursor.execute(query,
                    {'in_progress': models.TaskWorker.STATUS_IN_PROGRESS, 'expired': models.TaskWorker.STATUS_EXPIRED})
@@ -105,6 +107,8 @@ def expire_tasks():
         task_workers.append({'id': w[0]})
     refund_task.delay(task_workers)
     update_worker_cache.delay(worker_list, constants.TASK_EXPIRED)
+    mark_project_rollups_dirty([w[2] for w in workers])
+    mark_worker_earnings_dirty([(w[1], w[2]) for w in workers])
     _expire_returned_tasks()
 
     return 'SUCCESS'
@@ -142,7 +146,7 @@ def auto_approve_tasks():
         FROM taskworkers
         WHERE taskworkers.id=tw_up.id
         RETURNING tw_up.id, tw_up.worker_id, taskworkers.task_id, taskworkers.user_id, taskworkers.username,
-        taskworkers.project_gid, taskworkers.worker_username
+        taskworkers.project_gid, taskworkers.worker_username, taskworkers.project_id
     '''
     cursor.execute(query,
                    {'submitted': models.TaskWorker.STATUS_SUBMITTED,
@@ -150,13 +154,15 @@ def auto_approve_tasks():
                     'approved_at': now,
                     'auto_approve_freq': '{} hour'.format(settings.AUTO_APPROVE_FREQ)})
     task_workers = cursor.fetchall()
+    mark_project_rollups_dirty([w[7] for w in task_workers])
+    mark_worker_earnings_dirty([(w[1], w[7]) for w in task_workers])
+    notifier = notifications.Notifier()
     for w in task_workers:
-        task_workers.append({'id': w[0]})
         post_approve.delay(w[2], 1)
-        redis_publisher = RedisPublisher(facility='notifications', users=[w[4], w[6]])
-        message = RedisMessage(
-            json.dumps({"event": 'TASK_APPROVED', "project_gid": w[5], "project_key": to_hash(w[5])}))
-        redis_publisher.publish_message(message)
+        notifier.add('notifications',
+                     json.dumps({"event": 'TASK_APPROVED', "project_gid": w[5], "project_key": to_hash(w[5])}),
+                     users=[w[4], w[6]])
+    notifier.flush()
     cursor.close()
     return 'SUCCESS'
 
@@ -258,6 +264,7 @@ def create_tasks(self, tasks):
                 task_obj.append(t)
             models.Task.objects.bulk_create(task_obj)
             models.Task.objects.filter(project_id=tasks[0]['project_id']).update(group_id=F('id'))
+        mark_project_rollups_dirty([tasks[0]['project_id']])
     except Exception as e:
         self.retry(countdown=4, exc=e, max_retries=2)
 
@@ -290,6 +297,7 @@ def create_tasks_for_project(self, project_id, file_deleted):
         # price_data = models.Task.objects.filter(project_id=project_id, price__isnull=False).values_list('price',
         #                                                                                                 flat=True)
         _set_aux_attributes(project, [])
+        mark_project_rollups_dirty([project.id])
         return 'SUCCESS'
     try:
         with transaction.atomic():
@@ -315,6 +323,7 @@ def create_tasks_for_project(self, project_id, file_deleted):
             _set_aux_attributes(project, price_data)
             models.Task.objects.filter(project_id=project_id, group_id__isnull=True) \
                 .update(group_id=F('id'))
+        mark_project_rollups_dirty([project.id])
     except Exception as e:
         self.retry(countdown=4, exc=e, max_retries=2)
 
@@ -733,3 +742,629 @@ def post_to_discourse(project_id):
             except Exception as e:
                 print(e)
                 print 'failed to update post'
+
+
+# noinspection SqlResolve
+PROJECT_ROLLUPS_QUERY = '''
+    WITH groups AS (
+        SELECT DISTINCT group_id
+        FROM crowdsourcing_project
+        WHERE %(all_groups)s OR id = ANY(%(project_ids)s :: INTEGER [])
+    ), fresh AS (
+        SELECT
+          p_max.group_id project_group_id,
+          p_max.id project_id,
+          p0.owner_id,
+          sum(completed) completed,
+          sum(awaiting_review) awaiting_review,
+          sum(checked_out) checked_out,
+          greatest((p0.repetition * count(DISTINCT task_id)) - sum(completed) -
+                   sum(awaiting_review), 0) - sum(checked_out) open_tasks,
+          p0.repetition * count(DISTINCT task_id) total
+        FROM (
+               SELECT
+                 p.group_id,
+                 t.group_id task_id,
+                 CASE WHEN tw.status in (1, 5)
+                   THEN 1
+                 ELSE 0 END checked_out,
+                 CASE WHEN tw.status = 3
+                   THEN 1
+                 ELSE 0 END completed,
+                 CASE WHEN tw.status = 2
+                   THEN 1
+                 ELSE 0 END awaiting_review
+               FROM crowdsourcing_project p
+                 INNER JOIN groups g ON g.group_id = p.group_id
+                 LEFT OUTER JOIN crowdsourcing_task t ON t.project_id = p.id
+                   AND t.deleted_at IS NULL and t.exclude_at is null
+                 LEFT OUTER JOIN crowdsourcing_taskworker tw ON tw.task_id = t.id
+               WHERE p.deleted_at IS NULL AND is_review = FALSE) c
+          INNER JOIN (SELECT
+                        p.group_id,
+                        max(p.id) id
+                      FROM crowdsourcing_project p
+                        INNER JOIN groups g ON g.group_id = p.group_id
+                      GROUP BY p.group_id) p_max
+            ON c.group_id = p_max.group_id
+          INNER JOIN crowdsourcing_project p0 ON p0.id = p_max.id
+        GROUP BY p_max.group_id, p_max.id, p0.owner_id, p0.repetition
+    ), drifted AS (
+        SELECT count(*) drifted
+        FROM fresh f
+          LEFT OUTER JOIN crowdsourcing_projectgrouprollup r ON r.project_group_id = f.project_group_id
+        WHERE r.id IS NULL OR (r.project_id, r.completed, r.awaiting_review, r.checked_out, r.open_tasks, r.total)
+                              <> (f.project_id, f.completed, f.awaiting_review, f.checked_out, f.open_tasks, f.total)
+    ), upserted AS (
+        INSERT INTO crowdsourcing_projectgrouprollup (created_at, updated_at, project_group_id, project_id, owner_id,
+                                                      completed, awaiting_review, checked_out, open_tasks, total)
+          SELECT
+            now(),
+            now(),
+            project_group_id,
+            project_id,
+            owner_id,
+            completed,
+            awaiting_review,
+            checked_out,
+            open_tasks,
+            total
+          FROM fresh
+        ON CONFLICT (project_group_id)
+          DO UPDATE SET project_id    = excluded.project_id, owner_id = excluded.owner_id,
+            completed                 = excluded.completed, awaiting_review = excluded.awaiting_review,
+            checked_out               = excluded.checked_out, open_tasks = excluded.open_tasks,
+            total                     = excluded.total, updated_at = now()
+        RETURNING project_group_id
+    ), removed AS (
+        DELETE FROM crowdsourcing_projectgrouprollup r
+        USING groups g
+        WHERE r.project_group_id = g.group_id
+              AND r.project_group_id NOT IN (SELECT project_group_id FROM fresh)
+        RETURNING r.project_group_id
+    )
+    SELECT
+      (SELECT drifted FROM drifted),
+      (SELECT count(*) FROM upserted),
+      (SELECT count(*) FROM removed);
+'''
+
+
+def refresh_project_rollups(project_ids=None):
+    """
+    Recompute the dashboard rollups of the project groups of project_ids, or of every group when None.
+    Returns the number of groups whose rollup was missing or out of date.
+    """
+    if project_ids is not None and not len(project_ids):
+        return 0
+    cursor = connection.cursor()
+    cursor.execute(PROJECT_ROLLUPS_QUERY, {'all_groups': project_ids is None,
+                                           'project_ids': [int(p) for p in project_ids or []]})
+    drifted, _, _ = cursor.fetchone()
+    cursor.close()
+    return drifted
+
+
+def _take_dirty_set(provider, key):
+    """
+    Move a dirty set out of the way of new marks, the members are only dropped by deleting the returned key once
+    they were refreshed, so a set left behind by a failed run is taken first by the next one
+    """
+    flushing = key + ':flushing'
+    if not provider.exists(flushing):
+        if not provider.exists(key):
+            return None
+        provider.rename(key, flushing)
+    return flushing
+
+
+@celery_app.task(ignore_result=True)
+def flush_project_rollups():
+    provider = RedisProvider()
+    # ids marked while the refresh runs go into a new set for the next run
+    key = _take_dirty_set(provider, settings.PROJECT_ROLLUPS_DIRTY_KEY)
+    if key is None:
+        return 'SUCCESS'
+    refresh_project_rollups(list(provider.smembers(key)))
+    provider.delete(key)
+    return 'SUCCESS'
+
+
+@celery_app.task(ignore_result=True)
+def check_project_rollups():
+    drifted = refresh_project_rollups()
+    if drifted:
+        print('%d project rollups were out of date' % drifted)
+    return 'SUCCESS'
+
+
+# noinspection SqlResolve
+WORKER_PROJECT_EARNINGS_QUERY = '''
+    WITH pairs AS (
+        SELECT *
+        FROM unnest(%(worker_ids)s :: INTEGER [], %(project_ids)s :: INTEGER []) pr (worker_id, project_id)
+    ), fresh AS (
+        SELECT
+          tw.worker_id,
+          t.project_id,
+          sum(CASE WHEN tw.status NOT IN (%(skipped)s, %(expired)s)
+            THEN 1
+              ELSE 0 END) active,
+          sum(CASE WHEN tw.status = %(returned)s
+            THEN 1
+              ELSE 0 END) returned,
+          sum(CASE WHEN tw.status = %(in_progress)s
+            THEN 1
+              ELSE 0 END) in_progress,
+          sum(CASE WHEN tw.status = %(accepted)s
+            THEN 1
+              ELSE 0 END) accepted,
+          sum(CASE WHEN tw.status = %(submitted)s
+            THEN 1
+              ELSE 0 END) submitted,
+          sum(CASE WHEN tw.status NOT IN (%(skipped)s, %(expired)s) AND tw.is_paid IS TRUE
+            THEN 1
+              ELSE 0 END) paid_count,
+          sum(CASE WHEN tw.status = %(accepted)s
+            THEN coalesce(t.price, p.price)
+              ELSE 0 END) amount_paid,
+          sum(CASE WHEN tw.status NOT IN (%(skipped)s, %(expired)s)
+            THEN coalesce(t.price, p.price)
+              ELSE 0 END) expected_payout_amount,
+          sum(CASE WHEN tw.is_paid IS TRUE
+            THEN p.price
+              ELSE 0 END) earned,
+          sum(CASE WHEN tw.status = %(accepted)s AND tw.is_paid IS FALSE
+            THEN p.price
+              ELSE 0 END) awaiting_payment,
+          min(CASE WHEN tw.status NOT IN (%(skipped)s, %(expired)s)
+            THEN coalesce(tw.started_at, tw.created_at) + coalesce(p.timeout, INTERVAL %(default_timeout)s) END)
+            expires_at,
+          max(CASE WHEN tw.status NOT IN (%(skipped)s, %(expired)s)
+            THEN tw.submitted_at END) last_submitted_at
+        FROM crowdsourcing_taskworker tw
+          INNER JOIN crowdsourcing_task t ON tw.task_id = t.id
+          INNER JOIN crowdsourcing_project p ON p.id = t.project_id
+        WHERE %(all_workers)s OR (tw.worker_id, t.project_id) IN (SELECT worker_id, project_id FROM pairs)
+        GROUP BY tw.worker_id, t.project_id
+    ), upserted AS (
+        INSERT INTO crowdsourcing_workerprojectearnings (created_at, updated_at, worker_id, project_id, active,
+                                                         returned, in_progress, accepted, submitted, paid_count,
+                                                         amount_paid, expected_payout_amount, earned,
+                                                         awaiting_payment, expires_at, last_submitted_at)
+          SELECT
+            now(),
+            now(),
+            worker_id,
+            project_id,
+            active,
+            returned,
+            in_progress,
+            accepted,
+            submitted,
+            paid_count,
+            coalesce(amount_paid, 0),
+            coalesce(expected_payout_amount, 0),
+            coalesce(earned, 0),
+            coalesce(awaiting_payment, 0),
+            expires_at,
+            last_submitted_at
+          FROM fresh
+        ON CONFLICT (worker_id, project_id)
+          DO UPDATE SET active    = excluded.active, returned = excluded.returned,
+            in_progress           = excluded.in_progress, accepted = excluded.accepted,
+            submitted             = excluded.submitted, paid_count = excluded.paid_count,
+            amount_paid           = excluded.amount_paid, expected_payout_amount = excluded.expected_payout_amount,
+            earned                = excluded.earned, awaiting_payment = excluded.awaiting_payment,
+            expires_at            = excluded.expires_at, last_submitted_at = excluded.last_submitted_at,
+            updated_at            = now()
+        RETURNING worker_id
+    )
+    DELETE FROM crowdsourcing_workerprojectearnings e
+    USING pairs
+    WHERE e.worker_id = pairs.worker_id AND e.project_id = pairs.project_id
+          AND (e.worker_id, e.project_id) NOT IN (SELECT worker_id, project_id FROM fresh);
+'''
+
+# noinspection SqlResolve
+WORKER_EARNINGS_QUERY = '''
+    INSERT INTO crowdsourcing_workerearnings (created_at, updated_at, worker_id, earned, awaiting_payment,
+                                              tasks_completed)
+      SELECT
+        now(),
+        now(),
+        worker_id,
+        sum(earned),
+        sum(awaiting_payment),
+        sum(accepted + submitted)
+      FROM crowdsourcing_workerprojectearnings
+      WHERE %(all_workers)s OR worker_id = ANY(%(worker_ids)s :: INTEGER [])
+      GROUP BY worker_id
+    ON CONFLICT (worker_id)
+      DO UPDATE SET earned = excluded.earned, awaiting_payment = excluded.awaiting_payment,
+        tasks_completed    = excluded.tasks_completed, updated_at = now();
+'''
+
+# noinspection SqlResolve
+WORKER_DAILY_EARNINGS_QUERY = '''
+    WITH days AS (
+        SELECT DISTINCT
+          tw.worker_id,
+          tw.submitted_at :: DATE AS day
+        FROM crowdsourcing_taskworker tw
+          INNER JOIN crowdsourcing_task t ON tw.task_id = t.id
+        WHERE tw.submitted_at IS NOT NULL
+              AND (%(all_workers)s OR (tw.worker_id, t.project_id) IN (
+          SELECT *
+          FROM unnest(%(worker_ids)s :: INTEGER [], %(project_ids)s :: INTEGER [])))
+    )
+    INSERT INTO crowdsourcing_workerdailyearnings (created_at, updated_at, worker_id, day, submitted, accepted,
+                                                   earned)
+      SELECT
+        now(),
+        now(),
+        d.worker_id,
+        d.day,
+        sum(CASE WHEN tw.status IN (%(submitted)s, %(accepted)s)
+          THEN 1
+            ELSE 0 END),
+        sum(CASE WHEN tw.status = %(accepted)s
+          THEN 1
+            ELSE 0 END),
+        coalesce(sum(CASE WHEN tw.status = %(accepted)s
+          THEN coalesce(t.price, p.price)
+                     ELSE 0 END), 0)
+      FROM days d
+        INNER JOIN crowdsourcing_taskworker tw ON tw.worker_id = d.worker_id
+                                                  AND tw.submitted_at >= d.day
+                                                  AND tw.submitted_at < d.day + 1
+        INNER JOIN crowdsourcing_task t ON tw.task_id = t.id
+        INNER JOIN crowdsourcing_project p ON p.id = t.project_id
+      GROUP BY d.worker_id, d.day
+    ON CONFLICT (worker_id, day)
+      DO UPDATE SET submitted = excluded.submitted, accepted = excluded.accepted, earned = excluded.earned,
+        updated_at            = now();
+'''
+
+
+def refresh_worker_earnings(pairs=None):
+    """
+    Recompute the earnings rollups of the given (worker id, project id) pairs, or of every worker when None.
+    """
+    if pairs is not None and not len(pairs):
+        return
+    pairs = [(int(w), int(p)) for w, p in pairs or []]
+    params = {
+        'all_workers': not len(pairs),
+        'worker_ids': [w for w, _ in pairs],
+        'project_ids': [p for _, p in pairs],
+        'skipped': models.TaskWorker.STATUS_SKIPPED,
+        'expired': models.TaskWorker.STATUS_EXPIRED,
+        'in_progress': models.TaskWorker.STATUS_IN_PROGRESS,
+        'returned': models.TaskWorker.STATUS_RETURNED,
+        'accepted': models.TaskWorker.STATUS_ACCEPTED,
+        'submitted': models.TaskWorker.STATUS_SUBMITTED,
+        'default_timeout': '24 hour'
+    }
+    cursor = connection.cursor()
+    cursor.execute(WORKER_PROJECT_EARNINGS_QUERY, params)
+    cursor.execute(WORKER_EARNINGS_QUERY, params)
+    cursor.execute(WORKER_DAILY_EARNINGS_QUERY, params)
+    cursor.close()
+
+
+@celery_app.task(ignore_result=True)
+def flush_worker_earnings():
+    provider = RedisProvider()
+    key = _take_dirty_set(provider, settings.WORKER_EARNINGS_DIRTY_KEY)
+    if key is None:
+        return 'SUCCESS'
+    refresh_worker_earnings([m.split(':') for m in provider.smembers(key)])
+    provider.delete(key)
+    return 'SUCCESS'
+
+
+@celery_app.task(ignore_result=True)
+def check_worker_earnings():
+    refresh_worker_earnings()
+    return 'SUCCESS'
+
+
+# noinspection SqlResolve
+TASK_DURATION_QUERY = '''
+    WITH duration AS (
+        SELECT
+          p.group_id,
+          tw.worker_id,
+          least(greatest(ceil(%(scale)s * log(2, greatest(extract(EPOCH FROM tw.submitted_at - tw.created_at),
+                                                           1) :: NUMERIC)), 0), %(num_buckets)s - 1) :: INT + 1 bucket
+        FROM crowdsourcing_taskworker tw
+          INNER JOIN crowdsourcing_task t ON tw.task_id = t.id
+          INNER JOIN crowdsourcing_project p ON p.id = t.project_id
+        WHERE tw.id = %(task_worker_id)s AND tw.submitted_at IS NOT NULL
+    ), sketch AS (
+        SELECT
+          group_id,
+          worker_id,
+          array_fill(0, ARRAY [bucket - 1]) || 1 || array_fill(0, ARRAY [%(num_buckets)s - bucket]) counts
+        FROM duration
+    ), worker_sketch AS (
+      INSERT INTO crowdsourcing_workertaskdurationsketch AS s (created_at, updated_at, worker_id, project_group_id,
+                                                              counts)
+        SELECT now(), now(), worker_id, group_id, counts
+        FROM sketch
+      ON CONFLICT (worker_id, project_group_id)
+        DO UPDATE SET updated_at = now(), counts = (
+          SELECT array_agg(a + b ORDER BY i)
+          FROM unnest(s.counts, excluded.counts) WITH ORDINALITY u(a, b, i))
+    )
+    INSERT INTO crowdsourcing_taskdurationsketch AS s (created_at, updated_at, project_group_id, counts)
+      SELECT now(), now(), group_id, counts
+      FROM sketch
+    ON CONFLICT (project_group_id)
+      DO UPDATE SET updated_at = now(), counts = (
+        SELECT array_agg(a + b ORDER BY i)
+        FROM unnest(s.counts, excluded.counts) WITH ORDINALITY u(a, b, i));
+'''
+
+
+def record_task_duration(task_worker_id):
+    """
+    Add the time from assignment to submission of a task worker to the duration sketches of its worker and
+    project group, see crowdsourcing.sketches
+    """
+    cursor = connection.cursor()
+    cursor.execute(TASK_DURATION_QUERY, {'task_worker_id': task_worker_id, 'scale': sketches.SCALE,
+                                         'num_buckets': sketches.NUM_BUCKETS})
+    cursor.close()
+
+
+# buffered name: (table, key column, timestamp column), see crowdsourcing.utils.buffer_timestamp
+WRITE_BUFFER_TIMESTAMPS = {
+    'last_active': ('crowdsourcing_userprofile', 'user_id', 'last_active'),
+    'last_opened_at': ('crowdsourcing_project', 'id', 'last_opened_at'),
+}
+WRITE_BUFFER_BATCH_SIZE = 1000
+
+
+def _take_buffer(provider, name):
+    """
+    Move a buffer out of the way of new writes, a batch left behind by a failed flush is taken first
+    """
+    key = provider.build_key(settings.WRITE_BUFFER_KEY, name)
+    flushing = key + ':flushing'
+    if not provider.exists(flushing):
+        if not provider.exists(key):
+            return None
+        provider.rename(key, flushing)
+    return flushing
+
+
+def _update_timestamps(table, key_column, value_column, values):
+    cursor = connection.cursor()
+    for start in xrange(0, len(values), WRITE_BUFFER_BATCH_SIZE):
+        batch = values[start:start + WRITE_BUFFER_BATCH_SIZE]
+        # noinspection SqlResolve
+        query = '''
+            UPDATE {table} u
+            SET {value_column} = v.value
+            FROM (VALUES {rows}) v(key, value)
+            WHERE u.{key_column} = v.key AND (u.{value_column} IS NULL OR u.{value_column} < v.value);
+        '''.format(table=table, key_column=key_column, value_column=value_column,
+                   rows=', '.join(['(%s :: INT, %s :: TIMESTAMPTZ)'] * len(batch)))
+        cursor.execute(query, [item for row in batch for item in row])
+    cursor.close()
+
+
+def _update_read_receipts(receipts):
+    cursor = connection.cursor()
+    for start in xrange(0, len(receipts), WRITE_BUFFER_BATCH_SIZE):
+        batch = receipts[start:start + WRITE_BUFFER_BATCH_SIZE]
+        # noinspection SqlResolve
+        query = '''
+            UPDATE crowdsourcing_messagerecipient mr
+            SET status = %s, read_at = v.read_at, updated_at = now()
+            FROM crowdsourcing_message m, (VALUES {rows}) v(conversation_id, recipient_id, read_at)
+            WHERE m.id = mr.message_id AND m.conversation_id = v.conversation_id
+                  AND mr.recipient_id = v.recipient_id AND mr.status < %s AND m.created_at <= v.read_at;
+        '''.format(rows=', '.join(['(%s :: INT, %s :: INT, %s :: TIMESTAMPTZ)'] * len(batch)))
+        params = [models.MessageRecipient.STATUS_READ] + [item for row in batch for item in row]
+        cursor.execute(query, params + [models.MessageRecipient.STATUS_READ])
+    cursor.close()
+
+
+def _insert_project_previews(previews):
+    """
+    Insert (project id, user id) previews, skipping the ones whose project or user was deleted since
+    """
+    cursor = connection.cursor()
+    for start in xrange(0, len(previews), WRITE_BUFFER_BATCH_SIZE):
+        batch = previews[start:start + WRITE_BUFFER_BATCH_SIZE]
+        # noinspection SqlResolve
+        query = '''
+            INSERT INTO crowdsourcing_projectpreview (created_at, updated_at, project_id, user_id)
+              SELECT now(), now(), v.project_id, v.user_id
+              FROM unnest(%(project_ids)s :: INTEGER [], %(user_ids)s :: INTEGER []) v (project_id, user_id)
+                INNER JOIN crowdsourcing_project p ON p.id = v.project_id
+                INNER JOIN auth_user u ON u.id = v.user_id;
+        '''
+        cursor.execute(query, {'project_ids': [int(p) for p, _ in batch], 'user_ids': [int(u) for _, u in batch]})
+    cursor.close()
+
+
+@celery_app.task(ignore_result=True)
+def flush_write_buffer():
+    provider = RedisProvider()
+    # overlapping flushes would take the same :flushing buffers and write them twice
+    lock = provider.lock(provider.build_key(settings.WRITE_BUFFER_KEY, 'lock'),
+                         timeout=settings.WRITE_BUFFER_LOCK_SECONDS)
+    if not lock.acquire(blocking=False):
+        return 'LOCKED'
+    try:
+        _flush_write_buffer(provider)
+    finally:
+        lock.release()
+    return 'SUCCESS'
+
+
+def _flush_write_buffer(provider):
+    for name, (table, key_column, value_column) in WRITE_BUFFER_TIMESTAMPS.items():
+        flushing = _take_buffer(provider, name)
+        if flushing is None:
+            continue
+        values = [(int(k), v) for k, v in provider.hgetall(flushing).items()]
+        _update_timestamps(table, key_column, value_column, values)
+        provider.delete(flushing)
+
+    flushing = _take_buffer(provider, 'read_receipts')
+    if flushing is not None:
+        receipts = [k.split(':') + [v] for k, v in provider.hgetall(flushing).items()]
+        _update_read_receipts(receipts)
+        provider.delete(flushing)
+
+    flushing = _take_buffer(provider, 'project_previews')
+    if flushing is not None:
+        _insert_project_previews([m.split(':') for m in provider.get_list(flushing)])
+        provider.delete(flushing)
+
+
+# noinspection SqlResolve
+OUTBOX_QUERY = '''
+    DELETE FROM crowdsourcing_outboxevent
+    WHERE id IN (
+      SELECT id
+      FROM crowdsourcing_outboxevent
+      ORDER BY id
+      LIMIT %(batch_size)s
+      FOR UPDATE SKIP LOCKED
+    )
+    RETURNING id, kind, payload;
+'''
+
+
+def _dispatch_outbox(events):
+    """
+    Send outbox events in the order they were recorded, runs of update_worker_cache calls with the same
+    operation are sent as one task and the websocket messages of the batch are published together through one
+    redis pipeline. The counters of update_worker_cache aren't idempotent, so its tasks are only sent once the
+    batch is committed, a batch that fails is rolled back and sent again without having counted anything.
+    """
+    notifier = notifications.Notifier()
+    cache_call, cache_workers = None, []
+    for _, kind, payload in events:
+        call = None
+        if kind == outbox.KIND_TASK and payload['task'] == update_worker_cache.name:
+            call = json.dumps([payload['args'][1:], payload['kwargs']], sort_keys=True)
+        if cache_call is not None and call != cache_call:
+            _send_worker_cache(cache_call, cache_workers)
+            cache_call, cache_workers = None, []
+        if call is not None:
+            cache_call = call
+            cache_workers.extend(payload['args'][0])
+        elif kind == outbox.KIND_TASK:
+            celery_app.send_task(payload['task'], args=payload['args'], kwargs=payload['kwargs'])
+        elif kind == outbox.KIND_PUBLISH:
+            notifier.add(payload['facility'], payload['message'], users=payload['users'],
+                         broadcast=payload['broadcast'])
+        elif kind == outbox.KIND_STREAM:
+            notifier.stream(payload['user'], payload['submission'])
+    if cache_call is not None:
+        _send_worker_cache(cache_call, cache_workers)
+    notifier.flush()
+
+
+def _send_worker_cache(call, workers):
+    args, kwargs = json.loads(call)
+    transaction.on_commit(lambda: celery_app.send_task(update_worker_cache.name, args=[workers] + args,
+                                                       kwargs=kwargs))
+
+
+@celery_app.task(ignore_result=True)
+def drain_outbox():
+    while True:
+        with transaction.atomic():
+            cursor = connection.cursor()
+            cursor.execute(OUTBOX_QUERY, {'batch_size': settings.OUTBOX_BATCH_SIZE})
+            events = sorted(cursor.fetchall())
+            cursor.close()
+            _dispatch_outbox(events)
+        if len(events) < settings.OUTBOX_BATCH_SIZE:
+            return 'SUCCESS'
+
+
+# noinspection SqlResolve
+BOT_STREAM_EXPECTED_QUERY = '''
+    SELECT
+      t.group_id,
+      greatest(count(tw.id), max(p.repetition))
+    FROM crowdsourcing_task t
+      INNER JOIN crowdsourcing_project p ON p.id = t.project_id
+      LEFT OUTER JOIN crowdsourcing_taskworker tw ON tw.task_id = t.id AND tw.status IN (%(submitted)s, %(accepted)s)
+    WHERE t.group_id = ANY(%(group_ids)s)
+    GROUP BY t.group_id
+'''
+
+
+def _take_bot_stream(provider, user_id, stream, now):
+    """
+    Pop the submissions of user_id's stream that are due, whole batches of batch_size and, once the oldest waited
+    out the window, the rest. Streams that were unregistered are emptied.
+    """
+    key = notifications.bot_stream_key(user_id)
+    pipeline = provider.pipeline()
+    pipeline.llen(key)
+    pipeline.lindex(key, 0)
+    length, head = pipeline.execute()
+    if not length:
+        return []
+    batch_size, window = stream or (length, 0)
+    due = length - length % batch_size
+    if now - json.loads(head)[0] >= window:
+        due = length
+    if due < length:
+        provider.set_add(settings.BOT_STREAMS_DIRTY_KEY, user_id)
+    if not due:
+        return []
+    pipeline.lrange(key, 0, due - 1)
+    pipeline.ltrim(key, due, -1)
+    entries = pipeline.execute()[0]
+    submissions = [json.loads(entry)[1] for entry in entries]
+    return [submissions[i:i + batch_size] for i in range(0, len(submissions), batch_size)]
+
+
+@celery_app.task(ignore_result=True)
+def flush_bot_streams():
+    """
+    Publish the aggregated bot streams as BATCH messages, the expected number of submissions of each task group
+    is counted once per flush instead of once per submission.
+    """
+    provider = RedisProvider()
+    streams = provider.hgetall(settings.BOT_STREAMS_KEY)
+    now = time.time()
+    batches = []
+    for user_id in provider.smembers(settings.BOT_STREAMS_DIRTY_KEY):
+        provider.set_remove(settings.BOT_STREAMS_DIRTY_KEY, user_id)
+        # a flushed cache is filled again from UserPreferences
+        stream = json.loads(streams[user_id]) if user_id in streams else notifications.get_bot_stream(user_id)
+        batches.extend((int(user_id), batch) for batch in _take_bot_stream(provider, user_id, stream, now))
+    if not len(batches):
+        return 'SUCCESS'
+
+    group_ids = list(set(s['task_group_id'] for _, batch in batches for s in batch))
+    cursor = connection.cursor()
+    cursor.execute(BOT_STREAM_EXPECTED_QUERY, {'group_ids': group_ids,
+                                               'submitted': models.TaskWorker.STATUS_SUBMITTED,
+                                               'accepted': models.TaskWorker.STATUS_ACCEPTED})
+    expected = dict(cursor.fetchall())
+    cursor.close()
+
+    usernames = dict(User.objects.filter(id__in=set(u for u, _ in batches)).values_list('id', 'username'))
+    notifier = notifications.Notifier()
+    for user_id, batch in batches:
+        if user_id not in usernames:
+            continue
+        for submission in batch:
+            submission['expected'] = expected.get(submission['task_group_id'])
+        notifier.add('bot', json.dumps({"type": "BATCH", "payload": batch}), users=[usernames[user_id]])
+    notifier.flush()
+    return 'SUCCESS'
@@ -0,0 +1,86 @@
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from crowdsourcing.models import Project, Task, TaskWorker
+from crowdsourcing.viewsets.project import ProjectViewSet
+
+
+class CalculateTotalTest(TestCase):
+    """
+    calculate_total against the recursive query it replaced, and against totals worked out by hand
+    """
+
+    def setUp(self):
+        self.requester = User.objects.create_user(username='requester')
+        self.workers = [User.objects.create_user(username='worker{}'.format(i)) for i in range(4)]
+
+    def create_project(self, price, repetition, previous=None):
+        project = Project.objects.create(owner=self.requester, price=Decimal(price), repetition=repetition)
+        project.group_id = previous.group_id if previous is not None else project.id
+        project.save()
+        return project
+
+    @staticmethod
+    def create_task(project, previous=None):
+        task = Task.objects.create(project=project, hash='')
+        task.group_id = previous.group_id if previous is not None else task.id
+        task.save()
+        return task
+
+    def assign(self, task, *statuses):
+        for worker, status in zip(self.workers, statuses):
+            TaskWorker.objects.create(task=task, worker=worker, status=status)
+
+    def assertTotal(self, project, expected):
+        total = ProjectViewSet.calculate_total(project)
+        self.assertEqual(total, ProjectViewSet.calculate_total_recursive(project))
+        self.assertEqual(total, Decimal(expected))
+
+    def test_no_prior_assignments(self):
+        project = self.create_project('1.50', 2)
+        self.create_task(project)
+        self.create_task(project)
+        self.assertTotal(project, '6.00')
+
+    def test_accepted_and_rejected(self):
+        first = self.create_project('1.00', 2)
+        task = self.create_task(first)
+        self.assign(task, TaskWorker.STATUS_ACCEPTED, TaskWorker.STATUS_REJECTED)
+        revision = self.create_project('1.00', 2, previous=first)
+        self.create_task(revision, previous=task)
+        # the accepted slot is paid for, the rejected one is open again
+        self.assertTotal(revision, '1.00')
+
+    def test_excluded_revision(self):
+        first = self.create_project('1.00', 1)
+        kept = self.create_task(first)
+        excluded = self.create_task(first)
+        self.assign(kept, TaskWorker.STATUS_ACCEPTED)
+        self.assign(excluded, TaskWorker.STATUS_ACCEPTED, TaskWorker.STATUS_SUBMITTED)
+        revision = self.create_project('1.00', 1, previous=first)
+        self.create_task(revision, previous=kept)
+        self.create_task(revision, previous=excluded)
+        excluded.exclude_at = revision
+        excluded.save()
+        # the excluded accepted work is redone, the submission beyond the repetition is still owed
+        self.assertTotal(revision, '2.00')
+
+    def test_repetition_decreased_and_price_raised(self):
+        first = self.create_project('1.00', 3)
+        task = self.create_task(first)
+        self.assign(task, TaskWorker.STATUS_ACCEPTED, TaskWorker.STATUS_SUBMITTED, TaskWorker.STATUS_IN_PROGRESS)
+        revision = self.create_project('2.00', 2, previous=first)
+        self.create_task(revision, previous=task)
+        # the submission kept is paid at the new price, the one beyond the repetition at the old one
+        self.assertTotal(revision, '3.00')
+
+    def test_repetition_increased(self):
+        first = self.create_project('1.00', 1)
+        task = self.create_task(first)
+        self.assign(task, TaskWorker.STATUS_SUBMITTED)
+        revision = self.create_project('1.00', 3, previous=first)
+        self.create_task(revision, previous=task)
+        self.create_task(revision)
+        self.assertTotal(revision, '6.00')
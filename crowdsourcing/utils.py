@@ -1,25 +1,75 @@
 import ast
+import base64
 import datetime
 import hashlib
+import json
 import random
 import re
 import string
 
 from django.conf import settings
+from django.core.exceptions import EmptyResultSet
+from django.core.paginator import Paginator, Page, EmptyPage, PageNotAnInteger
+from django.db import connection, transaction
+from django.db.models import Q
 from django.http import HttpResponse
 from django.template import Template
 from django.template.base import VariableNode
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
 from django.utils.http import urlencode
+from django.utils.translation import ugettext_lazy as _
 from oauth2_provider.oauth2_backends import OAuthLibCore, get_oauthlib_core
+from rest_framework import serializers
 from rest_framework.pagination import PageNumberPagination, LimitOffsetPagination
 from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.urls import replace_query_param
 
 from crowdsourcing.crypto import to_pk
+from crowdsourcing.exceptions import daemo_error
 from crowdsourcing.redis import RedisProvider
 
 
-class SmallResultsSetPagination(LimitOffsetPagination):
+class EstimatedCountPagination(LimitOffsetPagination):
+    """
+    Limit/offset pagination whose count comes from count_rows, the response says if it is exact. The next
+    link is decided by reading one row past the page so it does not depend on the count. This is the
+    DEFAULT_PAGINATION_CLASS, so list endpoints such as the TaskWorker lists don't COUNT(*) large sets.
+    """
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.limit = self.get_limit(request)
+        if self.limit is None:
+            return None
+
+        self.count, self.count_is_exact = count_rows(queryset)
+        self.offset = self.get_offset(request)
+        self.request = request
+        if self.count > self.limit and self.template is not None:
+            self.display_page_controls = True
+
+        if self.count_is_exact and (self.count == 0 or self.offset > self.count):
+            self.has_next = False
+            return []
+        page = list(queryset[self.offset:self.offset + self.limit + 1])
+        self.has_next = len(page) > self.limit
+        return page[:self.limit]
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        url = replace_query_param(url, self.limit_query_param, self.limit)
+        return replace_query_param(url, self.offset_query_param, self.offset + self.limit)
+
+    def get_paginated_response(self, data):
+        response = super(EstimatedCountPagination, self).get_paginated_response(data)
+        response.data['count_is_exact'] = self.count_is_exact
+        return response
+
+
+class SmallResultsSetPagination(EstimatedCountPagination):
     default_limit = 100
 
 
@@ -161,10 +211,60 @@ class Oauth2Utils:
         pass
 
 
+class EstimatedCountPage(Page):
+    def __init__(self, object_list, number, paginator, has_next):
+        super(EstimatedCountPage, self).__init__(object_list, number, paginator)
+        self._has_next = has_next
+
+    def has_next(self):
+        return self._has_next
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator counted with count_rows. When the count is not exact pages past it are still served, and
+    whether there is a next page is decided by reading one row past the page.
+    """
+    @cached_property
+    def _counted(self):
+        return count_rows(self.object_list)
+
+    @cached_property
+    def count(self):
+        return self._counted[0]
+
+    @property
+    def count_is_exact(self):
+        return self._counted[1]
+
+    def validate_number(self, number):
+        if self.count_is_exact:
+            return super(EstimatedCountPaginator, self).validate_number(number)
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger(_('That page number is not an integer'))
+        if number < 1:
+            raise EmptyPage(_('That page number is less than 1'))
+        return number
+
+    def page(self, number):
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        object_list = list(self.object_list[bottom:bottom + self.per_page + 1])
+        return EstimatedCountPage(object_list[:self.per_page], number, self, len(object_list) > self.per_page)
+
+
 class SmallResultSetPagination(PageNumberPagination):
     page_size = 25
     page_size_query_param = 'page_size'
     max_page_size = 100
+    django_paginator_class = EstimatedCountPaginator
+
+    def get_paginated_response(self, data):
+        response = super(SmallResultSetPagination, self).get_paginated_response(data)
+        response.data['count_is_exact'] = self.page.paginator.count_is_exact
+        return response
 
 
 class JSONResponse(HttpResponse):
@@ -196,6 +296,93 @@ def get_relative_time(date_time):
             return date_time.strftime('%I:%M %p').lstrip('0')
 
 
+def mark_project_rollups_dirty(project_ids):
+    """
+    Queue the project groups of project_ids for crowdsourcing.tasks.flush_project_rollups once the transaction
+    commits, a flush running before that would recompute the rollups without the changes and consume the mark
+    """
+    project_ids = [p for p in set(project_ids) if p is not None]
+    if len(project_ids):
+        transaction.on_commit(lambda: RedisProvider().set_add(settings.PROJECT_ROLLUPS_DIRTY_KEY, *project_ids))
+
+
+def mark_worker_earnings_dirty(worker_project_pairs):
+    """
+    Queue (worker id, project id) pairs for crowdsourcing.tasks.flush_worker_earnings once the transaction commits,
+    see mark_project_rollups_dirty
+    """
+    members = set('%s:%s' % (w, p) for w, p in worker_project_pairs if w is not None and p is not None)
+    if len(members):
+        transaction.on_commit(lambda: RedisProvider().set_add(settings.WORKER_EARNINGS_DIRTY_KEY, *members))
+
+
+def mark_mturk_hits_dirty(task_group_ids):
+    """
+    Queue task groups for mturk.tasks.reconcile_mturk_hits, which creates the HITs they are missing
+    """
+    task_group_ids = [g for g in set(task_group_ids) if g is not None]
+    for start in range(0, len(task_group_ids), settings.MTURK_RECONCILE_BATCH_SIZE):
+        RedisProvider().set_add(settings.MTURK_HITS_DIRTY_KEY,
+                                *task_group_ids[start:start + settings.MTURK_RECONCILE_BATCH_SIZE])
+
+
+def buffer_timestamp(name, key, value=None):
+    """
+    Write-behind for a hot timestamp column, only the latest value per key is kept until
+    crowdsourcing.tasks.flush_write_buffer writes it out, see WRITE_BUFFER_TIMESTAMPS there
+    """
+    value = value or timezone.now()
+    RedisProvider().set_hash(RedisProvider.build_key(settings.WRITE_BUFFER_KEY, name), key, value.isoformat())
+    return value
+
+
+def get_buffered_timestamp(name, key, default=None):
+    value = RedisProvider().get_status(RedisProvider.build_key(settings.WRITE_BUFFER_KEY, name), key)
+    return parse_datetime(value) if value is not None else default
+
+
+def buffer_read_receipt(conversation_id, user_id):
+    """
+    Mark the messages of a conversation read by user_id as of now, written out by
+    crowdsourcing.tasks.flush_write_buffer
+    """
+    return buffer_timestamp('read_receipts', '%s:%s' % (conversation_id, user_id))
+
+
+def buffer_project_preview(project_id, user_id):
+    RedisProvider().push(RedisProvider.build_key(settings.WRITE_BUFFER_KEY, 'project_previews'),
+                         '%s:%s' % (project_id, user_id))
+
+
+def worker_statistics_keys(project_group_id):
+    """
+    The cached statistics, the workers they were computed from and a counter bumped whenever a new worker submits
+    """
+    provider = RedisProvider()
+    return provider.build_key('worker_statistics', project_group_id), \
+        provider.build_key('worker_statistics_workers', project_group_id), \
+        provider.build_key('worker_statistics_generation', project_group_id)
+
+
+def mark_worker_submitted(project_group_id, worker_id):
+    """
+    Drop the cached worker demographics of a project group the first time worker_id submits to it, once the
+    transaction commits. Before the commit, statistics computed without the worker could be cached right after, and
+    a rolled back submission would leave the worker marked, so their first real one wouldn't drop the cache.
+    """
+    if project_group_id is None or worker_id is None:
+        return
+
+    def mark():
+        provider = RedisProvider()
+        statistics_key, workers_key, generation_key = worker_statistics_keys(project_group_id)
+        if provider.set_add(workers_key, worker_id):
+            provider.incr(generation_key)
+            provider.delete(statistics_key)
+
+    transaction.on_commit(mark)
+
+
 def get_worker_cache(worker_id):
     provider = RedisProvider()
     name = provider.build_key('worker', worker_id)
@@ -251,18 +438,24 @@ def replace_braces(s):
     return re.sub(r'\s(?=[^\{\}]*}})', '', unicode(s))
 
 
-def get_template_string(initial_data, data):
+def compile_template_string(initial_data):
+    """
+    Parse a template string into a list of (is_variable, value) segments which can be rendered
+    repeatedly with render_template_segments without building a django Template each time.
+    """
     initial_data = replace_braces(initial_data)
     html_template = Template(initial_data)
-    return_value = ''
-    has_variables = False
-    for node in html_template.nodelist:
-        if isinstance(node, VariableNode):
-            return_value += unicode(data.get(node.token.contents, ''))
-            has_variables = True
-        else:
-            return_value += unicode(node.token.contents)
-    return return_value, has_variables
+    return [(isinstance(node, VariableNode), unicode(node.token.contents)) for node in html_template.nodelist]
+
+
+def render_template_segments(segments, data):
+    return_value = u''.join([unicode(data.get(value, '')) if is_variable else value
+                             for is_variable, value in segments])
+    return return_value, any([is_variable for is_variable, value in segments])
+
+
+def get_template_string(initial_data, data):
+    return render_template_segments(compile_template_string(initial_data), data)
 
 
 def get_template_tokens(initial_data):
@@ -289,3 +482,215 @@ def hash_as_set(data):
 def get_trailing_number(s):
     m = re.search(r'\d+$', s)
     return int(m.group()) if m else None
+
+
+def encode_cursor(values):
+    """
+    Encode a list of keyset values (e.g. [updated_at, id]) into an opaque, url safe cursor.
+    """
+    return base64.urlsafe_b64encode(json.dumps(values)).rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor produced by encode_cursor, returns None if the cursor is malformed.
+    """
+    try:
+        cursor = str(cursor)
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (TypeError, ValueError):
+        return None
+    if not isinstance(values, list):
+        return None
+    return values
+
+
+def estimate_count(query, params=None):
+    """
+    Row count the planner expects for a raw query or a queryset, read from EXPLAIN instead of running COUNT(*).
+    """
+    if hasattr(query, 'query'):
+        query, params = query.order_by().query.sql_with_params()
+    cursor = connection.cursor()
+    cursor.execute('EXPLAIN (FORMAT JSON) ' + query, params)
+    plan = cursor.fetchone()[0]
+    cursor.close()
+    if isinstance(plan, basestring):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def count_rows(query, params=None):
+    """
+    Count of a queryset, list or raw query for pagination, and whether it is exact. Up to
+    PAGINATION_EXACT_COUNT_LIMIT rows are counted exactly, with a LIMIT so that a large set is not read in
+    full. Above that the count is a cached full count when PAGINATION_COUNT_CACHE_SECONDS is set, and the
+    planner's estimate otherwise.
+    """
+    if isinstance(query, (list, tuple)):
+        return len(query), True
+    if hasattr(query, 'query'):
+        try:
+            query, params = query.order_by().query.sql_with_params()
+        except EmptyResultSet:
+            return 0, True
+    limit = settings.PAGINATION_EXACT_COUNT_LIMIT
+    cursor = connection.cursor()
+    cursor.execute('SELECT count(*) FROM ({} LIMIT {}) counted'.format(query, limit + 1), params)
+    count = cursor.fetchone()[0]
+    if count <= limit:
+        cursor.close()
+        return count, True
+    if not settings.PAGINATION_COUNT_CACHE_SECONDS:
+        cursor.close()
+        return max(estimate_count(query, params), count), False
+
+    provider = RedisProvider()
+    key = provider.build_key('pagination_count', hashlib.sha1(repr((query, params))).hexdigest())
+    cached = provider.get(key)
+    if cached is None:
+        cursor.execute('SELECT count(*) FROM ({}) counted'.format(query), params)
+        cached = cursor.fetchone()[0]
+        provider.set(key, cached, expire=settings.PAGINATION_COUNT_CACHE_SECONDS)
+    cursor.close()
+    return int(cached), False
+
+
+class KeysetPagination(object):
+    """
+    Seek pagination over a fixed ordering, e.g. ('-submitted_at', '-id'), where the last field is unique.
+    Instead of an offset the cursor carries the sort keys of the row it stops at, so every page is read
+    with the same index range scan no matter how deep it is. Works on querysets with paginate_queryset and
+    on raw SQL with paginate_raw_queryset, counts come from count_rows.
+    """
+    default_limit = 100
+    max_limit = 1000
+    limit_query_param = 'limit'
+    cursor_query_param = 'cursor'
+
+    def __init__(self, ordering, default_limit=None):
+        self.ordering = tuple(ordering)
+        if default_limit is not None:
+            self.default_limit = default_limit
+        self.request = None
+        self.limit = self.default_limit
+        self.count = None
+        self.count_is_exact = True
+        self.next_position = None
+        self.previous_position = None
+
+    def paginate_queryset(self, queryset, request):
+        reverse, position = self._start(request)
+        self.count, self.count_is_exact = count_rows(queryset)
+        ordering = self._ordering(reverse)
+        if position is not None:
+            queryset = queryset.filter(self._seek_filter(ordering, position))
+        page = list(queryset.order_by(*ordering)[:self.limit + 1])
+        return self._finish(page, reverse, position)
+
+    def paginate_raw_queryset(self, manager, query, params, request):
+        """
+        Page through the rows of a raw SELECT as instances of manager.model, the fields of the ordering
+        have to be output columns of the query.
+        """
+        reverse, position = self._start(request)
+        self.count, self.count_is_exact = count_rows(query, params)
+        ordering = self._ordering(reverse)
+        params = dict(params, keyset_limit=self.limit + 1)
+        conditions = 'TRUE'
+        if position is not None:
+            conditions = self._seek_condition(ordering, position, params)
+        order_by = ', '.join(f.lstrip('-') + (' DESC' if f.startswith('-') else ' ASC') for f in ordering)
+        page_query = 'SELECT * FROM ({}) keyset_page WHERE {} ORDER BY {} LIMIT %(keyset_limit)s'.format(
+            query, conditions, order_by)
+        page = list(manager.raw(page_query, params=params))
+        return self._finish(page, reverse, position)
+
+    def get_next_link(self):
+        return self._link(self.next_position, False)
+
+    def get_previous_link(self):
+        return self._link(self.previous_position, True)
+
+    def get_paginated_data(self, results):
+        return {
+            "count": self.count,
+            "count_is_exact": self.count_is_exact,
+            "next": self.get_next_link(),
+            "previous": self.get_previous_link(),
+            "results": results
+        }
+
+    def _start(self, request):
+        self.request = request
+        try:
+            limit = int(request.query_params.get(self.limit_query_param, self.default_limit))
+        except ValueError:
+            raise serializers.ValidationError(detail=daemo_error("Limit must be an integer."))
+        self.limit = max(1, min(limit, self.max_limit))
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor is None:
+            return False, None
+        values = decode_cursor(cursor)
+        if values is None or len(values) != len(self.ordering) + 1:
+            raise serializers.ValidationError(detail=daemo_error("Invalid cursor."))
+        position = []
+        for value in values[1:]:
+            if isinstance(value, basestring):
+                try:
+                    value = parse_datetime(value) or value
+                except ValueError:
+                    raise serializers.ValidationError(detail=daemo_error("Invalid cursor."))
+            position.append(value)
+        return bool(values[0]), position
+
+    def _finish(self, page, reverse, position):
+        has_more = len(page) > self.limit
+        page = page[:self.limit]
+        if reverse:
+            page.reverse()
+        self.next_position = self._keys(page[-1]) if len(page) and (has_more or reverse) else None
+        self.previous_position = self._keys(page[0]) if len(page) and position is not None and (
+            has_more or not reverse) else None
+        return page
+
+    def _ordering(self, reverse):
+        if not reverse:
+            return self.ordering
+        return tuple(f[1:] if f.startswith('-') else '-' + f for f in self.ordering)
+
+    def _keys(self, obj):
+        keys = []
+        for field in self.ordering:
+            value = obj
+            for attribute in field.lstrip('-').split('__'):
+                value = getattr(value, attribute)
+            keys.append(value.isoformat() if isinstance(value, datetime.datetime) else value)
+        return keys
+
+    def _link(self, position, reverse):
+        if position is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, encode_cursor([int(reverse)] + position))
+
+    @staticmethod
+    def _seek_filter(ordering, position):
+        condition = Q()
+        for i, field in enumerate(ordering):
+            term = Q(**{field.lstrip('-') + ('__lt' if field.startswith('-') else '__gt'): position[i]})
+            for previous, value in zip(ordering[:i], position[:i]):
+                term &= Q(**{previous.lstrip('-'): value})
+            condition |= term
+        return condition
+
+    @staticmethod
+    def _seek_condition(ordering, position, params):
+        terms = []
+        for i, field in enumerate(ordering):
+            params['keyset_%d' % i] = position[i]
+            term = ['{} {} %(keyset_{})s'.format(field.lstrip('-'), '<' if field.startswith('-') else '>', i)]
+            for j, previous in enumerate(ordering[:i]):
+                term.append('{} = %(keyset_{})s'.format(previous.lstrip('-'), j))
+            terms.append('(' + ' AND '.join(term) + ')')
+        return '(' + ' OR '.join(terms) + ')'
@@ -50,9 +50,7 @@ class Login(APIView):
         if user is not None:
 
             if not user.is_anonymous():
-                userprofile = user.profile
-                userprofile.last_active = timezone.now()
-                userprofile.save()
+                buffer_timestamp('last_active', user.id)
 
             if user.is_active:
                 login(request, user)
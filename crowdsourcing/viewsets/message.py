@@ -7,16 +7,14 @@ from rest_framework import status, viewsets, mixins, serializers
 from rest_framework.decorators import list_route, detail_route
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
-from ws4redis.publisher import RedisPublisher
-from ws4redis.redis_store import RedisMessage
 
-from crowdsourcing import models
+from crowdsourcing import notifications
 from crowdsourcing.exceptions import daemo_error
 from crowdsourcing.models import Conversation, Message, ConversationRecipient
 from crowdsourcing.redis import RedisProvider
 from crowdsourcing.serializers.message import ConversationSerializer, MessageSerializer, RedisMessageSerializer, \
     ConversationRecipientSerializer
-from crowdsourcing.utils import get_relative_time
+from crowdsourcing.utils import get_relative_time, buffer_read_receipt
 
 
 class ConversationViewSet(mixins.CreateModelMixin, mixins.UpdateModelMixin,
@@ -121,15 +119,13 @@ class MessageViewSet(viewsets.ModelViewSet):
 
     @list_route(methods=['get'], url_path='list-by-conversation')
     def list_by_conversation(self, request, *args, **kwargs):
-        queryset = self.queryset.filter(conversation_id=request.query_params.get('conversation', -1)) \
-            .order_by('created_at')
+        conversation_id = request.query_params.get('conversation', -1)
+        queryset = self.queryset.filter(conversation_id=conversation_id).order_by('created_at')
 
-        # mark as read
-        models.MessageRecipient.objects.filter(
-            message__conversation__id=request.query_params.get('conversation', -1),
-            status__lt=models.MessageRecipient.STATUS_READ,
-            recipient=request.user
-        ).update(status=models.MessageRecipient.STATUS_READ, read_at=timezone.now())
+        # mark as read, only when there is something unread and the receipts of the messages are written behind
+        if ConversationRecipient.objects.filter(conversation_id=conversation_id, recipient=request.user,
+                                                unread_count__gt=0).update(unread_count=0):
+            buffer_read_receipt(conversation_id, request.user.id)
 
         serializer = self.serializer_class(instance=queryset, many=True,
                                            fields=('body', 'time_relative',
@@ -156,14 +152,11 @@ class RedisMessageViewSet(viewsets.ViewSet):
             raise serializers.ValidationError(detail=daemo_error("Invalid conversation"))
 
         if serializer.is_valid():
-            redis_publisher = RedisPublisher(facility='notifications', users=[request.data['recipient']])
-
-            message = RedisMessage(json.dumps({"body": request.data['message'],
-                                               "time_relative": get_relative_time(timezone.now()),
-                                               "conversation": request.data['conversation'],
-                                               "sender": request.user.username}))
-
-            redis_publisher.publish_message(message)
+            notifications.publish('notifications', json.dumps({"body": request.data['message'],
+                                                               "time_relative": get_relative_time(timezone.now()),
+                                                               "conversation": request.data['conversation'],
+                                                               "sender": request.user.username}),
+                                  users=[request.data['recipient']])
 
             message_data = {
                 "conversation": request.data['conversation'],
@@ -1,5 +1,6 @@
 import json
 import math
+from datetime import timedelta
 from decimal import Decimal, ROUND_UP
 from itertools import groupby
 from textwrap import dedent
@@ -8,8 +9,10 @@ import numpy as np
 from django.conf import settings
 from crowdsourcing.discourse import DiscourseClient
 from django.db import connection
-from django.db.models import F
+from django.db.models import F, Q
 from django.http import HttpResponse, HttpResponseRedirect
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from rest_framework import mixins
 from rest_framework import status, viewsets
 from rest_framework.decorators import detail_route, list_route
@@ -17,12 +20,17 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from yapf.yapflib.yapf_api import FormatCode
 
+from crowdsourcing import sketches
+from crowdsourcing.exceptions import daemo_error
 from crowdsourcing.models import Project, Task, TaskWorker, TaskWorkerResult
 from crowdsourcing.permissions.project import IsProjectOwnerOrCollaborator, ProjectChangesAllowed
 from crowdsourcing.serializers.project import *
 from crowdsourcing.serializers.task import *
-from crowdsourcing.tasks import post_to_discourse
-from crowdsourcing.utils import get_pk, get_template_tokens, SmallResultsSetPagination
+from crowdsourcing.tasks import post_to_discourse, refresh_project_rollups
+from crowdsourcing.redis import RedisProvider
+from crowdsourcing.utils import get_pk, get_template_tokens, SmallResultsSetPagination, encode_cursor, \
+    decode_cursor, worker_statistics_keys, KeysetPagination, buffer_timestamp, get_buffered_timestamp, \
+    buffer_project_preview, mark_mturk_hits_dirty
 from crowdsourcing.validators.project import validate_account_balance
 from mturk.tasks import mturk_disable_hit
 
@@ -54,6 +62,7 @@ class ProjectViewSet(mixins.RetrieveModelMixin, mixins.CreateModelMixin, mixins.
         if serializer.is_valid():
             with transaction.atomic():
                 project = serializer.create(owner=request.user, with_defaults=with_defaults)
+                refresh_project_rollups([project.id])
 
                 serializer = ProjectSerializer(
                     instance=project,
@@ -105,13 +114,14 @@ class ProjectViewSet(mixins.RetrieveModelMixin, mixins.CreateModelMixin, mixins.
             Project.objects.filter(
                 Q(parent_id=instance.group_id, is_review=True) | Q(group_id=instance.group_id)).update(
                 deleted_at=timezone.now())
+            refresh_project_rollups([instance.id])
 
         return Response(data={}, status=status.HTTP_204_NO_CONTENT)
 
     @detail_route(methods=['POST'], url_path='log-preview', permission_classes=[IsAuthenticated])
     def log_preview(self, request, *args, **kwargs):
         project = self.get_object()
-        models.ProjectPreview.objects.create(project=project, user=request.user)
+        buffer_project_preview(project.id, request.user.id)
         return Response({})
 
     @detail_route(methods=['PUT'])
@@ -148,6 +158,73 @@ class ProjectViewSet(mixins.RetrieveModelMixin, mixins.CreateModelMixin, mixins.
 
     @staticmethod
     def calculate_total(instance):
+        """
+        Amount needed for every task of the project to be done repetition times, counting what was already
+        paid for in earlier revisions of the group. Each task group is settled from its counters: slots
+        still open are charged at the new price, slots taken by unfinished assignments at the higher of
+        the old and new price, and unfinished assignments beyond the new slots at their old price.
+        """
+        cursor = connection.cursor()
+        # noinspection SqlResolve
+        payment_query = '''
+            WITH current_tasks AS (
+                SELECT
+                  t.group_id,
+                  coalesce(t.price, p.price) price,
+                  p.repetition
+                FROM crowdsourcing_task t
+                  INNER JOIN crowdsourcing_project p ON p.id = t.project_id
+                WHERE t.project_id = %(current_pid)s
+            ), assignments AS (
+                SELECT
+                  a.price,
+                  a.group_id,
+                  a.accepted,
+                  a.exclude_at,
+                  c.group_id IS NOT NULL AND a.level <= c.repetition
+                  AND coalesce(a.exclude_at, %(current_pid)s) = %(current_pid)s matched,
+                  c.price new_price
+                FROM (
+                       SELECT
+                         t.group_id,
+                         coalesce(t.price, p.price)           price,
+                         tw.status = 3                        accepted,
+                         t.exclude_at,
+                         row_number()
+                         OVER (PARTITION BY t.group_id
+                           ORDER BY tw.id)                    level
+                       FROM crowdsourcing_taskworker tw
+                         INNER JOIN crowdsourcing_task t ON t.id = tw.task_id
+                         INNER JOIN crowdsourcing_project p ON p.id = t.project_id
+                       WHERE tw.status NOT IN (4, 6, 7) AND p.group_id = %(project_group_id)s
+                     ) a
+                  LEFT OUTER JOIN current_tasks c ON c.group_id = a.group_id
+            ), counters AS (
+                SELECT
+                  group_id,
+                  count(*) FILTER (WHERE matched)                                          slots_paid,
+                  count(*) FILTER (WHERE matched AND accepted AND exclude_at IS NOT NULL)  slots_redone,
+                  sum(greatest(price, new_price)) FILTER (WHERE matched AND NOT accepted)  matched_due,
+                  sum(price) FILTER (WHERE NOT matched AND NOT accepted)                   unmatched_due
+                FROM assignments
+                GROUP BY group_id
+            )
+            SELECT sum(coalesce(c.price * (c.repetition - coalesce(k.slots_paid, 0) + coalesce(k.slots_redone, 0)), 0)
+                       + coalesce(k.matched_due, 0) + coalesce(k.unmatched_due, 0)) total_needed
+            FROM current_tasks c
+              FULL OUTER JOIN counters k ON k.group_id = c.group_id;
+        '''
+        cursor.execute(payment_query, {'current_pid': instance.id, "project_group_id": instance.group_id})
+        total_needed = cursor.fetchall()[0][0]
+        cursor.close()
+        return total_needed
+
+    @staticmethod
+    def calculate_total_recursive(instance):
+        """
+        Reference version of calculate_total that pays out every (task, repetition) slot against the
+        numbered assignments of the group, kept to cross check the counters in the tests.
+        """
         cursor = connection.cursor()
         # noinspection SqlResolve
         payment_query = '''
@@ -213,7 +290,7 @@ class ProjectViewSet(mixins.RetrieveModelMixin, mixins.CreateModelMixin, mixins.
                                          t.exclude_at,
                                          row_number()
                                          OVER (PARTITION BY t.group_id
-                                           ORDER BY t.group_id) AS level
+                                           ORDER BY tw.id) AS level
                                        FROM crowdsourcing_taskworker tw
                                          INNER JOIN crowdsourcing_task t ON t.id = tw.task_id
                                          INNER JOIN crowdsourcing_project p ON p.id = t.project_id
@@ -270,6 +347,7 @@ class ProjectViewSet(mixins.RetrieveModelMixin, mixins.CreateModelMixin, mixins.
             if serializer.is_valid():
                 # with transaction.atomic():
                 serializer.publish(to_pay)
+                refresh_project_rollups([instance.id])
 
                 post_to_discourse.delay(instance.id)
             else:
@@ -282,79 +360,37 @@ class ProjectViewSet(mixins.RetrieveModelMixin, mixins.CreateModelMixin, mixins.
         # noinspection SqlResolve
         query = '''
             SELECT
-              id,
-              name,
-              owner_id,
-              status,
-              round(price, 2),
-              sum(paid_tasks) amount_paid,
-              sum(task_price) expected_payout_amount,
-              sum(returned)         returned,
-              sum(in_progress)      in_progress,
-              sum(accepted)         completed,
-              sum(submitted)         awaiting_review,
-              sum(paid_count)         paid_count,
-              case when min(estimated_expire) < now() then null else min(estimated_expire) end expires_at,
-              -- (max(submitted_at) + INTERVAL '1 day') payout_available_by
-              case when (latest_charge + INTERVAL '2 day') < max(submitted_at)
-              then  max(submitted_at) + INTERVAL '2 day'
+              p.id,
+              p.name,
+              p.owner_id,
+              p.status,
+              p.price,
+              e.amount_paid,
+              e.expected_payout_amount,
+              e.returned,
+              e.in_progress,
+              e.accepted completed,
+              e.submitted awaiting_review,
+              e.paid_count,
+              case when e.expires_at < now() then null else e.expires_at end expires_at,
+              case when (c.latest_charge + INTERVAL '2 day') < e.last_submitted_at
+              then e.last_submitted_at + INTERVAL '2 day'
               else
-                 max(submitted_at) + INTERVAL '4 day'
+                 e.last_submitted_at + INTERVAL '4 day'
                end payout_available_by,
-               max(submitted_at) last_submitted_at
-            FROM (SELECT
-                    p.id                                                                      id,
-                    p.name,
-                    p.owner_id,
-                    p.status,
-                    p.price,
-                    case when tw.status = %(accepted)s then coalesce(t.price, p.price) else 0 end paid_tasks,
-                    coalesce(t.price, p.price) task_price,
-                    coalesce(p.timeout, INTERVAL %(default_timeout)s) timeout,
-                    coalesce(tw.started_at, tw.created_at) + coalesce(p.timeout,
-                        INTERVAL %(default_timeout)s) estimated_expire,
-                    CASE WHEN tw.status = (%(returned)s)
-                      THEN 1
-                    ELSE 0 END                                                                      returned,
-                    CASE WHEN tw.status = (%(in_progress)s)
-                      THEN 1
-                    ELSE 0 END                                                                      in_progress,
-                    CASE WHEN tw.status = %(accepted)s
-                      THEN 1
-                    ELSE 0 END                                                                      accepted,
-                    CASE WHEN tw.status = %(submitted)s
-                      THEN 1
-                    ELSE 0 END                                                                       submitted,
-                     CASE WHEN tw.is_paid is true
-                      THEN 1
-                    ELSE 0 END paid_count,
-                    tw.submitted_at,
-                    max(scharge.created_at) latest_charge
-                  FROM crowdsourcing_taskworker tw
-                    INNER JOIN crowdsourcing_task t ON tw.task_id = t.id
-                    INNER JOIN crowdsourcing_project p ON p.id = t.project_id
-                    inner join crowdsourcing_stripecustomer sc on sc.owner_id = p.owner_id
-                    left outer join crowdsourcing_stripecharge scharge on scharge.customer_id=sc.id
-                    and scharge.created_at < p.revised_at
-                  WHERE tw.status not in ((%(skipped)s), (%(expired)s))
-                  AND tw.worker_id = (%(worker_id)s) AND p.is_review = FALSE
-                  GROUP BY p.id,
-                    p.name, p.owner_id, p.status, p.price,
-                   tw.status, tw.is_paid, p.timeout, tw.started_at, tw.created_at, tw.submitted_at, t.price
-                  ) tw
-            GROUP BY tw.id, tw.name, tw.owner_id, tw.status, tw.price, latest_charge
-            ORDER BY returned DESC, in_progress DESC, id DESC;
+              e.last_submitted_at
+            FROM crowdsourcing_workerprojectearnings e
+              INNER JOIN crowdsourcing_project p ON p.id = e.project_id
+              INNER JOIN crowdsourcing_stripecustomer sc ON sc.owner_id = p.owner_id
+              LEFT OUTER JOIN LATERAL (
+                SELECT max(scharge.created_at) latest_charge
+                FROM crowdsourcing_stripecharge scharge
+                WHERE scharge.customer_id = sc.id AND scharge.created_at < p.revised_at
+              ) c ON TRUE
+            WHERE e.worker_id = (%(worker_id)s) AND e.active > 0 AND p.is_review = FALSE
+            ORDER BY e.returned DESC, e.in_progress DESC, p.id DESC;
         '''
-        projects = Project.objects.raw(query, params={
-            'worker_id': request.user.id,
-            'skipped': TaskWorker.STATUS_SKIPPED,
-            'expired': TaskWorker.STATUS_EXPIRED,
-            'in_progress': TaskWorker.STATUS_IN_PROGRESS,
-            'returned': TaskWorker.STATUS_RETURNED,
-            'accepted': TaskWorker.STATUS_ACCEPTED,
-            'submitted': TaskWorker.STATUS_SUBMITTED,
-            'default_timeout': '24 hour'
-        })
+        projects = Project.objects.raw(query, params={'worker_id': request.user.id})
 
         serializer = ProjectSerializer(instance=projects, many=True,
                                        fields=('id', 'name', 'owner', 'price', 'status', 'returned',
@@ -375,6 +411,7 @@ class ProjectViewSet(mixins.RetrieveModelMixin, mixins.CreateModelMixin, mixins.
         else:
             response_data = {
                 "count": len(serializer.data),
+                "count_is_exact": True,
                 "next": None,
                 "previous": None,
                 "results": serializer.data
@@ -386,56 +423,15 @@ class ProjectViewSet(mixins.RetrieveModelMixin, mixins.CreateModelMixin, mixins.
         # noinspection SqlResolve
         query = '''
             SELECT
-              id,
-              group_id,
-              name,
-              created_at,
-              updated_at,
-              status,
-              price,
-              published_at,
-              completed,
-              awaiting_review,
-              open_tasks as in_progress,
-              checked_out
-            FROM crowdsourcing_project p
-              INNER JOIN (
-                           SELECT
-                             p_max.id  project_id,
-                             sum(completed) completed,
-                             sum(awaiting_review) awaiting_review,
-                             greatest((p0.repetition * count(DISTINCT task_id)) - sum(completed) -
-                               sum(awaiting_review), 0) - sum(checked_out) open_tasks,
-                               sum(checked_out) checked_out
-                           FROM (
-                                  SELECT
-                                    p.group_id,
-                                    t.group_id task_id,
-                                    CASE WHEN tw.status in (1, 5)
-                                      THEN 1
-                                    ELSE 0 END checked_out,
-                                    CASE WHEN tw.status = 3
-                                      THEN 1
-                                    ELSE 0 END completed,
-                                    CASE WHEN tw.status = 2
-                                      THEN 1
-                                    ELSE 0 END awaiting_review
-                                  FROM crowdsourcing_project p
-                                    LEFT OUTER JOIN crowdsourcing_task t ON t.project_id = p.id
-                                      AND t.deleted_at IS NULL and t.exclude_at is null
-                                    LEFT OUTER JOIN crowdsourcing_taskworker tw ON tw.task_id = t.id
-                                  WHERE p.owner_id = (%(owner_id)s) AND p.deleted_at IS NULL AND is_review = FALSE) c
-                             INNER JOIN (SELECT
-                                           group_id,
-                                           max(id) id
-                                         FROM crowdsourcing_project
-                                         GROUP BY group_id) p_max
-                               ON c.group_id = p_max.group_id
-                             INNER JOIN crowdsourcing_project p0 ON p0.id=p_max.id
-                           GROUP BY p_max.id, p0.repetition) t
-                ON t.project_id = p.id
-                where p.deleted_at is NULL
-            ORDER BY id DESC;
+              p.*,
+              r.completed,
+              r.awaiting_review,
+              r.open_tasks in_progress,
+              r.checked_out
+            FROM crowdsourcing_projectgrouprollup r
+              INNER JOIN crowdsourcing_project p ON p.id = r.project_id
+            WHERE r.owner_id = (%(owner_id)s) AND p.deleted_at IS NULL
+            ORDER BY p.id DESC;
         '''
         projects = Project.objects.raw(query, params={'owner_id': request.user.id})
         serializer = ProjectSerializer(instance=projects, many=True,
@@ -444,57 +440,21 @@ class ProjectViewSet(mixins.RetrieveModelMixin, mixins.CreateModelMixin, mixins.
                                                'hash_id', 'min_rating', 'repetition', 'published_at',
                                                'revisions', 'updated_at', 'discussion_link'),
                                        context={'request': request})
-        return Response({"count": len(serializer.data), "next": None, "previous": None, "results": serializer.data})
+        return Response({"count": len(serializer.data), "count_is_exact": True, "next": None, "previous": None,
+                         "results": serializer.data})
 
     @detail_route(methods=['get'], url_path='status')
     def status(self, request, *args, **kwargs):
         # noinspection SqlResolve
         query = '''
             SELECT
-              id,
-              group_id,
-              name,
-              created_at,
-              updated_at,
-              status,
-              price,
-              published_at,
-              completed,
-              awaiting_review,
-              in_progress
-            FROM crowdsourcing_project p
-              INNER JOIN (
-                           SELECT
-                             p_max.id  project_id,
-                             sum(completed) completed,
-                             sum(awaiting_review) awaiting_review,
-                             greatest((p0.repetition * count(DISTINCT task_id)) - sum(completed) -
-                               sum(awaiting_review), 0) in_progress
-                           FROM (
-                                  SELECT
-                                    p.group_id,
-                                    t.group_id task_id,
-                                    CASE WHEN tw.status = 3
-                                      THEN 1
-                                    ELSE 0 END completed,
-                                    CASE WHEN tw.status = 2
-                                      THEN 1
-                                    ELSE 0 END awaiting_review
-                                  FROM crowdsourcing_project p
-                                    LEFT OUTER JOIN crowdsourcing_task t ON t.project_id = p.id
-                                      AND t.deleted_at IS NULL
-                                    LEFT OUTER JOIN crowdsourcing_taskworker tw ON tw.task_id = t.id
-                                  WHERE p.owner_id = (%(owner_id)s) AND p.deleted_at IS NULL AND is_review = FALSE) c
-                             INNER JOIN (SELECT
-                                           group_id,
-                                           max(id) id
-                                         FROM crowdsourcing_project
-                                         GROUP BY group_id) p_max
-                               ON c.group_id = p_max.group_id
-                             INNER JOIN crowdsourcing_project p0 ON p0.id=p_max.id
-                           GROUP BY p_max.id, p0.repetition) t
-                ON t.project_id = p.id
-            WHERE p.id = (%(pk)s)
+              p.*,
+              r.completed,
+              r.awaiting_review,
+              greatest(r.total - r.completed - r.awaiting_review, 0) in_progress
+            FROM crowdsourcing_projectgrouprollup r
+              INNER JOIN crowdsourcing_project p ON p.id = r.project_id
+            WHERE r.owner_id = (%(owner_id)s) AND r.project_id = (%(pk)s)
         '''
         projects = Project.objects.raw(query, params={'owner_id': request.user.id, "pk": kwargs.get('pk')})
         serializer = ProjectSerializer(instance=projects, many=True,
@@ -513,6 +473,7 @@ class ProjectViewSet(mixins.RetrieveModelMixin, mixins.CreateModelMixin, mixins.
         if project_serializer.is_valid():
             with transaction.atomic():
                 project_serializer.fork()
+                refresh_project_rollups([project_serializer.instance.id])
             return Response(data=project_serializer.data, status=status.HTTP_200_OK)
         else:
             raise serializers.ValidationError(detail=project_serializer.errors)
@@ -549,11 +510,12 @@ class ProjectViewSet(mixins.RetrieveModelMixin, mixins.CreateModelMixin, mixins.
         query = '''
             SELECT count(t.id) remaining
             FROM crowdsourcing_task t INNER JOIN (SELECT
-                                                    group_id,
-                                                    max(id) id
-                                                  FROM crowdsourcing_task
-                                                  WHERE deleted_at IS NULL
-                                                  GROUP BY group_id) t_max ON t_max.id = t.id
+                                                    t.group_id,
+                                                    max(t.id) id
+                                                  FROM crowdsourcing_task t
+                                                    INNER JOIN crowdsourcing_project p ON p.id = t.project_id
+                                                  WHERE t.deleted_at IS NULL AND p.group_id = %(group_id)s
+                                                  GROUP BY t.group_id) t_max ON t_max.id = t.id
               INNER JOIN crowdsourcing_project p ON p.id = t.project_id
               INNER JOIN (
                            SELECT
@@ -572,15 +534,18 @@ class ProjectViewSet(mixins.RetrieveModelMixin, mixins.CreateModelMixin, mixins.
                                       THEN 1
                                     ELSE 0 END others
                                   FROM crowdsourcing_task t
+                                    INNER JOIN crowdsourcing_project p ON p.id = t.project_id
                                     LEFT OUTER JOIN crowdsourcing_taskworker tw ON (t.id =
                                                                                     tw.task_id)
-                                  WHERE t.exclude_at IS NULL AND t.deleted_at IS NULL) t
+                                  WHERE t.exclude_at IS NULL AND t.deleted_at IS NULL
+                                        AND p.group_id = %(group_id)s) t
                            GROUP BY t.group_id) t_count ON t_count.group_id = t.group_id
             WHERE t_count.own = 0 AND t_count.others < p.repetition AND p.id = %(project_id)s
         '''
         params = {
             "worker_id": request.user.id,
             "project_id": latest_revision.id,
+            "group_id": group_id
         }
         cursor = connection.cursor()
         cursor.execute(query, params)
@@ -697,6 +662,7 @@ class ProjectViewSet(mixins.RetrieveModelMixin, mixins.CreateModelMixin, mixins.
         project = self.get_object()
         with transaction.atomic():
             revision = self.serializer_class.create_revision(instance=project)
+            refresh_project_rollups([revision.id])
         return Response(data={'id': revision.id}, status=status.HTTP_200_OK)
 
     @detail_route(methods=['get'], url_path='relaunch-info')
@@ -800,6 +766,9 @@ class ProjectViewSet(mixins.RetrieveModelMixin, mixins.CreateModelMixin, mixins.
                 request.user.stripe_customer.save()
                 project.amount_due += to_pay
                 project.save()
+                if project.post_mturk:
+                    task_group_ids = [t.group_id for t in task_objects]
+                    transaction.on_commit(lambda: mark_mturk_hits_dirty(task_group_ids))
 
         return Response(data=response, status=status.HTTP_201_CREATED)
 
@@ -1018,19 +987,19 @@ class ProjectViewSet(mixins.RetrieveModelMixin, mixins.CreateModelMixin, mixins.
             status__in=[2, 3, 5],
             submitted_at__isnull=False,
             submitted_at__lte=up_to,
-            task__project_id=obj.id).order_by(*order_by_clause)
-        task_workers = self.paginate_queryset(task_workers)
+            task__project_id=obj.id)
+        paginator = KeysetPagination(order_by_clause + ('-id',))
+        task_workers = paginator.paginate_queryset(task_workers, request)
 
         serializer = TaskWorkerSerializer(instance=task_workers, many=True,
                                           fields=('id', 'results', 'worker', 'status', 'task',
                                                   'worker_alias', 'worker_rating', 'attempt',
                                                   'submitted_at', 'approved_at', 'task_data', 'task_template'))
 
-        response = self.get_paginated_response(serializer.data)
         if sort_by == 'worker_id':
-            grouped_responses = self._group_by_worker(response.data['results'])
+            grouped_responses = self._group_by_worker(serializer.data)
         else:
-            grouped_responses = response.data['results']
+            grouped_responses = serializer.data
 
         if obj.aux_attributes is None:
             obj.aux_attributes = {}
@@ -1038,7 +1007,7 @@ class ProjectViewSet(mixins.RetrieveModelMixin, mixins.CreateModelMixin, mixins.
         obj.save()
         # group_by_worker.sort(key=lambda x: x['tasks'].count, reverse=True)
         return Response(
-            data={"workers": grouped_responses, "count": response.data['count'], "next": response.data['next'],
+            data={"workers": grouped_responses, "count": paginator.count, "next": paginator.get_next_link(),
                   "up_to": up_to,
                   "project_template": TemplateSerializer(instance=obj.template).data, 'sort_by': sort_by},
             status=status.HTTP_200_OK)
@@ -1065,19 +1034,39 @@ class ProjectViewSet(mixins.RetrieveModelMixin, mixins.CreateModelMixin, mixins.
     @detail_route(methods=['get'], url_path='last-opened')
     def last_opened(self, request, *args, **kwargs):
         project = self.get_object()
-        last_opened_at = copy.copy(project.last_opened_at)
-        project.last_opened_at = timezone.now()
-        project.save()
+        last_opened_at = get_buffered_timestamp('last_opened_at', project.id, project.last_opened_at)
+        buffer_timestamp('last_opened_at', project.id)
         return Response({"last_opened_at": last_opened_at, "id": project.id})
 
+    AGE_GROUPS = ("0 - 17", "18 - 24", "25 - 34", "35 - 44", "45 - 54", "55 - 64", "65+")
+
     @detail_route(methods=['get'], url_path='worker-demographics')
     def worker_statistics(self, request, *args, **kwargs):
         project = self.get_object()
-        worker_ids = TaskWorker.objects.prefetch_related('worker__profile').filter(
+        redis_provider = RedisProvider()
+        statistics_key, workers_key, generation_key = worker_statistics_keys(project.group_id)
+        cached = redis_provider.get(statistics_key)
+        if cached is not None:
+            return Response(json.loads(cached))
+        generation = redis_provider.get(generation_key)
+
+        worker_ids = list(TaskWorker.objects.filter(
             task__project__group_id=project.group_id,
             status__in=[TaskWorker.STATUS_SUBMITTED, TaskWorker.STATUS_ACCEPTED,
-                        TaskWorker.STATUS_RETURNED]).values_list('worker_id', flat=True)
-        profiles = models.UserProfile.objects.prefetch_related('address__city').filter(user_id__in=worker_ids)
+                        TaskWorker.STATUS_RETURNED]).values_list('worker_id', flat=True).distinct())
+        response_data = self.calculate_worker_statistics(worker_ids)
+        # the statistics only change when a new worker submits, see crowdsourcing.utils.mark_worker_submitted
+        redis_provider.delete(workers_key)
+        if len(worker_ids):
+            redis_provider.set_add(workers_key, *worker_ids)
+        redis_provider.set(statistics_key, json.dumps(response_data), expire=settings.WORKER_STATISTICS_CACHE_SECONDS)
+        # a worker who submitted for the first time since worker_ids were read may be missing from them
+        if redis_provider.get(generation_key) != generation:
+            redis_provider.delete(statistics_key)
+        return Response(response_data)
+
+    @staticmethod
+    def calculate_worker_statistics(worker_ids):
         response_data = {
             "results": 0,
             "education": {
@@ -1096,60 +1085,59 @@ class ProjectViewSet(mixins.RetrieveModelMixin, mixins.CreateModelMixin, mixins.
                 "Unspecified": 0
             }
         }
-        if len(profiles) >= settings.MIN_WORKERS_FOR_STATS:
-            for p in profiles:
-                response_data["results"] += 1
-                if p.education is None:
-                    response_data["education"]["Unspecified"] += 1
-                else:
-                    if p.get_education_display() not in response_data["education"]:
-                        response_data["education"][p.get_education_display()] = 0
-                    response_data["education"][p.get_education_display()] += 1
-
-                if p.ethnicity is None:
-                    response_data["ethnicity"]["Unspecified"] += 1
-                else:
-                    if p.get_ethnicity_display() not in response_data["ethnicity"]:
-                        response_data["ethnicity"][p.get_ethnicity_display()] = 0
-                    response_data["ethnicity"][p.get_ethnicity_display()] += 1
-                if p.gender is None:
-                    response_data["gender"]["Unspecified"] += 1
-                else:
-                    if p.get_gender_display() not in response_data["gender"]:
-                        response_data["gender"][p.get_gender_display()] = 0
-                    response_data["gender"][p.get_gender_display()] += 1
-                if p.address is None:
-                    response_data["location"]["Unspecified"] += 1
-                else:
-                    location = p.address.city.state_code
-                    if location not in response_data["location"]:
-                        response_data["location"][location] = 0
-                    response_data["location"][location] += 1
+        if len(worker_ids) < settings.MIN_WORKERS_FOR_STATS:
+            return response_data
 
-                if p.birthday is None:
-                    response_data["age"]["Unspecified"] += 1
-                else:
-                    age_group = None
-                    age = int((timezone.now() - p.birthday).days / 365.25)
-                    if age < 18:
-                        age_group = "0 - 17"
-                    elif 18 <= age <= 24:
-                        age_group = "18 - 24"
-                    elif 25 <= age <= 34:
-                        age_group = "25 - 34"
-                    elif 35 <= age <= 44:
-                        age_group = "35 - 44"
-                    elif 45 <= age <= 54:
-                        age_group = "45 - 54"
-                    elif 55 <= age <= 64:
-                        age_group = "55 - 64"
-                    elif age > 64:
-                        age_group = "65+"
-                    if age_group not in response_data["age"]:
-                        response_data["age"][age_group] = 0
-                    response_data["age"][age_group] += 1
+        # noinspection SqlResolve
+        query = '''
+            WITH profiles AS (
+                SELECT
+                  up.education,
+                  up.gender,
+                  up.ethnicity,
+                  c.state_code location,
+                  CASE WHEN up.birthday IS NOT NULL
+                    THEN width_bucket(floor((current_date - up.birthday :: DATE) / 365.25) :: INT,
+                                      ARRAY [18, 25, 35, 45, 55, 65]) END age
+                FROM crowdsourcing_userprofile up
+                  LEFT OUTER JOIN crowdsourcing_address a ON a.id = up.address_id
+                  LEFT OUTER JOIN crowdsourcing_city c ON c.id = a.city_id
+                WHERE up.user_id = ANY (%(worker_ids)s)
+            )
+            SELECT
+              CASE WHEN grouping(education) = 0 THEN 'education'
+              WHEN grouping(gender) = 0 THEN 'gender'
+              WHEN grouping(ethnicity) = 0 THEN 'ethnicity'
+              WHEN grouping(location) = 0 THEN 'location'
+              WHEN grouping(age) = 0 THEN 'age'
+              ELSE 'results' END dimension,
+              coalesce(education, gender, ethnicity, location, age :: TEXT) val,
+              count(*)
+            FROM profiles
+            GROUP BY GROUPING SETS ((education), (gender), (ethnicity), (location), (age), ());
+        '''
+        cursor = connection.cursor()
+        cursor.execute(query, {'worker_ids': worker_ids})
+        rows = cursor.fetchall()
+        cursor.close()
 
-        return Response(response_data)
+        total = sum(count for dimension, value, count in rows if dimension == 'results')
+        if total < settings.MIN_WORKERS_FOR_STATS:
+            return response_data
+        labels = {
+            'education': dict(models.UserProfile.EDUCATION),
+            'gender': dict(models.UserProfile.GENDER),
+            'ethnicity': dict(models.UserProfile.ETHNICITY),
+            'location': {},
+            'age': dict((str(i), label) for i, label in enumerate(ProjectViewSet.AGE_GROUPS))
+        }
+        response_data["results"] = total
+        for dimension, value, count in rows:
+            if dimension == 'results':
+                continue
+            label = "Unspecified" if value is None else labels[dimension].get(value, value)
+            response_data[dimension][label] = response_data[dimension].get(label, 0) + count
+        return response_data
 
     @detail_route(methods=['get'], url_path='discuss')
     def discuss(self, request, *args, **kwargs):
@@ -1209,18 +1197,18 @@ class ProjectViewSet(mixins.RetrieveModelMixin, mixins.CreateModelMixin, mixins.
     @detail_route(methods=['get'], url_path='time-estimate', permission_classes=[IsAuthenticated])
     def time_estimate(self, request, *args, **kwargs):
         project = self.get_object()
-        other_workers = TaskWorker.objects.filter(~Q(worker=request.user), submitted_at__isnull=False,
-                                                  task__project__group_id=project.group_id,
-                                                  status__in=[TaskWorker.STATUS_ACCEPTED, TaskWorker.STATUS_SUBMITTED])
-        this_worker = TaskWorker.objects.filter(worker=request.user, submitted_at__isnull=False,
-                                                task__project__group_id=project.group_id,
-                                                status__in=[TaskWorker.STATUS_ACCEPTED, TaskWorker.STATUS_SUBMITTED])
-
-        others_time = [(ow.submitted_at - ow.created_at).total_seconds() for ow in other_workers]
-        this_time = [(tw.submitted_at - tw.created_at).total_seconds() for tw in this_worker]
-        return Response(
-            {"self_time_estimate": math.ceil(np.median(this_time)) if this_time else None,
-             "others_time_estimate": math.ceil(np.median(others_time)) if others_time else None})
+        group_sketch = models.TaskDurationSketch.objects.filter(project_group_id=project.group_id).first()
+        worker_sketch = models.WorkerTaskDurationSketch.objects.filter(project_group_id=project.group_id,
+                                                                       worker=request.user).first()
+        this_time = worker_sketch.counts if worker_sketch is not None else None
+        others_time = sketches.subtract(group_sketch.counts, this_time) if group_sketch is not None else None
+
+        response_data = {}
+        for key, counts in (('self_time', this_time), ('others_time', others_time)):
+            for suffix, q in (('estimate', 0.5), ('p25', 0.25), ('p90', 0.9)):
+                value = sketches.quantile(counts, q)
+                response_data[key + '_' + suffix] = math.ceil(value) if value is not None else None
+        return Response(response_data)
 
     @list_route(methods=['get'], url_path='workers')
     def workers(self, request, *args, **kwargs):
@@ -1236,16 +1224,13 @@ class ProjectViewSet(mixins.RetrieveModelMixin, mixins.CreateModelMixin, mixins.
 
     @detail_route(methods=['get'], url_path='tasks')
     def tasks(self, request, *args, **kwargs):
-        tasks = self.get_object().tasks.all()
+        paginator = KeysetPagination(('id',))
+        tasks = paginator.paginate_queryset(self.get_object().tasks.all(), request)
 
-        return Response({
-            "count": tasks.count(),
-            "next": None,
-            "previous": None,
-            "results": TaskSerializer(instance=tasks, many=True,
-                                      fields=('id', 'group_id', 'data', 'hash', 'project',
-                                              'created_at', 'price', 'row_number')).data
-        })
+        return Response(paginator.get_paginated_data(
+            TaskSerializer(instance=tasks, many=True,
+                           fields=('id', 'group_id', 'data', 'hash', 'project',
+                                   'created_at', 'price', 'row_number')).data))
 
     @detail_route(methods=['get'], url_path='assignment-results')
     def assignment_results(self, request, pk, *args, **kwargs):
@@ -1256,3 +1241,50 @@ class ProjectViewSet(mixins.RetrieveModelMixin, mixins.CreateModelMixin, mixins.
                                                            'created_at', 'updated_at', 'attachment',
                                                            'assignment_id')).data
         return Response(response_data)
+
+    @detail_route(methods=['get'], url_path='results-feed')
+    def results_feed(self, request, pk, *args, **kwargs):
+        """
+            Incremental changefeed of submitted results across all revisions of the project, ordered by
+            (updated_at, id). Pass the returned cursor back to receive only results created or changed since.
+        """
+        project = self.get_object()
+        try:
+            limit = int(request.query_params.get('limit', settings.RESULTS_FEED_PAGE_SIZE))
+        except ValueError:
+            raise serializers.ValidationError(detail=daemo_error("Limit must be an integer."))
+        limit = max(1, min(limit, settings.RESULTS_FEED_MAX_PAGE_SIZE))
+        cursor = request.query_params.get('cursor')
+
+        results = TaskWorkerResult.objects.select_related('template_item').filter(
+            task_worker__task__project__group_id=project.group_id,
+            updated_at__lt=timezone.now() - timedelta(seconds=settings.RESULTS_FEED_SETTLE_SECONDS))
+        if cursor is not None:
+            position = decode_cursor(cursor)
+            updated_at = None
+            if position is not None and len(position) == 2 and isinstance(position[0], basestring) \
+                    and isinstance(position[1], (int, long)) and not isinstance(position[1], bool):
+                try:
+                    updated_at = parse_datetime(position[0])
+                except ValueError:
+                    pass
+            if updated_at is None:
+                raise serializers.ValidationError(detail=daemo_error("Invalid cursor."))
+            results = results.filter(Q(updated_at__gt=updated_at) | Q(updated_at=updated_at, id__gt=position[1]))
+
+        page = list(results.order_by('updated_at', 'id')[:limit + 1])
+        has_more = len(page) > limit
+        page = page[:limit]
+        if len(page):
+            cursor = encode_cursor([page[-1].updated_at.isoformat(), page[-1].id])
+
+        response_data = TaskWorkerResultSerializer(instance=page,
+                                                   many=True,
+                                                   fields=('id', 'template_item', 'key', 'result',
+                                                           'created_at', 'updated_at', 'attachment',
+                                                           'assignment_id')).data
+        return Response({
+            "results": response_data,
+            "cursor": cursor,
+            "has_more": has_more
+        })
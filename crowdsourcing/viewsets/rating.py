@@ -1,11 +1,11 @@
-from django.db import transaction
+from django.db import connection, transaction
 from django.db.models import Q
 from rest_framework import status, viewsets, serializers
 from rest_framework.decorators import list_route
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
-from crowdsourcing.models import Rating, TaskWorker, Project, RawRatingFeedback, Match
+from crowdsourcing.models import Rating, TaskWorker, Project, RawRatingFeedbackBounds, Match
 from crowdsourcing.permissions.rating import IsRatingOwner
 from crowdsourcing.serializers.project import ProjectSerializer
 from crowdsourcing.serializers.rating import RatingSerializer
@@ -83,43 +83,165 @@ class WorkerRequesterRatingViewset(viewsets.ModelViewSet):
         if task_workers.count() != len(ratings):
             raise serializers.ValidationError(
                 detail={"message": "Task worker ids are not valid, or do not belong to this project"})
-        raw_ratings = []
+        raw_ratings = {}
         for r in ratings:
-            raw_ratings.append(RawRatingFeedback(requester_id=origin_id, worker_id=r['worker_id'], weight=r['weight'],
-                                                 task_id=r['task_id']))
+            raw_ratings[(r['worker_id'], r['task_id'])] = float(r['weight'])
+        params = {
+            'requester_id': origin_id,
+            'project_group_id': project_group_id,
+            'ignore_history': bool(ignore_history),
+            'origin_type': origin_type,
+            'worker_ids': [k[0] for k in raw_ratings.keys()],
+            'task_ids': [k[1] for k in raw_ratings.keys()],
+            'weights': list(raw_ratings.values())
+        }
         with transaction.atomic():
-            RawRatingFeedback.objects.filter(task_id__in=task_ids, worker_id__in=worker_ids,
-                                             requester_id=origin_id).delete()
-            RawRatingFeedback.objects.filter(requester_id=origin_id, task__project__group_id=project_group_id).update(
-                is_excluded=ignore_history)
-            RawRatingFeedback.objects.bulk_create(raw_ratings)
+            bounds, _ = RawRatingFeedbackBounds.objects.select_for_update().get_or_create(
+                requester_id=origin_id, project_group_id=project_group_id)
+            cursor = connection.cursor()
+            cursor.execute(self.exclude_history_query, params)
+            history_changed = cursor.rowcount > 0
+            excluded = [(worker_id, task_id) for worker_id, task_id, is_excluded in cursor.fetchall() if is_excluded]
+            removed_worker_ids = []
+            if len(excluded):
+                # ratings of the history that is now ignored go, as they did before the feedback was upserted
+                cursor.execute(self.delete_excluded_ratings_query,
+                               dict(params, excluded_worker_ids=[e[0] for e in excluded],
+                                    excluded_task_ids=[e[1] for e in excluded]))
+                removed_worker_ids = [row[0] for row in cursor.fetchall()]
+            cursor.execute(self.upsert_raw_ratings_query, params)
+            cursor.execute(self.update_bounds_query, dict(params, bounds_id=bounds.id))
+            min_weight, max_weight = cursor.fetchone()
+            bounds_changed = (min_weight, max_weight) != (bounds.min_weight, bounds.max_weight)
 
-            raw_ratings_obj = RawRatingFeedback.objects.filter(requester_id=origin_id,
-                                                               task__project__group_id=project_group_id,
-                                                               is_excluded=False)
+            # the weights of the other raw ratings only move when the bounds or the history changed
+            cursor.execute(self.sync_ratings_query, dict(params, min_weight=min_weight, max_weight=max_weight,
+                                                         whole_group=history_changed or bounds_changed))
+            changed_worker_ids = list(set([row[0] for row in cursor.fetchall()] + removed_worker_ids))
 
-            all_ratings = [{"weight": rr.weight, "worker_id": rr.worker_id, "task_id": rr.task_id} for rr in
-                           raw_ratings_obj]
-            all_worker_ids = [rr.worker_id for rr in raw_ratings_obj]
-            min_val = min([r['weight'] for r in all_ratings])
-            max_val = max([r['weight'] for r in all_ratings]) - min_val
+        if len(changed_worker_ids):
+            update_worker_boomerang.delay(origin_id, project_group_id, worker_ids=changed_worker_ids)
 
-            rating_objects = []
+        return Response(data={"message": "Success"}, status=status.HTTP_201_CREATED)
 
-            for rating in all_ratings:
-                rating['weight'] = 1 + (round(float(rating['weight'] -
-                                                    min_val) / max_val, 2) * 2) if max_val != 0 else 2.0
-                rating_objects.append(
-                    Rating(origin_type=origin_type, origin_id=origin_id, target_id=rating['worker_id'],
-                           task_id=rating['task_id'], weight=rating['weight']))
+    # noinspection SqlResolve
+    exclude_history_query = '''
+        UPDATE crowdsourcing_rawratingfeedback rr
+        SET is_excluded = %(ignore_history)s, updated_at = now()
+        FROM crowdsourcing_task t
+          INNER JOIN crowdsourcing_project p ON p.id = t.project_id
+        WHERE t.id = rr.task_id
+              AND rr.requester_id = %(requester_id)s
+              AND p.group_id = %(project_group_id)s
+              AND rr.is_excluded <> %(ignore_history)s
+              AND (rr.worker_id, rr.task_id) NOT IN (
+                SELECT *
+                FROM unnest(%(worker_ids)s :: INTEGER [], %(task_ids)s :: INTEGER []))
+        RETURNING rr.worker_id, rr.task_id, rr.is_excluded;
+    '''
 
-            Rating.objects.filter(origin_type=origin_type, origin_id=origin_id, target_id__in=all_worker_ids,
-                                  task__project__group_id=project_group_id).delete()
-            Rating.objects.bulk_create(rating_objects)
+    # noinspection SqlResolve
+    delete_excluded_ratings_query = '''
+        DELETE FROM crowdsourcing_rating r
+        USING unnest(%(excluded_worker_ids)s :: INTEGER [], %(excluded_task_ids)s :: INTEGER []) e (worker_id, task_id)
+        WHERE r.origin_id = %(requester_id)s
+              AND r.origin_type = %(origin_type)s
+              AND r.target_id = e.worker_id
+              AND r.task_id = e.task_id
+        RETURNING r.target_id;
+    '''
 
-        update_worker_boomerang.delay(origin_id, project_group_id)
+    # noinspection SqlResolve
+    upsert_raw_ratings_query = '''
+        INSERT INTO crowdsourcing_rawratingfeedback (created_at, updated_at, requester_id, worker_id, task_id, weight,
+                                                     is_excluded)
+          SELECT
+            now(),
+            now(),
+            %(requester_id)s,
+            r.worker_id,
+            r.task_id,
+            r.weight,
+            FALSE
+          FROM unnest(%(worker_ids)s :: INTEGER [], %(task_ids)s :: INTEGER [],
+                      %(weights)s :: DOUBLE PRECISION []) r (worker_id, task_id, weight)
+        ON CONFLICT (requester_id, worker_id, task_id)
+          DO UPDATE SET weight = excluded.weight, is_excluded = FALSE, updated_at = now();
+    '''
 
-        return Response(data={"message": "Success"}, status=status.HTTP_201_CREATED)
+    # noinspection SqlResolve
+    update_bounds_query = '''
+        UPDATE crowdsourcing_rawratingfeedbackbounds b
+        SET min_weight = agg.min_weight, max_weight = agg.max_weight, updated_at = now()
+        FROM (
+               SELECT
+                 min(rr.weight) min_weight,
+                 max(rr.weight) max_weight
+               FROM crowdsourcing_rawratingfeedback rr
+                 INNER JOIN crowdsourcing_task t ON t.id = rr.task_id
+                 INNER JOIN crowdsourcing_project p ON p.id = t.project_id
+               WHERE rr.requester_id = %(requester_id)s
+                     AND p.group_id = %(project_group_id)s
+                     AND rr.is_excluded = FALSE
+             ) agg
+        WHERE b.id = %(bounds_id)s
+        RETURNING b.min_weight, b.max_weight;
+    '''
+
+    # noinspection SqlResolve
+    sync_ratings_query = '''
+        WITH normalized AS (
+            SELECT
+              rr.worker_id,
+              rr.task_id,
+              CASE WHEN %(max_weight)s > %(min_weight)s
+                THEN 1 + round(((rr.weight - %(min_weight)s) / (%(max_weight)s - %(min_weight)s)) :: NUMERIC, 2) * 2
+              ELSE 2.0 END :: DOUBLE PRECISION weight
+            FROM crowdsourcing_rawratingfeedback rr
+              INNER JOIN crowdsourcing_task t ON t.id = rr.task_id
+              INNER JOIN crowdsourcing_project p ON p.id = t.project_id
+            WHERE rr.requester_id = %(requester_id)s
+                  AND p.group_id = %(project_group_id)s
+                  AND rr.is_excluded = FALSE
+                  AND (%(whole_group)s OR (rr.worker_id, rr.task_id) IN (
+                    SELECT *
+                    FROM unnest(%(worker_ids)s :: INTEGER [], %(task_ids)s :: INTEGER [])))
+        ), updated AS (
+            UPDATE crowdsourcing_rating r
+            SET weight = n.weight, updated_at = now()
+            FROM normalized n
+            WHERE r.origin_id = %(requester_id)s
+                  AND r.origin_type = %(origin_type)s
+                  AND r.target_id = n.worker_id
+                  AND r.task_id = n.task_id
+                  AND r.weight <> n.weight
+            RETURNING r.target_id
+        ), inserted AS (
+            INSERT INTO crowdsourcing_rating (created_at, updated_at, origin_id, target_id, task_id, weight,
+                                              origin_type)
+              SELECT
+                now(),
+                now(),
+                %(requester_id)s,
+                n.worker_id,
+                n.task_id,
+                n.weight,
+                %(origin_type)s
+              FROM normalized n
+              WHERE NOT exists(SELECT 1
+                               FROM crowdsourcing_rating r
+                               WHERE r.origin_id = %(requester_id)s
+                                     AND r.origin_type = %(origin_type)s
+                                     AND r.target_id = n.worker_id
+                                     AND r.task_id = n.task_id)
+            RETURNING target_id
+        )
+        SELECT target_id
+        FROM updated
+        UNION
+        SELECT target_id
+        FROM inserted;
+    '''
 
     @list_route(methods=['get'], url_path='list-by-target')
     def list_by_target(self, request, *args, **kwargs):
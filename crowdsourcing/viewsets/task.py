@@ -2,33 +2,34 @@ import datetime
 import json
 from decimal import Decimal, ROUND_UP
 
+import numpy as np
 import trueskill
-from django.conf import settings
 from django.db import connection
+from django.db.models import F
 from django.shortcuts import get_object_or_404
 from django.utils.decorators import method_decorator
 from django.utils.timezone import utc
 from django.views.decorators.csrf import csrf_exempt
-from hashids import Hashids
 from rest_framework import status, viewsets
 from rest_framework.decorators import detail_route, list_route
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from ws4redis.publisher import RedisPublisher
-from ws4redis.redis_store import RedisMessage
 
-from crowdsourcing import constants
+from crowdsourcing import constants, notifications, outbox
+from crowdsourcing.crypto import get_hasher
 from crowdsourcing.exceptions import daemo_error
 from crowdsourcing.models import Task, TaskWorker, TaskWorkerResult, UserPreferences, ReturnFeedback, \
-    User, MatchGroup, Batch, Match, WorkerMatchScore, MatchWorker
+    User, MatchGroup, Batch, Match, WorkerMatchScore, MatchWorker, WorkerProjectScore
 from crowdsourcing.permissions.task import IsTaskOwner, IsQualified  # HasExceededReservedLimit
 from crowdsourcing.permissions.util import IsSandbox
 from crowdsourcing.serializers.project import ProjectSerializer
 from crowdsourcing.serializers.task import *
-from crowdsourcing.tasks import update_worker_cache, refund_task, send_return_notification_email
+from crowdsourcing.tasks import update_worker_cache, refund_task, send_return_notification_email, \
+    record_task_duration
 from crowdsourcing.utils import get_model_or_none, hash_as_set, \
-    get_review_redis_message, hash_task
+    get_review_redis_message, hash_task, mark_project_rollups_dirty, mark_worker_earnings_dirty, \
+    mark_worker_submitted, KeysetPagination
 from crowdsourcing.validators.project import validate_account_balance
 from mturk.tasks import mturk_hit_update, mturk_approve, mturk_reject
 
@@ -53,103 +54,87 @@ def generate_matches(task_worker_ids, review_project, is_inter_task, match_group
         SELECT
             tw.id,
             tw.worker_id,
-            coalesce(match_workers.mu, 25.0) mu,
-            coalesce(match_workers.sigma, 8.333) sigma,
+            coalesce(s.mu, 25.0) mu,
+            coalesce(s.sigma, 8.333) sigma,
             u.username,
             tw.task_id
-        FROM
-            crowdsourcing_taskworker tw
-        INNER JOIN auth_user u
-            ON u.id = tw.worker_id
-        LEFT OUTER JOIN (
-            SELECT *
-            FROM (
-                SELECT
-                    max_mw.project_group_id,
-                    max_mw.worker_id,
-                    mw.sigma,
-                    mw.mu,
-                    tw.id task_worker_id
-                FROM crowdsourcing_matchworker mw
-                INNER JOIN crowdsourcing_match m
-                    ON m.id = mw.match_id
-                INNER JOIN crowdsourcing_taskworker tw ON tw.id = mw.task_worker_id
-                INNER JOIN crowdsourcing_task t ON t.id = tw.task_id
-                INNER JOIN crowdsourcing_project p ON p.id = t.project_id
-                INNER JOIN (
-                    SELECT
-                        p.group_id           project_group_id,
-                        tw.worker_id,
-                        max(m.submitted_at) submitted_at
-                    FROM crowdsourcing_matchworker mw
-                    INNER JOIN crowdsourcing_match m ON m.id = mw.match_id
-                    INNER JOIN crowdsourcing_taskworker tw ON tw.id = mw.task_worker_id
-                    INNER JOIN crowdsourcing_task t ON t.id = tw.task_id
-                    INNER JOIN crowdsourcing_project p ON p.id = t.project_id
-                    GROUP BY p.group_id, tw.worker_id
-                ) max_mw
-                    ON max_mw.project_group_id = p.group_id AND max_mw.worker_id = tw.worker_id AND
-                        max_mw.submitted_at = m.submitted_at
-            ) mw
-        ) match_workers
-            ON match_workers.task_worker_id = tw.id
+        FROM crowdsourcing_taskworker tw
+        INNER JOIN auth_user u ON u.id = tw.worker_id
+        INNER JOIN crowdsourcing_task t ON t.id = tw.task_id
+        INNER JOIN crowdsourcing_project p ON p.id = t.project_id
+        LEFT OUTER JOIN crowdsourcing_workerprojectscore s
+            ON s.worker_id = tw.worker_id AND s.project_group_id = p.group_id
         WHERE tw.id = ANY(%(ids)s);
     '''
     cursor.execute(query, {'ids': task_worker_ids})
-    worker_scores = cursor.fetchall()
+    worker_scores = sorted(cursor.fetchall(), key=lambda ws: (ws[5], ws[0]))
+    pairs = []
+
+    if not is_inter_task and len(worker_scores):  # TODO add inter task support later
+        task_ids = np.array([ws[5] for ws in worker_scores])
+        worker_ids = np.array([ws[1] for ws in worker_scores])
+        mu = np.array([ws[2] for ws in worker_scores], dtype=float)
+        sigma = np.array([ws[3] for ws in worker_scores], dtype=float)
+        # rows are sorted by task and workers are only matched within a task, so match one block at a time
+        boundaries = np.flatnonzero(np.diff(task_ids)) + 1
+        for start, end in zip(np.concatenate(([0], boundaries)), np.concatenate((boundaries, [len(task_ids)]))):
+            quality = match_quality_matrix(mu[start:end], sigma[start:end])
+            pairs.extend([(start + i, start + j) for i, j in greedy_pairs(quality, worker_ids[start:end])])
+
+    tasks = [Task(data={"task_workers": [{'username': worker_scores[i][4], 'task_worker': worker_scores[i][0]},
+                                         {'username': worker_scores[j][4], 'task_worker': worker_scores[j][0]}]},
+                  batch_id=match_group.batch_id, project_id=review_project.id, min_rating=1.99)
+             for i, j in pairs]
+    Task.objects.bulk_create(tasks)
+    Task.objects.filter(id__in=[t.id for t in tasks]).update(group_id=F('id'))
+    matches = [Match(group=match_group, task=task) for task in tasks]
+    Match.objects.bulk_create(matches)
+
     match_workers = []
     newly_matched = []
-
-    if not is_inter_task:  # TODO add inter task support later
-        to_match = {}
-        for worker_score in worker_scores:
-            task_id = str(worker_score[5])
-            if task_id not in to_match:
-                to_match[task_id] = []
-            to_match[task_id].append(worker_score)
-
-        for task_id in to_match:
-            length = len(to_match[task_id])
-
-            for i, worker_score in enumerate(to_match[task_id]):
-                if worker_score in newly_matched:
-                    continue
-                score_one = worker_score
-
-                rating_one = trueskill.Rating(mu=score_one[2], sigma=score_one[3])
-                best_quality = 0
-                score_two = None
-                for inner_ws in to_match[task_id]:
-                    if inner_ws != score_one and \
-                        (inner_ws not in newly_matched or (length - 1 == i and i % 2 == 0)) and \
-                            score_one[1] != inner_ws[1] and score_one[5] == inner_ws[5]:
-                        rating_two = trueskill.Rating(mu=inner_ws[2], sigma=inner_ws[3])
-                        match_quality = trueskill.quality_1vs1(rating_one, rating_two)
-                        if match_quality > best_quality:
-                            best_quality = match_quality
-                            score_two = inner_ws
-
-                if score_two is not None:
-                    newly_matched.append(score_one)
-                    newly_matched.append(score_two)
-                    task = Task.objects.create(
-                        data={"task_workers": [{'username': score_one[4], 'task_worker': score_one[0]},
-                                               {'username': score_two[4], 'task_worker': score_two[0]}]},
-                        batch_id=match_group.batch_id, project_id=review_project.id, min_rating=1.99)
-                    task.group_id = task.id
-                    task.save()
-                    match = Match.objects.create(group=match_group, task=task)
-                    match_workers.append(
-                        MatchWorker(match=match, task_worker_id=score_one[0], old_mu=score_one[2],
-                                    old_sigma=score_one[3])
-                    )
-                    match_workers.append(
-                        MatchWorker(match=match, task_worker_id=score_two[0], old_mu=score_two[2],
-                                    old_sigma=score_two[3])
-                    )
+    for match, (i, j) in zip(matches, pairs):
+        for score in [worker_scores[i], worker_scores[j]]:
+            newly_matched.append(score[0])
+            match_workers.append(MatchWorker(match=match, task_worker_id=score[0], old_mu=score[2],
+                                             old_sigma=score[3]))
     MatchWorker.objects.bulk_create(match_workers)
-    # Task.objects.bulk_create(review_tasks)
-    return [s[0] for s in newly_matched]
+    return newly_matched
+
+
+def match_quality_matrix(mu, sigma):
+    """
+    Pairwise trueskill.quality_1vs1 of all ratings, computed with its closed form
+    sqrt(2b^2 / c) * exp(-(mu_1 - mu_2)^2 / 2c) where c = 2b^2 + sigma_1^2 + sigma_2^2.
+    The diagonal is set to 0.
+    """
+    beta_sq = trueskill.global_env().beta ** 2
+    c = 2 * beta_sq + sigma[:, None] ** 2 + sigma[None, :] ** 2
+    quality = np.sqrt(2 * beta_sq / c) * np.exp(-(mu[:, None] - mu[None, :]) ** 2 / (2 * c))
+    np.fill_diagonal(quality, 0)
+    return quality
+
+
+def greedy_pairs(quality, worker_ids):
+    """
+    Pair every player, in order, with its best unmatched opponent of a different worker. When the count is odd
+    the last player is paired with its best opponent among those already matched.
+    """
+    length = len(worker_ids)
+    available = np.ones(length, dtype=bool)
+    pairs = []
+    for i in xrange(length):
+        if not available[i]:
+            continue
+        candidates = worker_ids != worker_ids[i]
+        if not (length - 1 == i and i % 2 == 0):
+            candidates &= available
+        candidates[i] = False
+        scores = np.where(candidates, quality[i], 0)
+        j = int(np.argmax(scores))
+        if scores[j] > 0:
+            available[i] = available[j] = False
+            pairs.append((i, j))
+    return pairs
 
 
 def make_matchups(workers_to_match, project_group_id, review_project, inter_task_review, match_group_id, batch_id):
@@ -234,31 +219,40 @@ def update_ts_scores(task_worker, winner_id):
     if task_worker.task.project.is_review:
         match = Match.objects.filter(task=task_worker.task).first()
         if match is not None:
-            match_workers = MatchWorker.objects.prefetch_related('task_worker').filter(match=match)
+            match_workers = MatchWorker.objects.select_related('task_worker__task__project').filter(match=match)
             winner = [w for w in match_workers if w.task_worker_id == int(winner_id)][0]
             loser = [w for w in match_workers if w.task_worker_id != int(winner_id)][0]
-            winner_project_ts = MatchWorker.objects.prefetch_related('task_worker').filter(
-                task_worker__worker=winner.task_worker.worker, match__status=Match.STATUS_COMPLETED).order_by(
-                '-match__submitted_at').first()
-            loser_project_ts = MatchWorker.objects.prefetch_related('task_worker').filter(
-                task_worker__worker=loser.task_worker.worker, match__status=Match.STATUS_COMPLETED).order_by(
-                '-match__submitted_at').first()
-            loser_ts = trueskill.Rating(mu=loser_project_ts.mu if loser_project_ts is not None else loser.old_mu,
-                                        sigma=loser_project_ts.sigma if loser_project_ts is not None
-                                        else loser.old_sigma)
-            winner_ts = trueskill.Rating(mu=winner_project_ts.mu if winner_project_ts is not None else winner.old_mu,
-                                         sigma=winner_project_ts.sigma if winner_project_ts is not None
-                                         else winner.old_sigma)
-            new_winner_ts, new_loser_ts = trueskill.rate_1vs1(winner_ts, loser_ts)
-            winner.mu = new_winner_ts.mu
-            winner.sigma = new_winner_ts.sigma
-            winner.save()
-            loser.mu = new_loser_ts.mu
-            loser.sigma = new_loser_ts.sigma
-            loser.save()
-            match.status = Match.STATUS_COMPLETED
-            match.submitted_at = timezone.now()
-            match.save()
+            with transaction.atomic():
+                scores = lock_project_scores(winner.task_worker.task.project.group_id, [winner, loser])
+                winner_score = scores[winner.task_worker.worker_id]
+                loser_score = scores[loser.task_worker.worker_id]
+                new_winner_ts, new_loser_ts = trueskill.rate_1vs1(
+                    trueskill.Rating(mu=winner_score.mu, sigma=winner_score.sigma),
+                    trueskill.Rating(mu=loser_score.mu, sigma=loser_score.sigma))
+                for match_worker, score, rating in [(winner, winner_score, new_winner_ts),
+                                                    (loser, loser_score, new_loser_ts)]:
+                    score.mu = match_worker.mu = rating.mu
+                    score.sigma = match_worker.sigma = rating.sigma
+                    score.save()
+                    match_worker.save()
+                match.status = Match.STATUS_COMPLETED
+                match.submitted_at = timezone.now()
+                match.save()
+
+
+def lock_project_scores(project_group_id, match_workers):
+    """
+    Fetch and lock the current skill of the workers of a match in the project group, creating it from the
+    rating the workers had when they were matched if they have none yet. Rows are locked in worker order
+    so that concurrent reviews can't deadlock.
+    """
+    scores = {}
+    for match_worker in sorted(match_workers, key=lambda mw: mw.task_worker.worker_id):
+        worker_id = match_worker.task_worker.worker_id
+        scores[worker_id], created = WorkerProjectScore.objects.select_for_update().get_or_create(
+            worker_id=worker_id, project_group_id=project_group_id,
+            defaults={'mu': match_worker.old_mu, 'sigma': match_worker.old_sigma})
+    return scores
 
 
 class TaskViewSet(viewsets.ModelViewSet):
@@ -298,7 +292,6 @@ class TaskViewSet(viewsets.ModelViewSet):
     @list_route(methods=['get'], url_path='list-data')
     def list_conflicts(self, request, *args, **kwargs):
         project = request.query_params.get('project', -1)
-        offset = int(request.query_params.get('offset', 0))
 
         # noinspection SqlResolve
         query = '''
@@ -313,15 +306,16 @@ class TaskViewSet(viewsets.ModelViewSet):
                            WHERE exclude_at IS NULL AND t.deleted_at IS NULL AND t.project_id <> (%(project_id)s)
                            GROUP BY t.group_id HAVING count(tw.id)>0) all_tasks ON all_tasks.group_id = t.group_id
             WHERE project_id = (%(project_id)s) AND deleted_at IS NULL
-            LIMIT 10 OFFSET (%(seek)s)
         '''
 
-        tasks = list(Task.objects.raw(query, params={'project_id': project, 'seek': offset}))
+        paginator = KeysetPagination(('id',), default_limit=10)
+        tasks = paginator.paginate_raw_queryset(Task.objects, query, {'project_id': project}, request)
         headers = []
         if len(tasks) > 0:
             headers = tasks[0].data.keys()[:4]
         serializer = TaskSerializer(tasks, many=True, fields=('id', 'data', 'row_number'))
-        return Response({'headers': headers, 'tasks': serializer.data})
+        return Response({'headers': headers, 'tasks': serializer.data, 'count': paginator.count,
+                         'next': paginator.get_next_link(), 'previous': paginator.get_previous_link()})
 
     def retrieve(self, request, *args, **kwargs):
         obj = self.get_object()
@@ -482,6 +476,7 @@ class TaskViewSet(viewsets.ModelViewSet):
         project = get_object_or_404(models.Project, pk=project_id)
         tasks = models.Task.objects.active().filter(~Q(project_id=project_id), project__group_id=project.group_id)
         self.serializer_class().bulk_update(tasks, {'exclude_at': project_id})
+        mark_project_rollups_dirty([project.id])
         return Response(data={}, status=status.HTTP_200_OK)
 
     @detail_route(methods=['post'], url_path='relaunch')
@@ -489,6 +484,7 @@ class TaskViewSet(viewsets.ModelViewSet):
         task = self.get_object()
         tasks = models.Task.objects.active().filter(~Q(id=task.id), group_id=task.group_id)
         self.serializer_class().bulk_update(tasks, {'exclude_at': task.project_id})
+        mark_project_rollups_dirty([task.project_id])
         return Response(data={}, status=status.HTTP_200_OK)
 
     @list_route(methods=['post'], url_path='peer-review')
@@ -581,11 +577,12 @@ class TaskWorkerViewSet(viewsets.ModelViewSet):
         with transaction.atomic():
             instance, http_status = serializer.create(worker=request.user,
                                                       project=latest_revision.id, group_id=latest_revision.group_id)
+            if http_status == 200:
+                outbox.delay(update_worker_cache, [instance.worker_id], constants.TASK_ACCEPTED)
+                outbox.delay(mturk_hit_update, {'id': instance.task_id})
         serialized_data = {}
         if http_status == 200:
             serialized_data = TaskWorkerSerializer(instance=instance, fields=('id', 'task', 'project_data')).data
-            update_worker_cache.delay([instance.worker_id], constants.TASK_ACCEPTED)
-            mturk_hit_update.delay({'id': instance.task.id})
         return Response(serialized_data, http_status)
 
     @list_route(url_path='has-project-permission')
@@ -600,6 +597,8 @@ class TaskWorkerViewSet(viewsets.ModelViewSet):
         instance, http_status = None, status.HTTP_204_NO_CONTENT
         obj.status = TaskWorker.STATUS_SKIPPED
         obj.save()
+        mark_project_rollups_dirty([obj.task.project_id])
+        mark_worker_earnings_dirty([(obj.worker_id, obj.task.project_id)])
         obj.sessions.all().filter(ended_at__isnull=True).update(ended_at=timezone.now())
         if user_prefs is not None:
             auto_accept = user_prefs.auto_accept
@@ -627,17 +626,20 @@ class TaskWorkerViewSet(viewsets.ModelViewSet):
         workers = relevant_task_workers.values_list('worker_id', flat=True)
         task_worker_ids = relevant_task_workers.values_list('id', flat=True)
 
-        if task_status == TaskWorker.STATUS_RETURNED:
-            update_worker_cache.delay(list(workers), constants.TASK_RETURNED)
-        elif task_status == TaskWorker.STATUS_REJECTED:
-            update_worker_cache.delay(list(workers), constants.TASK_REJECTED)
-            mturk_reject(list(task_worker_ids))
-        elif task_status == TaskWorker.STATUS_ACCEPTED:
-            mturk_approve.delay(list(task_worker_ids))
-
-        all_task_workers.update(status=task_status, updated_at=timezone.now())
-        if task_status == TaskWorker.STATUS_ACCEPTED:
-            all_task_workers.update(approved_at=timezone.now())
+        with transaction.atomic():
+            if task_status == TaskWorker.STATUS_RETURNED:
+                outbox.delay(update_worker_cache, list(workers), constants.TASK_RETURNED)
+            elif task_status == TaskWorker.STATUS_REJECTED:
+                outbox.delay(update_worker_cache, list(workers), constants.TASK_REJECTED)
+                mturk_reject(list(task_worker_ids))
+            elif task_status == TaskWorker.STATUS_ACCEPTED:
+                outbox.delay(mturk_approve, list(task_worker_ids))
+
+            all_task_workers.update(status=task_status, updated_at=timezone.now())
+            if task_status == TaskWorker.STATUS_ACCEPTED:
+                all_task_workers.update(approved_at=timezone.now())
+        mark_project_rollups_dirty(all_task_workers.values_list('task__project_id', flat=True))
+        mark_worker_earnings_dirty(all_task_workers.values_list('worker_id', 'task__project_id'))
 
         return Response(TaskWorkerSerializer(instance=all_task_workers, many=True,
                                              fields=('id', 'task', 'status',
@@ -656,9 +658,10 @@ class TaskWorkerViewSet(viewsets.ModelViewSet):
                                                  submitted_at__lte=up_to,
                                                  task__project_id=project_id)
         list_workers = list(chain.from_iterable(task_workers.values_list('id')))
+        earnings = list(task_workers.values_list('worker_id', 'task__project_id'))
 
-        update_worker_cache.delay(list(task_workers.values_list('worker_id', flat=True)), constants.TASK_APPROVED)
         with transaction.atomic():
+            outbox.delay(update_worker_cache, [w for w, _ in earnings], constants.TASK_APPROVED)
             task_workers.update(status=TaskWorker.STATUS_ACCEPTED, updated_at=timezone.now(),
                                 approved_at=timezone.now())
 
@@ -667,6 +670,8 @@ class TaskWorkerViewSet(viewsets.ModelViewSet):
                 .order_by('-id').first()
             latest_revision.amount_due -= Decimal(latest_revision.price * len(list_workers))
             latest_revision.save()
+        mark_project_rollups_dirty([project.id])
+        mark_worker_earnings_dirty(earnings)
         return Response(data=list_workers, status=status.HTTP_200_OK)
 
     @list_route(methods=['post'], url_path='approve-worker')
@@ -684,9 +689,10 @@ class TaskWorkerViewSet(viewsets.ModelViewSet):
                                                  worker_id=worker_id,
                                                  task__project_id=project_id)
         list_workers = list(chain.from_iterable(task_workers.values_list('id')))
+        earnings = list(task_workers.values_list('worker_id', 'task__project_id'))
 
-        update_worker_cache.delay(list(task_workers.values_list('worker_id', flat=True)), constants.TASK_APPROVED)
         with transaction.atomic():
+            outbox.delay(update_worker_cache, [w for w, _ in earnings], constants.TASK_APPROVED)
             task_workers.update(status=TaskWorker.STATUS_ACCEPTED, updated_at=timezone.now(),
                                 approved_at=timezone.now())
 
@@ -695,6 +701,8 @@ class TaskWorkerViewSet(viewsets.ModelViewSet):
                 .order_by('-id').first()
             latest_revision.amount_due -= Decimal(latest_revision.price * len(list_workers))
             latest_revision.save()
+        mark_project_rollups_dirty([project.id])
+        mark_worker_earnings_dirty(earnings)
         return Response(data=list_workers, status=status.HTTP_200_OK)
 
     @list_route(methods=['get'], url_path='list-my-tasks')
@@ -702,13 +710,17 @@ class TaskWorkerViewSet(viewsets.ModelViewSet):
         project_id = request.query_params.get('project_id', -1)
         task_workers = TaskWorker.objects.exclude(status=TaskWorker.STATUS_SKIPPED). \
             filter(worker=request.user, task__project_id=project_id)
+        paginator = KeysetPagination(('id',))
+        task_workers = paginator.paginate_queryset(task_workers, request)
         serializer = TaskWorkerSerializer(instance=task_workers, many=True,
                                           fields=(
                                               'id', 'status', 'task',
                                               'is_paid', 'return_feedback'))
         response_data = {
             "project_id": project_id,
-            "tasks": serializer.data
+            "tasks": serializer.data,
+            "count": paginator.count,
+            "next": paginator.get_next_link()
         }
         return Response(data=response_data, status=status.HTTP_200_OK)
 
@@ -720,6 +732,8 @@ class TaskWorkerViewSet(viewsets.ModelViewSet):
         task_workers = self.queryset.filter(task_id__in=task_ids, worker=request.user)
         task_workers.update(
             status=TaskWorker.STATUS_SKIPPED, updated_at=timezone.now())
+        mark_project_rollups_dirty(task_workers.values_list('task__project_id', flat=True))
+        mark_worker_earnings_dirty(task_workers.values_list('worker_id', 'task__project_id'))
         tw_serialized = self.serializer_class(task_workers, fields=('id',), many=True).data
         refund_task.delay(tw_serialized)
         return Response(data={'task_ids': task_ids}, status=status.HTTP_200_OK)
@@ -730,6 +744,7 @@ class TaskWorkerViewSet(viewsets.ModelViewSet):
         task_workers = TaskWorker.objects.filter(task__project=project).filter(
             Q(status=TaskWorker.STATUS_ACCEPTED) | Q(status=TaskWorker.STATUS_REJECTED))
         task_workers.update(is_paid=True, updated_at=timezone.now())
+        mark_worker_earnings_dirty(task_workers.values_list('worker_id', 'task__project_id'))
         return Response('Success', status.HTTP_200_OK)
 
     @list_route(methods=['get'], url_path="get-taskworker")
@@ -745,11 +760,13 @@ class TaskWorkerViewSet(viewsets.ModelViewSet):
     @list_route(methods=['get'], url_path="list-submissions")
     def list_submissions(self, request, *args, **kwargs):
         task_id = request.query_params.get('task_id', -1)
-        workers = TaskWorker.objects.filter(status__in=[2, 3, 5], task_id=task_id)
+        paginator = KeysetPagination(('id',))
+        workers = paginator.paginate_queryset(TaskWorker.objects.filter(status__in=[2, 3, 5], task_id=task_id),
+                                              request)
         serializer = TaskWorkerSerializer(instance=workers, many=True,
                                           fields=('id', 'results',
                                                   'worker_alias', 'worker_rating', 'worker', 'status'))
-        return Response(data=serializer.data, status=status.HTTP_200_OK)
+        return Response(data=paginator.get_paginated_data(serializer.data), status=status.HTTP_200_OK)
 
     @detail_route(methods=['get'], url_path='retrieve-with-data')
     def retrieve_with_data(self, request, *args, **kwargs):
@@ -820,6 +837,9 @@ class TaskWorkerViewSet(viewsets.ModelViewSet):
         instance.submitted_at = timezone.now()
         instance.status = TaskWorker.STATUS_SUBMITTED
         instance.save()
+        mark_project_rollups_dirty([instance.task.project_id])
+        mark_worker_earnings_dirty([(instance.worker_id, instance.task.project_id)])
+        mark_worker_submitted(instance.task.project.group_id, instance.worker_id)
         return Response({"message": "Assignment updated successfully!"})
 
 
@@ -911,42 +931,46 @@ class TaskWorkerResultViewSet(viewsets.ModelViewSet):
                 serializer = TaskWorkerResultSerializer(data=template_items, many=True)
 
             if serializer.is_valid():
+                first_submission = task_worker.status == TaskWorker.STATUS_IN_PROGRESS
                 task_worker.status = task_status
                 task_worker.attempt += 1
                 task_worker.submitted_at = timezone.now()
                 task_worker.save()
                 task_worker.sessions.all().filter(ended_at__isnull=True).update(ended_at=timezone.now())
+                mark_project_rollups_dirty([task_worker.task.project_id])
+                mark_worker_earnings_dirty([(task_worker.worker_id, task_worker.task.project_id)])
                 # check_project_completed.delay(project_id=task_worker.task.project_id)
                 # #send_project_completed_email.delay(project_id=task_worker.task.project_id)
                 if task_status == TaskWorker.STATUS_SUBMITTED:
-                    redis_publisher = RedisPublisher(facility='bot', users=[task_worker.task.project.owner])
-                    front_end_publisher = RedisPublisher(facility='notifications',
-                                                         users=[task_worker.task.project.owner])
-
+                    mark_worker_submitted(task_worker.task.project.group_id, task_worker.worker_id)
+                    if first_submission:
+                        record_task_duration(task_worker.id)
                     task = task_worker.task
-                    message = {
-                        "type": "REGULAR",
-                        "payload": {
-                            'project_id': task_worker.task.project_id,
-                            'project_key': ProjectSerializer().get_hash_id(task_worker.task.project),
-                            'task_id': task_worker.task_id,
-                            'task_group_id': task_worker.task.group_id,
-                            'taskworker_id': task_worker.id,
-                            'worker_id': task_worker.worker_id
-                        }
+                    payload = {
+                        'project_id': task_worker.task.project_id,
+                        'project_key': ProjectSerializer().get_hash_id(task_worker.task.project),
+                        'task_id': task_worker.task_id,
+                        'task_group_id': task_worker.task.group_id,
+                        'taskworker_id': task_worker.id,
+                        'worker_id': task_worker.worker_id
                     }
-                    if task.project.is_review:
-                        match_group = MatchGroup.objects.get(batch=task.batch)
-                        if is_final_review(match_group.batch_id):
-                            message = get_review_redis_message(match_group.id, ProjectSerializer().get_hash_id(
-                                task_worker.task.project))
-                    message = RedisMessage(json.dumps(message))
-
-                    redis_publisher.publish_message(message)
-                    front_end_publisher.publish_message(RedisMessage(
-                        json.dumps({"event": "TASK_SUBMITTED",
-                                    'project_key': ProjectSerializer().get_hash_id(task_worker.task.project),
-                                    "project_gid": task_worker.task.project.group_id})))
+                    if not task.project.is_review and notifications.get_bot_stream(task.project.owner_id) is not None:
+                        outbox.stream(task.project.owner_id, payload)
+                    else:
+                        message = {
+                            "type": "REGULAR",
+                            "payload": payload
+                        }
+                        if task.project.is_review:
+                            match_group = MatchGroup.objects.get(batch=task.batch)
+                            if is_final_review(match_group.batch_id):
+                                message = get_review_redis_message(match_group.id, ProjectSerializer().get_hash_id(
+                                    task_worker.task.project))
+                        outbox.publish('bot', json.dumps(message), users=[task_worker.task.project.owner])
+                    outbox.publish('notifications', json.dumps({
+                        "event": "TASK_SUBMITTED",
+                        'project_key': ProjectSerializer().get_hash_id(task_worker.task.project),
+                        "project_gid": task_worker.task.project.group_id}), users=[task_worker.task.project.owner])
                 existing_results = [t.template_item_id for t in task_worker_results]
                 if len(existing_results) != 0:
                     serializer.update(task_worker_results, serializer.validated_data)
@@ -957,7 +981,7 @@ class TaskWorkerResultViewSet(viewsets.ModelViewSet):
                 if len(new_items):
                     serializer.create(task_worker=task_worker, validated_data=new_items)
 
-                update_worker_cache.delay([task_worker.worker_id], constants.TASK_SUBMITTED)
+                outbox.delay(update_worker_cache, [task_worker.worker_id], constants.TASK_SUBMITTED)
                 if task_worker_results.count():
                     winner_id = task_worker_results[0].result
                     update_ts_scores(task_worker, winner_id)
@@ -980,7 +1004,7 @@ class TaskWorkerResultViewSet(viewsets.ModelViewSet):
 
                     if http_status == status.HTTP_200_OK:
                         serialized_data = TaskWorkerSerializer(instance=instance).data
-                        update_worker_cache.delay([task_worker.worker_id], constants.TASK_ACCEPTED)
+                        outbox.delay(update_worker_cache, [task_worker.worker_id], constants.TASK_ACCEPTED)
 
                     return Response(serialized_data, http_status)
             else:
@@ -1020,7 +1044,7 @@ class ExternalSubmit(APIView):
             raise serializers.ValidationError(detail=daemo_error("Missing identifier"))
         try:
 
-            identifier_hash = Hashids(salt=settings.SECRET_KEY, min_length=settings.ID_HASH_MIN_LENGTH)
+            identifier_hash = get_hasher()
             if len(identifier_hash.decode(identifier)) == 0:
                 raise serializers.ValidationError(detail=daemo_error("Invalid identifier"))
             task_worker_id, task_id, template_item_id = identifier_hash.decode(identifier)
@@ -1037,25 +1061,29 @@ class ExternalSubmit(APIView):
             # if referer_url.netloc != source_url.netloc or referer_url.scheme != source_url.scheme:
             #     return Response(data={"message": "Referer does not match source"}, status=status.HTTP_403_FORBIDDEN)
 
-            redis_publisher = RedisPublisher(facility='external', broadcast=True)
-            task_hash = Hashids(salt=settings.SECRET_KEY, min_length=settings.ID_HASH_MIN_LENGTH)
-            message = RedisMessage(json.dumps({"task_id": task_hash.encode(task_id),
-                                               "daemo_id": identifier,
-                                               "template_item": template_item_id
-                                               }))
-            redis_publisher.publish_message(message)
+            task_hash = get_hasher()
+            notifications.publish('external', json.dumps({"task_id": task_hash.encode(task_id),
+                                                          "daemo_id": identifier,
+                                                          "template_item": template_item_id
+                                                          }), broadcast=True)
             with transaction.atomic():
                 task_worker = TaskWorker.objects.get(id=task_worker_id, task_id=task_id)
                 task_worker_result, created = TaskWorkerResult.objects.get_or_create(task_worker_id=task_worker.id,
                                                                                      template_item_id=template_item_id)
                 # only accept in progress, submitted, or returned tasks
                 if task_worker.status in [1, 2, 5]:
+                    first_submission = task_worker.status == TaskWorker.STATUS_IN_PROGRESS
                     task_worker.status = TaskWorker.STATUS_SUBMITTED
                     task_worker.submitted_at = timezone.now()
                     task_worker.save()
+                    mark_project_rollups_dirty([task_worker.task.project_id])
+                    mark_worker_earnings_dirty([(task_worker.worker_id, task_worker.task.project_id)])
+                    mark_worker_submitted(task_worker.task.project.group_id, task_worker.worker_id)
+                    if first_submission:
+                        record_task_duration(task_worker.id)
                     task_worker_result.result = request.data
                     task_worker_result.save()
-                    update_worker_cache.delay([task_worker.worker_id], constants.TASK_SUBMITTED)
+                    outbox.delay(update_worker_cache, [task_worker.worker_id], constants.TASK_SUBMITTED)
                     # check_project_completed.delay(project_id=task_worker.task.project_id)
                     return Response(request.data, status=status.HTTP_200_OK)
                 else:
@@ -1067,7 +1095,7 @@ class ExternalSubmit(APIView):
 
     def get(self, request, *args, **kwargs):
         identifier = request.query_params.get('daemo_id', False)
-        identifier_hash = Hashids(salt=settings.SECRET_KEY, min_length=settings.ID_HASH_MIN_LENGTH)
+        identifier_hash = get_hasher()
         if len(identifier_hash.decode(identifier)) == 0:
             raise serializers.ValidationError(detail=daemo_error("Invalid identifier"))
         task_worker_id, task_id, template_item_id = identifier_hash.decode(identifier)
@@ -73,6 +73,7 @@ class TemplateItemViewSet(viewsets.ModelViewSet):
             item.successors.all().update(predecessor=item.predecessor)
 
         item.delete()
+        TemplateItemSerializer.touch_template(item.template_id)
         return Response({})
 
 
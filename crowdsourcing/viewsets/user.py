@@ -1,4 +1,3 @@
-from datetime import datetime
 from datetime import timedelta
 
 from django.conf import settings
@@ -15,11 +14,11 @@ from rest_framework.response import Response
 
 from crowdsourcing import constants
 from crowdsourcing import models
+from crowdsourcing import presence
 from crowdsourcing.exceptions import daemo_error
 from crowdsourcing.models import RegistrationWhitelist
 from crowdsourcing.payment import Stripe
 from crowdsourcing.permissions.user import CanCreateAccount
-from crowdsourcing.redis import RedisProvider
 from crowdsourcing.serializers.user import UserProfileSerializer, UserSerializer, UserPreferencesSerializer
 from crowdsourcing.serializers.utils import CountrySerializer, CitySerializer
 from crowdsourcing.tasks import update_worker_cache
@@ -58,26 +57,14 @@ class UserViewSet(mixins.RetrieveModelMixin, mixins.CreateModelMixin, mixins.Upd
             "worker": False,
             "requester": False
         }
-        worker_query = '''
-            SELECT
-              worker_id id,
-              count(day_of_month) days_of_month
-            FROM (
-                   SELECT
-                     worker_id,
-                     extract(DAY FROM submitted_at) day_of_month
-                   FROM crowdsourcing_taskworker
-                   WHERE submitted_at > now() - INTERVAL '30 day' AND status IN (2, 3) and worker_id=%(user_id)s
-                   GROUP BY worker_id, extract(DAY FROM submitted_at)
-                 ) s
-            GROUP BY worker_id HAVING count(day_of_month) >= 5;
-        '''
+        active_days = models.WorkerDailyEarnings.objects.filter(
+            worker=request.user, submitted__gt=0,
+            day__gt=(timezone.now() - timedelta(days=30)).date()).count()
+        if active_days >= 5:
+            response_data['worker'] = True
         params = {
             "user_id": request.user.id
         }
-        worker = User.objects.raw(worker_query, params)
-        if len(list(worker)):
-            response_data['worker'] = True
         requester_query = '''
             SELECT count(DISTINCT day_of_month) id
             FROM (
@@ -200,8 +187,7 @@ class UserViewSet(mixins.RetrieveModelMixin, mixins.CreateModelMixin, mixins.Upd
     @list_route(methods=['post'], permission_classes=[IsAuthenticated, ])
     def online(self, request, *args, **kwargs):
         user = request.user
-        provider = RedisProvider()
-        provider.set_hash('online', user.id, datetime.utcnow())
+        presence.heartbeat(user.id)
 
         # online_users = provider.get_hkeys('online')
 
@@ -351,22 +337,15 @@ class UserProfileViewSet(mixins.RetrieveModelMixin,
     @list_route(methods=['get'], permission_classes=[IsAuthenticated, ], url_path='financial')
     def financial_data(self, request):
         profile = request.user.profile
-        earned = models.TaskWorker.objects.prefetch_related('task__project').values(
-            'task__project__price').filter(worker=request.user,
-                                           is_paid=True).values_list('task__project__price', flat=True)
-        awaiting_payment = models.TaskWorker.objects.prefetch_related('task__project').values(
-            'task__project__price').filter(worker=request.user,
-                                           is_paid=False, status=models.TaskWorker.STATUS_ACCEPTED).values_list(
-            'task__project__price', flat=True)
+        earnings = get_model_or_none(models.WorkerEarnings, worker=request.user)
         response_data = {
             "is_worker": profile.is_worker,
             "is_requester": profile.is_requester,
-            "awaiting_payment": sum(awaiting_payment) if len(awaiting_payment) else 0,
-            "total_earned": sum(earned) if len(earned) else 0,
-            "is_discount_eligible": is_discount_eligible(request.user)
+            "awaiting_payment": earnings.awaiting_payment if earnings is not None else 0,
+            "total_earned": earnings.earned if earnings is not None else 0,
+            "is_discount_eligible": is_discount_eligible(request.user),
+            "tasks_completed": earnings.tasks_completed if earnings is not None else 0
         }
-        response_data.update({'tasks_completed': models.TaskWorker.objects.filter(worker=request.user, status__in=[
-            models.TaskWorker.STATUS_ACCEPTED, models.TaskWorker.STATUS_SUBMITTED]).count()})
         if hasattr(request.user, 'stripe_customer') and request.user.stripe_customer is not None:
             response_data.update({"account_balance": round(request.user.stripe_customer.account_balance, 2) / 100})
             response_data.update({"held_for_liability": 0})
@@ -18,6 +18,7 @@ import dj_database_url
 import dj_redis_url
 import django
 import os
+from celery.schedules import crontab
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
@@ -56,7 +57,7 @@ REST_FRAMEWORK = {
         'rest_framework.renderers.JSONRenderer',
         # 'rest_framework.renderers.BrowsableAPIRenderer',
     ),
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.LimitOffsetPagination',
+    'DEFAULT_PAGINATION_CLASS': 'crowdsourcing.utils.EstimatedCountPagination',
     'PAGE_SIZE': 10
 }
 
@@ -243,6 +244,7 @@ MTURK_CLIENT_SECRET = os.environ.get('MTURK_CLIENT_SECRET', 'INVALID')
 MTURK_HOST = os.environ.get('MTURK_HOST', 'mechanicalturk.sandbox.amazonaws.com')
 MTURK_WORKER_HOST = os.environ.get('MTURK_WORKER_HOST', 'https://workersandbox.mturk.com/mturk/externalSubmit')
 ID_HASH_MIN_LENGTH = 8
+TEMPLATE_RENDER_CACHE_SIZE = 512
 MTURK_WORKER_USERNAME = 'mturk'
 MTURK_QUALIFICATIONS = os.environ.get('MTURK_QUALIFICATIONS', True)
 MTURK_BEAT = os.environ.get('MTURK_BEAT', 1)
@@ -252,6 +254,34 @@ MTURK_COMPLETION_TIME = int(os.environ.get('MTURK_COMPLETION_TIME', 12))
 MTURK_THRESHOLD = 0.61
 POST_TO_MTURK = os.environ.get('POST_TO_MTURK', True)
 MTURK_SYS_QUALIFICATIONS = os.environ.get('MTURK_SYS_QUALIFICATIONS', True)
+# providers, with their decrypted credentials, connection and hit types, are reused for this long per process
+MTURK_PROVIDER_TTL = int(os.environ.get('MTURK_PROVIDER_TTL', 600))
+# concurrency, rate limit and retries of the batched MTurk calls, see mturk.executor
+MTURK_EXECUTOR_THREADS = int(os.environ.get('MTURK_EXECUTOR_THREADS', 16))
+MTURK_REQUESTS_PER_SECOND = float(os.environ.get('MTURK_REQUESTS_PER_SECOND', 20))
+MTURK_REQUEST_BURST = int(os.environ.get('MTURK_REQUEST_BURST', 20))
+MTURK_BUCKET_KEY = 'mturk:bucket'
+MTURK_RETRIES = 5
+MTURK_RETRY_BACKOFF = 0.5
+# latency and throttling rate of the fake MTurk connection used with MTURK_HOST=fake, see mturk.fake
+MTURK_FAKE_LATENCY = float(os.environ.get('MTURK_FAKE_LATENCY', 0.2))
+MTURK_FAKE_RATE = int(os.environ.get('MTURK_FAKE_RATE', 25))
+# task groups whose HITs need creating or updating are queued here for mturk.tasks.reconcile_mturk_hits
+MTURK_HITS_DIRTY_KEY = 'mturk_hits:dirty'
+# the reconcile beat creates paid HITs on its own, like the commented out mturk-push-tasks it is off unless enabled
+MTURK_RECONCILE_BEAT = os.environ.get('MTURK_RECONCILE_BEAT', 'False') == 'True'
+MTURK_RECONCILE_SECONDS = int(os.environ.get('MTURK_RECONCILE_SECONDS', 30))
+MTURK_RECONCILE_BATCH_SIZE = 500
+MTURK_RECONCILE_LOCK_SECONDS = 600
+# groups that failed with a transient error wait in MTURK_HITS_RETRY_KEY, MTURK_RECONCILE_RETRY_SECONDS doubled on
+# every attempt, and are given up after MTURK_RECONCILE_MAX_ATTEMPTS, their attempts are counted in a hash
+MTURK_HITS_RETRY_KEY = 'mturk_hits:retry'
+MTURK_HITS_ATTEMPTS_KEY = 'mturk_hits:attempts'
+MTURK_RECONCILE_RETRY_SECONDS = 60
+MTURK_RECONCILE_MAX_ATTEMPTS = 8
+# whether any requester ratings exist, the answer is cached for MTURK_RATINGS_FLAG_TTL seconds until it is yes
+MTURK_RATINGS_FLAG_KEY = 'mturk:requester_ratings'
+MTURK_RATINGS_FLAG_TTL = 300
 
 WORKER_SPLIT_PERCENT = float(os.environ.get('WORKER_SPLIT_PERCENTILE', 0.75))
 
@@ -270,6 +300,10 @@ CELERY_ACCEPT_CONTENT = ['application/json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'America/Los_Angeles'
+# cpu heavy tasks get their own workers, see systemd/celery_ratings_worker.service
+CELERY_ROUTES = {
+    'mturk.tasks.update_worker_boomerang': {'queue': 'ratings'},
+}
 
 FEED_BOOMERANG = 1
 
@@ -281,6 +315,8 @@ BOOMERANG_LAMBDA = float(os.environ.get('BOOMERANG_LAMBDA', 0.6))
 BOOMERANG_TASK_ALPHA = float(os.environ.get('BOOMERANG_TASK_ALPHA', 0.3))
 BOOMERANG_REQUESTER_ALPHA = float(os.environ.get('BOOMERANG_REQUESTER_ALPHA', 0.4))
 BOOMERANG_PLATFORM_ALPHA = float(os.environ.get('BOOMERANG_PLATFORM_ALPHA', 0.5))
+# update_worker_boomerang pushes the ratings of mturk.ratings to the workers' MTurk qualifications only when set
+BOOMERANG_QUALIFICATIONS = os.environ.get('BOOMERANG_QUALIFICATIONS', 'False') == 'True'
 MIN_RATINGS_REQUIRED = 5
 
 COLLECTIVE_REJECTION_THRESHOLD = 7
@@ -335,9 +371,37 @@ CELERY_REDIS_MAX_CONNECTIONS = 10
 CELERY_IGNORE_RESULT = True
 CELERY_STORE_ERRORS_EVEN_IF_IGNORED = True
 MIN_WORKERS_FOR_STATS = 10
+WORKER_STATISTICS_CACHE_SECONDS = 24 * 60 * 60
 
 WORKER_ACTIVITY_DAYS = 30
 
+# paginated counts above this many rows are estimated, or cached for PAGINATION_COUNT_CACHE_SECONDS when set
+PAGINATION_EXACT_COUNT_LIMIT = int(os.environ.get('PAGINATION_EXACT_COUNT_LIMIT', 10000))
+PAGINATION_COUNT_CACHE_SECONDS = int(os.environ.get('PAGINATION_COUNT_CACHE_SECONDS', 0))
+
+RESULTS_FEED_PAGE_SIZE = 100
+RESULTS_FEED_MAX_PAGE_SIZE = 1000
+# rows younger than this are held back so that slower concurrent transactions can't commit behind the cursor
+RESULTS_FEED_SETTLE_SECONDS = int(os.environ.get('RESULTS_FEED_SETTLE_SECONDS', 2))
+
+PROJECT_ROLLUPS_DIRTY_KEY = 'project_rollups:dirty'
+PROJECT_ROLLUPS_FLUSH_SECONDS = int(os.environ.get('PROJECT_ROLLUPS_FLUSH_SECONDS', 15))
+WORKER_EARNINGS_DIRTY_KEY = 'worker_earnings:dirty'
+WRITE_BUFFER_KEY = 'write_buffer'
+WRITE_BUFFER_FLUSH_SECONDS = int(os.environ.get('WRITE_BUFFER_FLUSH_SECONDS', 10))
+WRITE_BUFFER_LOCK_SECONDS = 300
+OUTBOX_DRAIN_SECONDS = int(os.environ.get('OUTBOX_DRAIN_SECONDS', 1))
+OUTBOX_BATCH_SIZE = 500
+NOTIFICATION_PIPELINE_SIZE = 1000
+# requesters registered for batched bot messages, see crowdsourcing.notifications.set_bot_stream
+BOT_STREAMS_KEY = 'bot_streams'
+BOT_STREAMS_DIRTY_KEY = 'bot_streams:dirty'
+BOT_STREAMS_FLUSH_SECONDS = int(os.environ.get('BOT_STREAMS_FLUSH_SECONDS', 1))
+BOT_STREAM_MAX_BATCH_SIZE = 1000
+BOT_STREAM_MAX_WINDOW = 300
+PRESENCE_KEY = 'presence'
+PRESENCE_TIMEOUT_SECONDS = int(os.environ.get('PRESENCE_TIMEOUT_SECONDS', 90))
+
 # LOGGING CONFIGURATION
 # ------------------------------------------------------------------------------
 # See: https://docs.djangoproject.com/en/dev/ref/settings/#logging
@@ -442,9 +506,43 @@ CELERYBEAT_SCHEDULE = {
     'update-feed-boomerang': {
         'task': 'crowdsourcing.tasks.update_feed_boomerang',
         'schedule': timedelta(minutes=HEART_BEAT_BOOMERANG),
-    }
+    },
+    'flush-project-rollups': {
+        'task': 'crowdsourcing.tasks.flush_project_rollups',
+        'schedule': timedelta(seconds=PROJECT_ROLLUPS_FLUSH_SECONDS),
+    },
+    'check-project-rollups': {
+        'task': 'crowdsourcing.tasks.check_project_rollups',
+        'schedule': crontab(hour=3, minute=30),
+    },
+    'flush-worker-earnings': {
+        'task': 'crowdsourcing.tasks.flush_worker_earnings',
+        'schedule': timedelta(seconds=PROJECT_ROLLUPS_FLUSH_SECONDS),
+    },
+    'check-worker-earnings': {
+        'task': 'crowdsourcing.tasks.check_worker_earnings',
+        'schedule': crontab(hour=4, minute=0),
+    },
+    'flush-write-buffer': {
+        'task': 'crowdsourcing.tasks.flush_write_buffer',
+        'schedule': timedelta(seconds=WRITE_BUFFER_FLUSH_SECONDS),
+    },
+    'drain-outbox': {
+        'task': 'crowdsourcing.tasks.drain_outbox',
+        'schedule': timedelta(seconds=OUTBOX_DRAIN_SECONDS),
+    },
+    'flush-bot-streams': {
+        'task': 'crowdsourcing.tasks.flush_bot_streams',
+        'schedule': timedelta(seconds=BOT_STREAMS_FLUSH_SECONDS),
+    },
 }
 
+if MTURK_RECONCILE_BEAT:
+    CELERYBEAT_SCHEDULE['reconcile-mturk-hits'] = {
+        'task': 'mturk.tasks.reconcile_mturk_hits',
+        'schedule': timedelta(seconds=MTURK_RECONCILE_SECONDS),
+    }
+
 # Secure Settings
 if not DEBUG:
     # Honor the 'X-Forwarded-Proto' header for request.is_secure()
@@ -0,0 +1,59 @@
+"""
+Timing of the cumulative rating computation on synthetic sparse rating matrices.
+
+    python -m mturk.benchmark_ratings --workers 5000 --tasks 20000 --per-worker 30
+"""
+from __future__ import print_function
+
+import argparse
+import time
+
+import numpy as np
+
+from mturk import ratings
+
+
+def synthetic_ratings(num_workers, num_tasks, per_worker, seed=0):
+    random_state = np.random.RandomState(seed)
+    skill = random_state.normal(size=num_workers)
+    difficulty = random_state.normal(size=num_tasks)
+    worker_ids = np.repeat(np.arange(num_workers), per_worker)
+    task_ids = random_state.randint(0, num_tasks, size=len(worker_ids))
+    noise = random_state.normal(scale=0.5, size=len(worker_ids))
+    weights = np.clip(2 + (skill[worker_ids] - difficulty[task_ids] + noise) / 2, 1, 3).round(2)
+    return worker_ids.tolist(), task_ids.tolist(), weights
+
+
+def timed(label, func, *args, **kwargs):
+    start = time.time()
+    result = func(*args, **kwargs)
+    print('%-32s %8.3fs' % (label, time.time() - start))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--workers', type=int, default=2000)
+    parser.add_argument('--tasks', type=int, default=10000)
+    parser.add_argument('--per-worker', type=int, default=20)
+    parser.add_argument('--changed', type=int, default=50, help='workers with new feedback')
+    args = parser.parse_args()
+
+    worker_ids, task_ids, weights = synthetic_ratings(args.workers, args.tasks, args.per_worker)
+    print('%d ratings, %d workers, %d tasks' % (len(weights), args.workers, args.tasks))
+
+    factors = timed('cold fit', ratings.factorize, worker_ids, task_ids, weights)
+    timed('warm fit', ratings.factorize, worker_ids, task_ids, weights, previous=factors)
+    restored = timed('load saved factors', ratings.RatingFactors.loads, factors.dumps())
+
+    changed = np.random.RandomState(1).choice(args.workers, args.changed, replace=False)
+    weights = weights.copy()
+    weights[np.in1d(worker_ids, changed)] = 2.0
+    timed('incremental update', ratings.update, restored, worker_ids, task_ids, weights, changed.tolist())
+
+    scores = timed('scores', factors.scores)
+    timed('boomerang split', ratings.boomerang_scores, scores, 0.75)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""
+Runs the MTurk calls of a batch, approvals, rejections, HIT updates and HIT creation, on a bounded thread pool.
+
+Every call first takes a token from a bucket refilled at MTURK_REQUESTS_PER_SECOND with room for MTURK_REQUEST_BURST,
+so the pool stays under MTurk's throttling, and calls MTurk throttled anyway are retried with jittered exponential
+backoff. MTurk throttles per account, so the bucket is kept in redis per account and shared by the executors of all
+celery workers. Calls are functions of a boto MTurkConnection, each thread gets its own connection from
+MTurkProvider.get_thread_connection. The pool is shared by the executors of a process, so its threads and their
+connections are reused from batch to batch. A call that raises, a socket error as much as an MTurk error, fails on
+its own, its result is the exception and the results of the other calls of the batch are kept.
+"""
+import os
+import random
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+from boto.mturk.connection import MTurkRequestError
+from django.conf import settings
+
+from crowdsourcing.redis import RedisProvider
+
+THROTTLED_ERRORS = ('ServiceUnavailable', 'AWS.ServiceUnavailable', 'Throttling', 'AWS.MechanicalTurk.Throttled')
+
+# (pid, pool), a pool inherited by a forked worker has no threads and is replaced
+_pool = (None, None)
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool[0] != os.getpid():
+            _pool = (os.getpid(), ThreadPool(settings.MTURK_EXECUTOR_THREADS))
+        return _pool[1]
+
+
+# takes a token from the bucket KEYS[1] refilled at ARGV[1] a second up to ARGV[2], the seconds to wait are returned
+# when there is none, as a string since redis truncates numbers returned by scripts
+TAKE_TOKEN_SCRIPT = '''
+    local rate, capacity, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+    local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+    local tokens, updated_at = tonumber(bucket[1]) or capacity, tonumber(bucket[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - updated_at) * rate)
+    local wait = 0
+    if tokens >= 1 then
+        tokens = tokens - 1
+    else
+        wait = (1 - tokens) / rate
+    end
+    redis.call('HMSET', KEYS[1], 'tokens', tostring(tokens), 'updated_at', tostring(math.max(now, updated_at)))
+    redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+    return tostring(wait)
+'''
+
+
+class TokenBucket(object):
+    """
+    A token bucket in redis, shared by every process taking tokens from the same key
+    """
+
+    def __init__(self, key, rate, capacity):
+        self.key = key
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._take = RedisProvider().script(TAKE_TOKEN_SCRIPT)
+
+    def take(self):
+        """
+        Block until a token is available and take it
+        """
+        while True:
+            wait = float(self._take(keys=[self.key], args=[self.rate, self.capacity, repr(time.time())]))
+            if not wait:
+                return
+            time.sleep(wait)
+
+
+def is_throttled(error):
+    return error.status == 503 or any(code in THROTTLED_ERRORS for code, _ in error.errors or [])
+
+
+def is_transient(error):
+    """
+    Whether a failed call may succeed when tried again later, throttling, MTurk's own errors and network errors are,
+    errors of the request or the account, e.g. insufficient funds or bad credentials, aren't
+    """
+    if not isinstance(error, MTurkRequestError):
+        return True
+    return is_throttled(error) or error.status >= 500
+
+
+class MTurkExecutor(object):
+    def __init__(self, provider):
+        self.provider = provider
+        self.bucket = TokenBucket(RedisProvider.build_key(settings.MTURK_BUCKET_KEY, provider.account_key),
+                                  settings.MTURK_REQUESTS_PER_SECOND, settings.MTURK_REQUEST_BURST)
+
+    def _call(self, call):
+        for attempt in range(settings.MTURK_RETRIES + 1):
+            self.bucket.take()
+            try:
+                return call(self.provider.get_thread_connection())
+            except MTurkRequestError as e:
+                if not is_throttled(e) or attempt == settings.MTURK_RETRIES:
+                    return e
+            except Exception as e:
+                return e
+            time.sleep(settings.MTURK_RETRY_BACKOFF * 2 ** attempt * (1 + random.random()))
+
+    def run(self, calls):
+        """
+        Results of calls in their order, the exception of a call that failed in place of its result
+        """
+        calls = list(calls)
+        if not len(calls):
+            return []
+        return get_pool().map(self._call, calls)
+
+
+def failed(result):
+    return isinstance(result, Exception)
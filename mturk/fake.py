@@ -0,0 +1,65 @@
+"""
+An in-memory stand-in for the MTurk requester API, MTurkProvider connects to it when MTURK_HOST is 'fake'.
+
+Every call is recorded in FakeMTurkConnection.calls and takes MTURK_FAKE_LATENCY seconds, calls beyond
+MTURK_FAKE_RATE per second, counted over all connections of the process, fail the way MTurk throttles. That is
+enough to run publishing, approvals and the mturk.executor locally and in tests without an AWS account.
+"""
+import threading
+import time
+import uuid
+
+from boto.mturk.connection import MTurkRequestError
+from boto.mturk.price import Price
+from django.conf import settings
+
+THROTTLED_BODY = '<Response><Errors><Error><Code>ServiceUnavailable</Code>' \
+                 '<Message>Request rate exceeded</Message></Error></Errors></Response>'
+
+
+class FakeResult(object):
+    def __init__(self, **kwargs):
+        self.HITId = uuid.uuid4().hex.upper()[:30]
+        self.HITTypeId = uuid.uuid4().hex.upper()[:30]
+        self.QualificationTypeId = uuid.uuid4().hex.upper()[:30]
+        self.__dict__.update(kwargs)
+
+
+class FakeMTurkConnection(object):
+    calls = []
+    _window = [0, 0]
+    _lock = threading.Lock()
+
+    def __init__(self, *args, **kwargs):
+        self.APIVersion = None
+
+    def _request(self, name, args, kwargs):
+        with self._lock:
+            second = int(time.time())
+            if self._window[0] != second:
+                self._window[:] = [second, 0]
+            self._window[1] += 1
+            throttled = self._window[1] > settings.MTURK_FAKE_RATE
+            self.calls.append((name, args, kwargs, throttled))
+        time.sleep(settings.MTURK_FAKE_LATENCY)
+        if throttled:
+            raise MTurkRequestError(503, 'Service Unavailable', THROTTLED_BODY)
+
+    def register_hit_type(self, *args, **kwargs):
+        self._request('register_hit_type', args, kwargs)
+        return [FakeResult()]
+
+    def create_hit(self, *args, **kwargs):
+        self._request('create_hit', args, kwargs)
+        return [FakeResult(HITTypeId=kwargs.get('hit_type'))]
+
+    def get_account_balance(self, *args, **kwargs):
+        self._request('get_account_balance', args, kwargs)
+        return [Price(10000)]
+
+    def __getattr__(self, name):
+        def call(*args, **kwargs):
+            self._request(name, args, kwargs)
+            return [FakeResult()]
+
+        return call
@@ -1,5 +1,6 @@
 import datetime
 import json
+import threading
 from decimal import Decimal
 
 from boto.mturk.connection import MTurkConnection, MTurkRequestError
@@ -11,12 +12,14 @@ from boto.mturk.question import ExternalQuestion
 from django.db.models import Q
 from django.db import connection
 from django.utils import timezone
-from hashids import Hashids
-from ws4redis.publisher import RedisPublisher
-from ws4redis.redis_store import RedisMessage
 
+from crowdsourcing import notifications
+from crowdsourcing.crypto import get_hasher
 from crowdsourcing.models import Task, TaskWorker, Rating
+from crowdsourcing.redis import RedisProvider
 from csp import settings
+from mturk.executor import MTurkExecutor, failed, is_transient
+from mturk.fake import FakeMTurkConnection
 from mturk.models import MTurkHIT, MTurkHITType, MTurkQualification, MTurkWorkerQualification
 from mturk.utils import MultiLocaleRequirement, BoomerangRequirement
 
@@ -42,6 +45,24 @@ WAIT_LIST_BUCKETS = [(1.80, 1.98), (1.60, 1.79), (1.40, 1.59), (1.20, 1.39), (1.
 BOOMERANG_QUAL_INITIAL = 300
 
 
+def requester_ratings_exist():
+    """
+    Whether any requester has rated a worker, the boomerang qualifications are only added to HITs once one has.
+    A yes is kept until unset, a no is cached for MTURK_RATINGS_FLAG_TTL seconds, see set_requester_ratings_exist
+    """
+    flag = RedisProvider().get(settings.MTURK_RATINGS_FLAG_KEY)
+    if flag is None:
+        exists = Rating.objects.filter(origin_type=Rating.RATING_REQUESTER).exists()
+        set_requester_ratings_exist(exists)
+        return exists
+    return flag == '1'
+
+
+def set_requester_ratings_exist(exists=True):
+    RedisProvider().set(settings.MTURK_RATINGS_FLAG_KEY, '1' if exists else '0',
+                        expire=None if exists else settings.MTURK_RATINGS_FLAG_TTL)
+
+
 class MTurkProvider(object):
     description = 'This is a task authored by a requester on Daemo, a research crowdsourcing platform. ' \
                   'Mechanical Turk workers are welcome to do it'
@@ -51,18 +72,36 @@ class MTurkProvider(object):
 
     def __init__(self, host, aws_access_key_id, aws_secret_access_key):
         self.host = host
-        self.connection = MTurkConnection(
-            aws_access_key_id=aws_access_key_id,
-            aws_secret_access_key=aws_secret_access_key,
-            host=settings.MTURK_HOST
-        )
-        self.connection.APIVersion = "2014-08-15"
+        self._credentials = {'aws_access_key_id': aws_access_key_id, 'aws_secret_access_key': aws_secret_access_key}
+        # MTurk throttles per account, the executors of every process share its token bucket, see mturk.executor
+        self.account_key = '{}:{}'.format(settings.MTURK_HOST, aws_access_key_id)
+        self._local = threading.local()
+        self.connection = self._connect()
         if not self.host:
             raise ValueError("Please provide a host url")
+        # hit types by (owner, title, price, duration, qualifications mask, boomerang threshold) and the hit types
+        # notifications were set up for, kept for as long as the provider, see mturk.tasks.get_provider
+        self._hit_types = {}
+        self._notified_hit_types = set()
+
+    def _connect(self):
+        if settings.MTURK_HOST == 'fake':
+            return FakeMTurkConnection()
+        connection = MTurkConnection(host=settings.MTURK_HOST, **self._credentials)
+        connection.APIVersion = "2014-08-15"
+        return connection
 
     def get_connection(self):
         return self.connection
 
+    def get_thread_connection(self):
+        """
+        A connection of the calling thread, boto connections aren't shared between the threads of mturk.executor
+        """
+        if not hasattr(self._local, 'connection'):
+            self._local.connection = self._connect()
+        return self._local.connection
+
     @staticmethod
     def _mturk_system_qualifications(qualification):
         requirements = []
@@ -120,10 +159,18 @@ class MTurkProvider(object):
                 requirements.append(boomerang)
         return Qualifications(requirements), boomerang_qual
 
-    def create_hits(self, project, tasks=None, repetition=None):
+    def create_hits(self, project, tasks=None, repetition=None, task_group_ids=None):
+        """
+        Create the HITs of the project's task groups that have assignments left and no HIT, and move existing HITs
+        to the project's current hit type, task_group_ids limits this to those groups instead of the whole project.
+        Failed calls give 'RETRY' when all of them may succeed later, see mturk.executor.is_transient, else 'FAILED'
+        """
         # if project.min_rating > 0:
         #     return 'NOOP'
         if not tasks:
+            group_filter = ''
+            if task_group_ids is not None:
+                group_filter = 'AND t.group_id = ANY(%(task_group_ids)s)'
             cursor = connection.cursor()
             # noinspection SqlResolve
             query = '''
@@ -147,31 +194,34 @@ class MTurkProvider(object):
                          INNER JOIN crowdsourcing_task t_rev ON t_rev.group_id = t.group_id
                          LEFT OUTER JOIN mturk_mturkhit mh ON mh.task_id = t_rev.id
                          LEFT OUTER JOIN mturk_mturkassignment ma ON ma.hit_id = mh.id
-                       WHERE t.project_id = (%(project_id)s) AND t_rev.exclude_at IS NULL
+                       WHERE t.project_id = (%(project_id)s) {group_filter} AND t_rev.exclude_at IS NULL
                        AND t_rev.deleted_at IS NULL
                 ) t
                 GROUP BY group_id, repetition, min_rating HAVING sum(existing_assignments) < repetition;
-            '''
+            '''.format(group_filter=group_filter)
             cursor.execute(query, {'skipped': TaskWorker.STATUS_SKIPPED,
                                    'rejected': TaskWorker.STATUS_REJECTED,
                                    'expired': TaskWorker.STATUS_EXPIRED,
-                                   'project_id': project.id})
+                                   'project_id': project.id,
+                                   'task_group_ids': list(task_group_ids or [])})
             tasks = cursor.fetchall()
 
-        rated_workers = Rating.objects.filter(origin_type=Rating.RATING_REQUESTER).count()
-        add_boomerang = rated_workers > 0
+        add_boomerang = requester_ratings_exist()
 
         duration = project.timeout if project.timeout is not None else datetime.timedelta(hours=24)
         lifetime = project.deadline - timezone.now() if project.deadline is not None else datetime.timedelta(
             days=7)
 
+        hits = {h.task_id: h for h in MTurkHIT.objects.filter(task_id__in=[task[0] for task in tasks])}
+        qualifications_by_threshold = {}
+        new_hits, changed_hits = [], []
         for task in tasks:
-            question = self.create_external_question(task[0])
-            mturk_hit = MTurkHIT.objects.filter(task_id=task[0]).first()
-            qualifications, boomerang_qual = self.get_qualifications(project=project,
-                                                                     boomerang_threshold=int(
-                                                                         round(task[4], 2) * 100),
-                                                                     add_boomerang=add_boomerang)
+            mturk_hit = hits.get(task[0])
+            boomerang_threshold = int(round(task[4], 2) * 100)
+            if boomerang_threshold not in qualifications_by_threshold:
+                qualifications_by_threshold[boomerang_threshold] = self.get_qualifications(
+                    project=project, boomerang_threshold=boomerang_threshold, add_boomerang=add_boomerang)
+            qualifications, boomerang_qual = qualifications_by_threshold[boomerang_threshold]
             qualifications_mask = 0
             if qualifications is not None:
                 qualifications_mask = FLAG_Q_LOCALE + FLAG_Q_HITS + FLAG_Q_RATE + FLAG_Q_BOOMERANG
@@ -181,50 +231,63 @@ class MTurkProvider(object):
                                                      approval_delay=datetime.timedelta(days=2),
                                                      qual_req=qualifications,
                                                      qualifications_mask=qualifications_mask,
-                                                     boomerang_threshold=int(round(task[4], 2) * 100),
+                                                     boomerang_threshold=boomerang_threshold,
                                                      owner_id=project.owner_id, boomerang_qual=boomerang_qual)
             if not success:
                 return 'FAILURE'
 
             if mturk_hit is None:
-                try:
-                    hit = self.connection.create_hit(hit_type=hit_type.string_id,
-                                                     max_assignments=task[3],
-                                                     lifetime=lifetime,
-                                                     question=question)[0]
-                    self.set_notification(hit_type_id=hit.HITTypeId)
-                    mturk_hit = MTurkHIT(hit_id=hit.HITId, hit_type=hit_type, task_id=task[0])
-                except MTurkRequestError as e:
-                    error = e.errors[0][0]
-                    if error == 'AWS.MechanicalTurk.InsufficientFunds':
-                        message = {
-                            "type": "ERROR",
-                            "detail": "Insufficient funds on your Mechanical Turk account!",
-                            "code": error
-                        }
-
-                        redis_publisher = RedisPublisher(facility='bot', users=[project.owner])
-                        message = RedisMessage(json.dumps(message))
-                        redis_publisher.publish_message(message)
-                    return 'FAILED'
-            else:
-                if mturk_hit.hit_type_id != hit_type.id:
-                    result, success = self.change_hit_type_of_hit(hit_id=mturk_hit.hit_id,
-                                                                  hit_type_id=hit_type.string_id)
-                    if success:
-                        mturk_hit.hit_type = hit_type
-            mturk_hit.save()
+                new_hits.append((task[0], task[3], hit_type, self.create_external_question(task[0])))
+            elif mturk_hit.hit_type_id != hit_type.id:
+                changed_hits.append((mturk_hit, hit_type))
+
+        # the API calls run concurrently, their results are recorded in bulk
+        executor = MTurkExecutor(self)
+        results = executor.run([lambda c, h=h: c.change_hit_type_of_hit(hit_id=h[0].hit_id, hit_type=h[1].string_id)
+                                for h in changed_hits])
+        changed = {}
+        for (mturk_hit, hit_type), result in zip(changed_hits, results):
+            if not failed(result):
+                changed.setdefault(hit_type, []).append(mturk_hit.id)
+        for hit_type, hit_ids in changed.items():
+            MTurkHIT.objects.filter(id__in=hit_ids).update(hit_type=hit_type, updated_at=timezone.now())
+
+        results = executor.run([lambda c, h=h: c.create_hit(hit_type=h[2].string_id, max_assignments=h[1],
+                                                            lifetime=lifetime, question=h[3])[0]
+                                for h in new_hits])
+        MTurkHIT.objects.bulk_create([MTurkHIT(hit_id=hit.HITId, hit_type=h[2], task_id=h[0])
+                                      for h, hit in zip(new_hits, results) if not failed(hit)])
+        for hit_type_id in set(hit.HITTypeId for hit in results if not failed(hit)) - self._notified_hit_types:
+            self.set_notification(hit_type_id=hit_type_id)
+            self._notified_hit_types.add(hit_type_id)
+
+        errors = [e.errors[0][0] for e in results if isinstance(e, MTurkRequestError) and e.errors]
+        if 'AWS.MechanicalTurk.InsufficientFunds' in errors:
+            message = {
+                "type": "ERROR",
+                "detail": "Insufficient funds on your Mechanical Turk account!",
+                "code": 'AWS.MechanicalTurk.InsufficientFunds'
+            }
+
+            notifications.publish('bot', json.dumps(message), users=[project.owner])
+        failures = [r for r in results if failed(r)]
+        if len(failures):
+            return 'RETRY' if all(is_transient(r) for r in failures) else 'FAILED'
         return 'SUCCESS'
 
     def create_hit_type(self, owner_id, title, description, price, duration, boomerang_threshold, keywords=None,
                         approval_delay=None, qual_req=None,
                         qualifications_mask=0, boomerang_qual=None):
+        key = (owner_id, title, description, Decimal(str(price)), duration, qualifications_mask, boomerang_threshold)
+        if key in self._hit_types:
+            return self._hit_types[key], True
         hit_type = MTurkHITType.objects.filter(owner_id=owner_id, name=title, description=description,
                                                price=Decimal(str(price)),
                                                duration=duration,
                                                qualifications_mask=qualifications_mask,
                                                boomerang_threshold=boomerang_threshold).first()
         if hit_type is not None:
+            self._hit_types[key] = hit_type
             return hit_type, True
 
         reward = Price(price)
@@ -243,10 +306,11 @@ class MTurkProvider(object):
             hit_type.save()
         except MTurkRequestError:
             return None, False
+        self._hit_types[key] = hit_type
         return hit_type, True
 
     def create_external_question(self, task, frame_height=800):
-        task_hash = Hashids(salt=settings.SECRET_KEY, min_length=settings.ID_HASH_MIN_LENGTH)
+        task_hash = get_hasher()
         task_id = task_hash.encode(task)
         url = self.host + '/mturk/task/?taskId=' + task_id
         question = ExternalQuestion(external_url=url, frame_height=frame_height)
@@ -0,0 +1,178 @@
+"""
+Low rank completion of the sparse worker x task rating matrix of a project group.
+
+Ratings are kept as coordinate arrays (worker index, task index, weight) and factorized with alternating
+least squares over the observed entries only, so the dense worker x task matrix is never built. A worker's
+score is the mean of its completed row, which for a factorization is mean + u_i . mean(V).
+
+The factors can be saved and passed back in to warm start the next fit, and update() re-solves only the
+rows of the workers whose ratings changed, and the columns of the tasks they rated, from the ratings of those
+rows and columns only.
+"""
+from __future__ import division
+
+import json
+
+import numpy as np
+
+RANK = 5
+REGULARIZATION = 0.1
+ITERATIONS = 15
+WARM_ITERATIONS = 3
+
+
+class RatingFactors(object):
+    def __init__(self, worker_ids, task_ids, mean, worker_factors, task_factors):
+        self.worker_ids = list(worker_ids)
+        self.task_ids = list(task_ids)
+        self.mean = mean
+        self.worker_factors = worker_factors
+        self.task_factors = task_factors
+
+    def scores(self):
+        """
+        Mean of every worker's completed row, in the order of worker_ids.
+        """
+        return self.mean + self.worker_factors.dot(self.task_factors.mean(axis=0))
+
+    def dumps(self):
+        return json.dumps({
+            'worker_ids': self.worker_ids,
+            'task_ids': self.task_ids,
+            'mean': self.mean,
+            'worker_factors': self.worker_factors.tolist(),
+            'task_factors': self.task_factors.tolist()
+        })
+
+    @classmethod
+    def loads(cls, value):
+        data = json.loads(value)
+        return cls(data['worker_ids'], data['task_ids'], data['mean'],
+                   np.array(data['worker_factors'], dtype=float).reshape(len(data['worker_ids']), -1),
+                   np.array(data['task_factors'], dtype=float).reshape(len(data['task_ids']), -1))
+
+
+def _solve(fixed, idx, other_idx, residuals, size, regularization):
+    """
+    Least squares solution of every row of one side given the fixed factors of the other side,
+    using only the observed entries. Each row solves (F'F + rI) x = F'r, where the normal equations of
+    all rows are accumulated at once with bincount and solved as a stack.
+    """
+    rank = fixed.shape[1]
+    observed = fixed[other_idx]
+    gram = np.empty((size, rank, rank))
+    for a in xrange(rank):
+        for b in xrange(a, rank):
+            gram[:, a, b] = gram[:, b, a] = np.bincount(idx, weights=observed[:, a] * observed[:, b],
+                                                        minlength=size)
+    rhs = np.empty((size, rank))
+    for a in xrange(rank):
+        rhs[:, a] = np.bincount(idx, weights=observed[:, a] * residuals, minlength=size)
+    gram += regularization * np.eye(rank)
+    return np.linalg.solve(gram, rhs[:, :, None])[:, :, 0]
+
+
+def _entries_of(idx, subset):
+    """
+    The entries whose idx is in the sorted subset, and their idx renumbered to positions in subset
+    """
+    entries = np.flatnonzero(np.in1d(idx, subset))
+    return entries, np.searchsorted(subset, idx[entries])
+
+
+def _index(ids, known_ids):
+    positions = dict((v, i) for i, v in enumerate(known_ids))
+    new_ids = [v for v in sorted(set(ids)) if v not in positions]
+    for v in new_ids:
+        positions[v] = len(positions)
+    return np.array([positions[v] for v in ids], dtype=np.int64), list(known_ids) + new_ids
+
+
+def _extend(factors, size, rank, random_state):
+    if factors is None:
+        factors = np.empty((0, rank))
+    if factors.shape[0] < size:
+        factors = np.vstack([factors, random_state.normal(scale=0.1, size=(size - factors.shape[0], rank))])
+    return factors
+
+
+def factorize(worker_ids, task_ids, weights, previous=None, rank=RANK, regularization=REGULARIZATION,
+              iterations=None, seed=0):
+    """
+    Fit the factors of all the ratings of a project group, given as parallel sequences of worker id,
+    task id and weight. When the previous factors are passed they are used as the starting point.
+    """
+    random_state = np.random.RandomState(seed)
+    weights = np.asarray(weights, dtype=float)
+    rows, all_workers = _index(worker_ids, previous.worker_ids if previous is not None else [])
+    cols, all_tasks = _index(task_ids, previous.task_ids if previous is not None else [])
+    if iterations is None:
+        iterations = WARM_ITERATIONS if previous is not None else ITERATIONS
+    mean = float(weights.mean()) if len(weights) else 0.0
+    residuals = weights - mean
+    worker_factors = _extend(previous.worker_factors if previous is not None else None, len(all_workers),
+                             rank, random_state)
+    task_factors = _extend(previous.task_factors if previous is not None else None, len(all_tasks),
+                           rank, random_state)
+    for _ in xrange(iterations):
+        worker_factors = _solve(task_factors, rows, cols, residuals, len(all_workers), regularization)
+        task_factors = _solve(worker_factors, cols, rows, residuals, len(all_tasks), regularization)
+    return RatingFactors(all_workers, all_tasks, mean, worker_factors, task_factors)
+
+
+def update(factors, worker_ids, task_ids, weights, changed_worker_ids, regularization=REGULARIZATION,
+           iterations=WARM_ITERATIONS, seed=0):
+    """
+    Refresh a previous fit after the ratings of changed_worker_ids changed. Only the rows of those workers
+    and the columns of the tasks they rated are re-solved, everything else keeps its previous factors.
+    """
+    random_state = np.random.RandomState(seed)
+    weights = np.asarray(weights, dtype=float)
+    rank = factors.worker_factors.shape[1]
+    rows, all_workers = _index(worker_ids, factors.worker_ids)
+    cols, all_tasks = _index(task_ids, factors.task_ids)
+    residuals = weights - factors.mean
+    # rows are re-solved in place, the previous factors are left as they were
+    worker_factors = _extend(factors.worker_factors, len(all_workers), rank, random_state).copy()
+    task_factors = _extend(factors.task_factors, len(all_tasks), rank, random_state).copy()
+
+    worker_positions = dict((v, i) for i, v in enumerate(all_workers))
+    changed_rows = np.unique([worker_positions[w] for w in changed_worker_ids if w in worker_positions])
+    if not len(changed_rows):
+        return RatingFactors(all_workers, all_tasks, factors.mean, worker_factors, task_factors)
+    # the normal equations of the changed rows and columns are built from their own entries only
+    worker_entries, local_rows = _entries_of(rows, changed_rows)
+    changed_cols = np.unique(cols[worker_entries])
+    task_entries, local_cols = _entries_of(cols, changed_cols)
+    for _ in xrange(iterations):
+        worker_factors[changed_rows] = _solve(task_factors, local_rows, cols[worker_entries],
+                                              residuals[worker_entries], len(changed_rows), regularization)
+        if len(changed_cols):
+            task_factors[changed_cols] = _solve(worker_factors, local_cols, rows[task_entries],
+                                                residuals[task_entries], len(changed_cols), regularization)
+    return RatingFactors(all_workers, all_tasks, factors.mean, worker_factors, task_factors)
+
+
+def min_max_scale(values, low, high):
+    spread = values.max() - values.min() if len(values) else 0
+    if spread == 0:
+        return np.full(len(values), float(low))
+    return low + (values - values.min()) / spread * (high - low)
+
+
+def boomerang_scores(scores, split_percentile):
+    """
+    Map scores to boomerang ratings, workers at or above the split percentile get 2-3 and the rest 1-2.
+    Returns the ratings in the same order as scores.
+    """
+    scores = np.asarray(scores, dtype=float)
+    order = np.argsort(-scores, kind='mergesort')
+    ranked = scores[order]
+    percentile = np.percentile(ranked, split_percentile * 100)
+    num_top = int((ranked >= percentile).sum())
+    # the worker at the inflexion point is shared by both ranges so the bottom one starts at 2.0
+    boomerang = np.append(min_max_scale(ranked[:num_top], 2, 3),
+                          min_max_scale(ranked[max(num_top - 1, 0):], 1, 2)[1 if num_top else 0:])
+    result = np.empty(len(scores))
+    result[order] = boomerang
+    return result
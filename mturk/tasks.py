@@ -1,15 +1,22 @@
+import time
+from collections import OrderedDict
+
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.db import connection
 from django.db.models import Q
-from pandas import *
+from django.utils import timezone
 
 from crowdsourcing.crypto import AESUtil
 from crowdsourcing.models import Project, TaskWorker, Task, Rating
+from crowdsourcing.redis import RedisProvider
+from crowdsourcing.utils import mark_mturk_hits_dirty
 from csp.celery import app as celery_app
 from csp.settings import SITE_HOST, AWS_DAEMO_KEY
-from mturk.interface import MTurkProvider
-from mturk.models import MTurkHIT
+from mturk import ratings
+from mturk.executor import MTurkExecutor, failed
+from mturk.interface import MTurkProvider, set_requester_ratings_exist
+from mturk.models import MTurkAssignment, MTurkHIT
 
 
 @celery_app.task(ignore_result=True)
@@ -26,6 +33,123 @@ def mturk_publish():
     return {'message': 'SUCCESS'}
 
 
+def _take_dirty_hits(provider):
+    """
+    Move the queued task groups out of the way of new marks, groups left behind by a failed run are taken first
+    """
+    key = settings.MTURK_HITS_DIRTY_KEY
+    reconciling = key + ':reconciling'
+    if not provider.exists(reconciling):
+        if not provider.exists(key):
+            return None
+        provider.rename(key, reconciling)
+    return reconciling
+
+
+@celery_app.task(ignore_result=True)
+def reconcile_mturk_hits():
+    """
+    Create the HITs of the task groups queued by mark_mturk_hits_dirty, MTURK_RECONCILE_BATCH_SIZE groups at a time,
+    each batch handled per project with create_hits scoped to its groups. mturk_publish still scans whole projects.
+
+    Runs hold a lock so two of them never create HITs for the same groups. A run stops taking batches after half of
+    MTURK_RECONCILE_LOCK_SECONDS, what's left is taken first by the next run. Groups that failed with a transient
+    error are queued again after a backoff, see _retry_hits, groups that failed otherwise are dropped.
+    """
+    provider = RedisProvider()
+    lock = provider.lock(settings.MTURK_HITS_DIRTY_KEY + ':lock', timeout=settings.MTURK_RECONCILE_LOCK_SECONDS)
+    if not lock.acquire(blocking=False):
+        return 'LOCKED'
+    try:
+        _queue_due_retries(provider)
+        key = _take_dirty_hits(provider)
+        if key is None:
+            return 'SUCCESS'
+        deadline = time.time() + settings.MTURK_RECONCILE_LOCK_SECONDS / 2
+        while time.time() < deadline:
+            batch = [int(g) for g in provider.set_random(key, settings.MTURK_RECONCILE_BATCH_SIZE)]
+            if not len(batch):
+                provider.delete(key)
+                break
+            retry_groups = _reconcile_hits(batch)
+            _retry_hits(provider, retry_groups)
+            done = set(batch) - set(retry_groups)
+            if len(done):
+                pipeline = provider.pipeline(transaction=False)
+                pipeline.hdel(settings.MTURK_HITS_ATTEMPTS_KEY, *done)
+                pipeline.zrem(settings.MTURK_HITS_RETRY_KEY, *done)
+                pipeline.execute()
+            provider.set_remove(key, *batch)
+    finally:
+        lock.release()
+    return 'SUCCESS'
+
+
+def _queue_due_retries(provider):
+    """
+    Queue the groups whose backoff is over
+    """
+    due = provider.zrangebyscore(settings.MTURK_HITS_RETRY_KEY, 0, time.time())
+    if len(due):
+        mark_mturk_hits_dirty(int(g) for g in due)
+        provider.zrem(settings.MTURK_HITS_RETRY_KEY, *due)
+
+
+def _retry_hits(provider, task_group_ids):
+    """
+    Schedule task_group_ids for another attempt MTURK_RECONCILE_RETRY_SECONDS * 2 ** attempts later, groups that used
+    up MTURK_RECONCILE_MAX_ATTEMPTS are given up
+    """
+    if not len(task_group_ids):
+        return
+    pipeline = provider.pipeline(transaction=False)
+    for task_group_id in task_group_ids:
+        pipeline.hincrby(settings.MTURK_HITS_ATTEMPTS_KEY, task_group_id)
+    attempts = pipeline.execute()
+    now = time.time()
+    given_up = []
+    for task_group_id, attempt in zip(task_group_ids, attempts):
+        if attempt >= settings.MTURK_RECONCILE_MAX_ATTEMPTS:
+            given_up.append(task_group_id)
+        else:
+            pipeline.zadd(settings.MTURK_HITS_RETRY_KEY,
+                          now + settings.MTURK_RECONCILE_RETRY_SECONDS * 2 ** (attempt - 1), task_group_id)
+    if len(given_up):
+        print('Giving up on the HITs of {} task groups after {} attempts'.format(len(given_up), max(attempts)))
+        pipeline.hdel(settings.MTURK_HITS_ATTEMPTS_KEY, *given_up)
+    pipeline.execute()
+
+
+def _reconcile_hits(task_group_ids):
+    """
+    Create the HITs of task_group_ids, the groups of the projects whose create_hits failed in a way that may succeed
+    later are returned. Projects that failed otherwise, e.g. for insufficient funds or bad credentials, are reported
+    and their groups dropped until they are marked again, so the requester isn't notified on every run.
+    """
+    groups = OrderedDict()
+    for project_id, task_group_id in Task.objects.filter(group_id__in=task_group_ids,
+                                                         project__deleted_at__isnull=True,
+                                                         project__post_mturk=True,
+                                                         project__status=Project.STATUS_IN_PROGRESS,
+                                                         project__owner__mturk_account__isnull=False) \
+            .order_by('project_id').values_list('project_id', 'group_id').distinct():
+        groups.setdefault(project_id, []).append(task_group_id)
+    projects = Project.objects.select_related('owner__mturk_account', 'qualification').in_bulk(groups.keys())
+    retry_groups = []
+    for project_id, project_groups in groups.items():
+        project = projects[project_id]
+        try:
+            result = get_provider(project.owner).create_hits(project, task_group_ids=project_groups)
+        except Exception as e:
+            result = e
+        if result != 'SUCCESS':
+            print('Could not reconcile the HITs of {} task groups of project {}: {}'.format(len(project_groups),
+                                                                                            project_id, result))
+        if result != 'SUCCESS' and result != 'FAILED':
+            retry_groups += project_groups
+    return retry_groups
+
+
 @celery_app.task(ignore_result=True)
 def mturk_hit_update(task):
     user_id = Task.objects.values('project__owner').get(id=task['id'])['project__owner']
@@ -47,8 +171,9 @@ def mturk_approve(list_workers):
     provider = get_provider(user)
     if provider is None:
         return
-    for task_worker_id in list_workers:
-        provider.approve_assignment({'id': task_worker_id})
+    assignment_ids = _first_assignments(list_workers).values()
+    results = MTurkExecutor(provider).run([lambda c, a=a: c.approve_assignment(a) for a in assignment_ids])
+    _report_failures('approve', assignment_ids, results)
     return 'SUCCESS'
 
 
@@ -65,12 +190,16 @@ def mturk_reject(list_workers):
     if provider is None:
         return
 
-    for task_worker_id in list_workers:
-        provider.reject_assignment({'id': task_worker_id})
+    executor = MTurkExecutor(provider)
+    assignment_ids = _first_assignments(list_workers).values()
+    results = executor.run([lambda c, a=a: c.reject_assignment(a) for a in assignment_ids])
+    _report_failures('reject', assignment_ids, results)
 
-        # add new assignment every time a assignment is rejected
-        hit_id = TaskWorker.objects.values('task__mturk_hit__hit_id').get(id=task_worker_id)['task__mturk_hit__hit_id']
-        provider.add_assignments(hit_id=hit_id, increment=1)
+    # add new assignment every time a assignment is rejected
+    hit_ids = [h for h in TaskWorker.objects.filter(id__in=list_workers).values_list('task__mturk_hit__hit_id',
+                                                                                     flat=True) if h is not None]
+    results = executor.run([lambda c, h=h: c.extend_hit(hit_id=h, assignments_increment=1) for h in hit_ids])
+    _report_failures('add assignment to', hit_ids, results)
     return 'SUCCESS'
 
 
@@ -81,19 +210,17 @@ def mturk_update_status(project):
     provider = get_provider(user)
     if provider is None:
         return
-    hits = MTurkHIT.objects.filter(task__project_id=project['id'])
-    for hit in hits:
-        if project['status'] == Project.STATUS_IN_PROGRESS:
-            provider.extend_hit(hit.hit_id)
-            hit.status = MTurkHIT.STATUS_IN_PROGRESS
-        elif project['status'] == Project.STATUS_CROWD_REJECTED:
-            # TODO delete? for now only expire
-            provider.expire_hit(hit.hit_id)
-            hit.status = MTurkHIT.STATUS_EXPIRED
-        else:
-            provider.expire_hit(hit.hit_id)
-            hit.status = MTurkHIT.STATUS_EXPIRED
-        hit.save()
+    hits = list(MTurkHIT.objects.filter(task__project_id=project['id']).values_list('id', 'hit_id'))
+    if project.get('status') == Project.STATUS_IN_PROGRESS:
+        calls = [lambda c, h=h: c.extend_hit(hit_id=h, expiration_increment=604800) for _, h in hits]  # 7 days
+        hit_status = MTurkHIT.STATUS_IN_PROGRESS
+    else:
+        # TODO delete crowd rejected? for now only expire
+        calls = [lambda c, h=h: c.expire_hit(h) for _, h in hits]
+        hit_status = MTurkHIT.STATUS_EXPIRED
+    results = MTurkExecutor(provider).run(calls)
+    _report_failures('update', [h for _, h in hits], results)
+    MTurkHIT.objects.filter(id__in=[i for i, _ in hits]).update(status=hit_status, updated_at=timezone.now())
     return 'SUCCESS'
 
 
@@ -116,37 +243,65 @@ def mturk_disable_hit(project):
     provider = get_provider(user)
     if provider is None:
         return
-    hits = MTurkHIT.objects.filter(task__project__group_id=project['id'])
-    for hit in hits:
-        provider.disable_hit(hit.hit_id)
-        hit.status = MTurkHIT.STATUS_DELETED
-        hit.save()
+    hits = list(MTurkHIT.objects.filter(task__project__group_id=project['id']).values_list('id', 'hit_id'))
+    results = MTurkExecutor(provider).run([lambda c, h=h: c.disable_hit(h) for _, h in hits])
+    _report_failures('disable', [h for _, h in hits], results)
+    MTurkHIT.objects.filter(id__in=[i for i, _ in hits]).update(status=MTurkHIT.STATUS_DELETED,
+                                                                updated_at=timezone.now())
     return 'SUCCESS'
 
 
-def get_provider(user, host=None):
-    if not hasattr(user, 'mturk_account'):
-        return None
-    if host is None:
-        host = SITE_HOST
-    client_secret = AESUtil(key=AWS_DAEMO_KEY).decrypt(user.mturk_account.client_secret)
-    return MTurkProvider(host=host, aws_access_key_id=user.mturk_account.client_id,
-                         aws_secret_access_key=client_secret)
+def _first_assignments(task_worker_ids):
+    """
+    {task worker id: MTurk assignment id} of the first assignment of each task worker that has one
+    """
+    assignments = OrderedDict()
+    for task_worker_id, assignment_id in MTurkAssignment.objects.filter(task_worker_id__in=task_worker_ids) \
+            .order_by('task_worker_id', 'id').values_list('task_worker_id', 'assignment_id'):
+        assignments.setdefault(task_worker_id, assignment_id)
+    return assignments
+
 
+def _report_failures(operation, ids, results):
+    errors = [(i, r) for i, r in zip(ids, results) if failed(r)]
+    if len(errors):
+        print('Could not {} {} of {} on MTurk, first error: {} {}'.format(operation, len(errors), len(results),
+                                                                          errors[0][0], errors[0][1]))
 
-def calculate_cumulative_ratings(owner_id, project_id):
-    import numpy as np
-    from fancyimpute import SoftImpute, IterativeSVD
-    from sklearn.preprocessing import MinMaxScaler
 
-    ROW_WISE = 1
-    # COL_WISE = 0
+# (client id, encrypted client secret, host): (expires at, provider)
+_providers = {}
 
-    scaler_top = MinMaxScaler(feature_range=(2, 3))
-    scaler_bottom = MinMaxScaler(feature_range=(1, 2))
 
-    # input format: worker_id, task_id, accuracy
-    # output format: pivot table of worker_id and task_id with accuracy values
+def get_provider(user, host=None):
+    """
+    The MTurkProvider of the user's account, providers are pooled per process for MTURK_PROVIDER_TTL seconds so the
+    secret is decrypted and the connection set up once, a changed secret is keyed separately and gets a new one.
+    """
+    if not hasattr(user, 'mturk_account'):
+        return None
+    if host is None:
+        host = SITE_HOST
+    account = user.mturk_account
+    key = (account.client_id, account.client_secret, host)
+    now = time.time()
+    pooled = _providers.get(key)
+    if pooled is not None and pooled[0] > now:
+        return pooled[1]
+    for expired in [k for k, (expires_at, _) in _providers.items() if expires_at <= now]:
+        _providers.pop(expired, None)
+    client_secret = AESUtil(key=AWS_DAEMO_KEY).decrypt(account.client_secret)
+    provider = MTurkProvider(host=host, aws_access_key_id=account.client_id, aws_secret_access_key=client_secret)
+    _providers[key] = (now + settings.MTURK_PROVIDER_TTL, provider)
+    return provider
+
+
+def calculate_cumulative_ratings(owner_id, project_id, worker_ids=None):
+    """
+    Boomerang ratings of the workers of a project group, from the low rank completion of their requester ratings.
+    The factors of the previous run are kept in redis, when worker_ids is given only the rows of those workers and
+    the tasks they rated are re-solved, otherwise all the factors are refit starting from the previous ones.
+    """
     query = '''
         SELECT
             r.id,
@@ -176,81 +331,53 @@ def calculate_cumulative_ratings(owner_id, project_id):
     })
 
     worker_ratings_raw = cursor.fetchall()
+    if not len(worker_ratings_raw):
+        return []
 
     # 0 - rating id
     # 1 - worker_id
     # 2 - username
     # 3 - task_id
     # 4 - accuracy
-    d = [{
-         'worker_id': worker_rating[1],
-         'task_id': worker_rating[3],
-         'accuracy': worker_rating[4],
-         } for worker_rating in worker_ratings_raw]
-
     usernames = {}
     for rating in worker_ratings_raw:
-        usernames['%d' % rating[1]] = rating[2]
-
-    df = DataFrame(d)
-
-    pivoted = pivot_table(df, values='accuracy', index=['worker_id'], columns=['task_id'])
-    pivoted = pivoted.reset_index('worker_id')
-    pivoted.index.name = None
-
-    # COLUMNS = ["worker_id", "score", "accuracy", "attempted", "correct", "boomerang"]
-
-    data = pivoted.copy(deep=True)
-    matrix = data.ix[:, 1:]  # without worker_id
-
-    # data['accuracy'] = matrix.mean(axis=ROW_WISE) * 100
-    # data['attempted'] = matrix.count(axis=ROW_WISE)
-    # data['correct'] = matrix.sum(axis=ROW_WISE)
-
-    # data = data[data["attempted"]>=MIN_TASKS]
-
-    # turn incorrect to -1 as imputations will fill with 0
-    # matrix[matrix <= 0] = -1
-
-    try:
-        mat = IterativeSVD(verbose=False, init_fill_method="mean").complete(matrix)
-    except Exception:
-        mat = SoftImpute(verbose=False, init_fill_method="mean").complete(matrix)
-
-    data['score'] = mat.mean(axis=ROW_WISE)
-    data = data.sort_values(by=['score'], ascending=[False])
-
-    percentile = data['score'].quantile(settings.WORKER_SPLIT_PERCENTILE)
-
-    # Top 25% = 3-2 and Bottom 75% = 2-1
-    num_workers = len(data)
-    num_workers_top_x = len(data[data['score'] >= percentile])
-
-    top_x = data.head(num_workers_top_x)
-
-    # add extra worker at inflexion point from top set as it will have 2.0 duplicated
-    bottom_y = data.tail(num_workers - num_workers_top_x + 1)
-
-    # accuracy = sum(data['correct']) * 100 / sum(data['attempted'])
-
-    top_x_score = scaler_top.fit_transform(np.array(top_x['score']).reshape((len(top_x['score']), 1)))
-    bottom_y_score = scaler_bottom.fit_transform(np.array(bottom_y['score']).reshape((len(bottom_y['score']), 1)))
-
-    # ignore the 1st value of bottom list as it is duplicate one from top list.
-    boomerang_scores = np.append(top_x_score, bottom_y_score[1:])
-
-    data['boomerang'] = boomerang_scores
-
-    boomerang_ratings = data.to_dict('records')
-
-    worker_ratings = [{"worker_id": r.worker_id, "worker_username": usernames[r.worker_id], "task_avg": r.boomerang,
-                       "requester_avg": 0} for r in boomerang_ratings]
-
-    return worker_ratings
+        usernames[rating[1]] = rating[2]
+    rating_workers = [r[1] for r in worker_ratings_raw]
+    rating_tasks = [r[3] for r in worker_ratings_raw]
+    weights = [r[4] for r in worker_ratings_raw]
+
+    redis_provider = RedisProvider()
+    factors_key = redis_provider.build_key('boomerang_factors', project_id)
+    cached = redis_provider.get(factors_key)
+    previous = ratings.RatingFactors.loads(cached) if cached is not None else None
+
+    if previous is not None and worker_ids is not None:
+        factors = ratings.update(previous, rating_workers, rating_tasks, weights, worker_ids)
+    else:
+        factors = ratings.factorize(rating_workers, rating_tasks, weights, previous=previous)
+    redis_provider.set(factors_key, factors.dumps())
+
+    # workers that no longer have ratings keep their factors for the next run but are not rated
+    rated = [i for i, worker_id in enumerate(factors.worker_ids) if worker_id in usernames]
+    scores = factors.scores()[rated]
+    boomerang = ratings.boomerang_scores(scores, settings.WORKER_SPLIT_PERCENT)
+
+    worker_ratings = []
+    for position, i in enumerate(rated):
+        worker_id = factors.worker_ids[i]
+        worker_ratings.append({"worker_id": worker_id, "worker_username": usernames[worker_id],
+                               "task_avg": boomerang[position], "requester_avg": 0})
+    return sorted(worker_ratings, key=lambda r: r['task_avg'], reverse=True)
 
 
 @celery_app.task(ignore_result=True)
-def update_worker_boomerang(owner_id, project_id):
+def update_worker_boomerang(owner_id, project_id, worker_ids=None):
+    """
+    Push the boomerang scores of calculate_cumulative_ratings to the workers' MTurk qualifications.
+
+    Off unless BOOMERANG_QUALIFICATIONS is set: the task then returns before computing anything, as it always did
+    before the sparse ALS engine, since it changes the qualifications of real MTurk workers.
+    """
     # TODO fix group_id
     # noinspection SqlResolve
     # query = '''
@@ -323,8 +450,11 @@ def update_worker_boomerang(owner_id, project_id):
 
     # for rating in worker_ratings:
     #     update_worker_boomerang.delay(project_id, worker_id=rating['worker_id'], task_avg=rating['task_avg'])
-    return 'NOT_IMPLEMENTED'
-    worker_ratings = calculate_cumulative_ratings(owner_id=owner_id, project_id=project_id)
+    # a requester rated workers, new HITs get the boomerang qualifications from now on
+    set_requester_ratings_exist()
+    if not settings.BOOMERANG_QUALIFICATIONS:
+        return 'NOT_IMPLEMENTED'
+    worker_ratings = calculate_cumulative_ratings(owner_id=owner_id, project_id=project_id, worker_ids=worker_ids)
 
     user = User.objects.get(id=owner_id)
     provider = get_provider(user=user)
@@ -346,15 +476,20 @@ def expire_hits():
         WITH assignments AS (
             SELECT
               ma.id assignment_id,
-              ma.status
+              ma.status,
+              t.group_id
             FROM crowdsourcing_taskworker tw
               INNER JOIN mturk_mturkassignment ma ON ma.task_worker_id = tw.id
+              INNER JOIN crowdsourcing_task t ON t.id = tw.task_id
             WHERE tw.status = (%(expired)s) AND ma.status <> tw.status
         )
         UPDATE mturk_mturkassignment SET status=(%(expired)s) FROM assignments
-        WHERE assignments.assignment_id=id;
+        WHERE assignments.assignment_id=id
+        RETURNING assignments.group_id;
     '''
     cursor = connection.cursor()
     cursor.execute(query, {'expired': TaskWorker.STATUS_EXPIRED})
+    # the expired assignments are free again
+    mark_mturk_hits_dirty([row[0] for row in cursor.fetchall()])
 
     return 'SUCCESS'
@@ -1 +1,287 @@
-# Create your tests here.
+import socket
+import time
+from decimal import Decimal
+
+import numpy as np
+from boto.mturk.connection import MTurkRequestError
+from django.contrib.auth.models import User
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from crowdsourcing.models import Project, Task
+from crowdsourcing.redis import RedisProvider
+from csp import settings as csp_settings
+from mturk import ratings, tasks
+from mturk.executor import MTurkExecutor, TokenBucket, failed
+from mturk.fake import FakeMTurkConnection
+from mturk.interface import MTurkProvider
+from mturk.models import MTurkAccount, MTurkHIT
+
+INVALID_STATE_BODY = '<Response><Errors><Error><Code>AWS.MechanicalTurk.InvalidAssignmentState</Code>' \
+                     '<Message>Invalid state</Message></Error></Errors></Response>'
+
+
+@override_settings(MTURK_FAKE_LATENCY=0, MTURK_FAKE_RATE=1000, MTURK_REQUESTS_PER_SECOND=1000,
+                   MTURK_REQUEST_BURST=1000)
+class FakeMTurkTestCase(TestCase):
+    """
+    Runs against mturk.fake, MTurkProvider reads MTURK_HOST from csp.settings
+    """
+
+    def setUp(self):
+        self.host = csp_settings.MTURK_HOST
+        csp_settings.MTURK_HOST = 'fake'
+        FakeMTurkConnection.calls = []
+        FakeMTurkConnection._window[:] = [0, 0]
+        self.provider = MTurkProvider(host='https://daemo.test', aws_access_key_id='id',
+                                      aws_secret_access_key='secret')
+        RedisProvider().delete(RedisProvider.build_key(csp_settings.MTURK_BUCKET_KEY, self.provider.account_key))
+
+    def tearDown(self):
+        csp_settings.MTURK_HOST = self.host
+
+    @staticmethod
+    def calls(name):
+        return [c for c in FakeMTurkConnection.calls if c[0] == name]
+
+
+class MTurkExecutorTest(FakeMTurkTestCase):
+    def test_results_in_order(self):
+        def call(i):
+            def run(connection):
+                # the first calls take the longest, so they finish last
+                time.sleep(0.01 * (20 - i))
+                connection.get_account_balance()
+                return i
+
+            return run
+
+        self.assertEqual(MTurkExecutor(self.provider).run([call(i) for i in range(20)]), list(range(20)))
+
+    @override_settings(MTURK_FAKE_RATE=5, MTURK_RETRY_BACKOFF=0.2)
+    def test_throttled_calls_are_retried(self):
+        results = MTurkExecutor(self.provider).run([lambda c: c.approve_assignment('A') for _ in range(10)])
+        self.assertFalse(any(failed(r) for r in results))
+        calls = self.calls('approve_assignment')
+        self.assertTrue(any(throttled for _, _, _, throttled in calls))
+        self.assertEqual(len([c for c in calls if not c[3]]), 10)
+
+    def test_other_errors_are_not_retried(self):
+        attempts = []
+
+        def call(connection):
+            attempts.append(connection)
+            raise MTurkRequestError(400, 'Bad Request', INVALID_STATE_BODY)
+
+        results = MTurkExecutor(self.provider).run([call])
+        self.assertTrue(failed(results[0]))
+        self.assertEqual(len(attempts), 1)
+
+    def test_raising_call_fails_alone(self):
+        def call(i):
+            def run(connection):
+                if i == 1:
+                    raise socket.error('connection reset')
+                return connection.create_hit(hit_type='T')[0]
+
+            return run
+
+        results = MTurkExecutor(self.provider).run([call(i) for i in range(3)])
+        self.assertEqual([failed(r) for r in results], [False, True, False])
+        self.assertIsInstance(results[1], socket.error)
+
+    def test_token_bucket_holds_rate(self):
+        key = RedisProvider.build_key(csp_settings.MTURK_BUCKET_KEY, 'test')
+        RedisProvider().delete(key)
+        # two buckets on one key are one bucket, as for the executors of two celery workers
+        buckets = [TokenBucket(key, rate=20, capacity=5), TokenBucket(key, rate=20, capacity=5)]
+        started_at = time.time()
+        for i in range(25):
+            buckets[i % 2].take()
+        # the burst of 5 is free, the other 20 come at 20 a second
+        self.assertGreaterEqual(time.time() - started_at, 0.95)
+
+    @override_settings(MTURK_FAKE_RATE=12, MTURK_REQUESTS_PER_SECOND=10, MTURK_REQUEST_BURST=1)
+    def test_executor_stays_under_rate(self):
+        MTurkExecutor(self.provider).run([lambda c: c.extend_hit(hit_id='H') for _ in range(30)])
+        self.assertFalse(any(throttled for _, _, _, throttled in self.calls('extend_hit')))
+
+
+class MTurkHITWritesTest(FakeMTurkTestCase):
+    def setUp(self):
+        super(MTurkHITWritesTest, self).setUp()
+        self.requester = User.objects.create_user(username='requester')
+        self.account = MTurkAccount.objects.create(user=self.requester, client_id='id', client_secret='secret')
+        self.project = Project.objects.create(owner=self.requester, price=Decimal('0.50'), repetition=2,
+                                              status=Project.STATUS_IN_PROGRESS, post_mturk=True)
+        self.project.group_id = self.project.id
+        self.project.save()
+        for _ in range(5):
+            task = Task.objects.create(project=self.project, hash='')
+            task.group_id = task.id
+            task.save()
+        # get_provider hands out the pooled fake provider instead of decrypting the account's secret
+        tasks._providers[(self.account.client_id, self.account.client_secret, csp_settings.SITE_HOST)] = \
+            (time.time() + 60, self.provider)
+
+    def tearDown(self):
+        tasks._providers.clear()
+        super(MTurkHITWritesTest, self).tearDown()
+
+    def test_create_hits(self):
+        self.assertEqual(self.provider.create_hits(self.project), 'SUCCESS')
+        hits = MTurkHIT.objects.filter(task__project=self.project)
+        self.assertEqual(hits.count(), 5)
+        self.assertEqual(len(set(hits.values_list('hit_type_id', flat=True))), 1)
+        self.assertEqual(len(self.calls('create_hit')), 5)
+        self.assertEqual(len(self.calls('set_rest_notification')), 1)
+
+        # the groups have their HITs now
+        self.assertEqual(self.provider.create_hits(self.project), 'SUCCESS')
+        self.assertEqual(hits.count(), 5)
+        self.assertEqual(len(self.calls('create_hit')), 5)
+
+    def test_create_hits_of_task_groups(self):
+        task_group_ids = list(Task.objects.filter(project=self.project).values_list('group_id', flat=True)[:2])
+        self.assertEqual(self.provider.create_hits(self.project, task_group_ids=task_group_ids), 'SUCCESS')
+        self.assertEqual(sorted(MTurkHIT.objects.values_list('task__group_id', flat=True)), sorted(task_group_ids))
+
+    def test_disable_hit(self):
+        self.provider.create_hits(self.project)
+        self.assertEqual(tasks.mturk_disable_hit({'id': self.project.group_id}), 'SUCCESS')
+        self.assertEqual(len(self.calls('disable_hit')), 5)
+        self.assertFalse(MTurkHIT.objects.exclude(status=MTurkHIT.STATUS_DELETED).exists())
+
+
+class ReconcileRetryTest(SimpleTestCase):
+    def setUp(self):
+        self.redis = RedisProvider()
+        self.redis.delete(csp_settings.MTURK_HITS_RETRY_KEY, csp_settings.MTURK_HITS_ATTEMPTS_KEY,
+                          csp_settings.MTURK_HITS_DIRTY_KEY)
+
+    def test_backoff_doubles_until_given_up(self):
+        delays = []
+        for _ in range(csp_settings.MTURK_RECONCILE_MAX_ATTEMPTS - 1):
+            started_at = time.time()
+            tasks._retry_hits(self.redis, [7])
+            retry_at = self.redis.zrangebyscore(csp_settings.MTURK_HITS_RETRY_KEY, 0, '+inf')
+            self.assertEqual(retry_at, ['7'])
+            score = self.redis.pipeline(transaction=False).zscore(csp_settings.MTURK_HITS_RETRY_KEY, 7).execute()[0]
+            delays.append(int(round(score - started_at)))
+        self.assertEqual(delays, [csp_settings.MTURK_RECONCILE_RETRY_SECONDS * 2 ** i for i in range(len(delays))])
+
+        self.redis.zrem(csp_settings.MTURK_HITS_RETRY_KEY, 7)
+        tasks._retry_hits(self.redis, [7])
+        self.assertEqual(self.redis.zrangebyscore(csp_settings.MTURK_HITS_RETRY_KEY, 0, '+inf'), [])
+        self.assertIsNone(self.redis.get_status(csp_settings.MTURK_HITS_ATTEMPTS_KEY, 7))
+
+    def test_due_retries_are_queued(self):
+        self.redis.pipeline(transaction=False).zadd(csp_settings.MTURK_HITS_RETRY_KEY, time.time() - 1, 3,
+                                                    time.time() + 60, 4).execute()
+        tasks._queue_due_retries(self.redis)
+        self.assertEqual(self.redis.smembers(csp_settings.MTURK_HITS_DIRTY_KEY), {'3'})
+        self.assertEqual(self.redis.zrangebyscore(csp_settings.MTURK_HITS_RETRY_KEY, 0, '+inf'), ['4'])
+
+
+def dense_solve(matrix, fixed, rows, regularization):
+    """
+    One side of ALS over the dense matrix, row by row over the observed entries only
+    """
+    rank = fixed.shape[1]
+    solved = np.zeros((len(rows), rank))
+    for position, i in enumerate(rows):
+        observed = ~np.isnan(matrix[i])
+        factors = fixed[observed]
+        solved[position] = np.linalg.solve(factors.T.dot(factors) + regularization * np.eye(rank),
+                                           factors.T.dot(matrix[i, observed]))
+    return solved
+
+
+def dense_split(scores, split_percentile):
+    """
+    The boomerang split of the pandas version, sorted scores, top and bottom scaled separately
+    """
+    def scale(values, low, high):
+        spread = values.max() - values.min()
+        return np.full(len(values), float(low)) if spread == 0 else low + (values - values.min()) / spread * (
+            high - low)
+
+    order = np.argsort(-scores, kind='mergesort')
+    ranked = scores[order]
+    num_top = int((ranked >= np.percentile(ranked, split_percentile * 100)).sum())
+    result = np.empty(len(scores))
+    result[order] = np.append(scale(ranked[:num_top], 2, 3), scale(ranked[num_top - 1:], 1, 2)[1:])
+    return result
+
+
+class RatingsTest(SimpleTestCase):
+    """
+    The sparse ALS of mturk.ratings against the same completion computed on the dense worker x task matrix
+    """
+
+    def setUp(self):
+        random_state = np.random.RandomState(3)
+        self.num_workers, self.num_tasks = 12, 30
+        # every worker and task is rated at least once, so both sides are indexed like the dense matrix
+        cells = [(w, t) for w in range(self.num_workers) for t in range(self.num_tasks)
+                 if random_state.rand() < 0.3 or t % self.num_workers == w]
+        self.worker_ids = [w for w, _ in cells]
+        self.task_ids = [t for _, t in cells]
+        self.weights = random_state.uniform(1, 3, size=len(cells)).round(2)
+        self.matrix = np.full((self.num_workers, self.num_tasks), np.nan)
+        self.matrix[self.worker_ids, self.task_ids] = self.weights
+
+    def test_factorize(self):
+        factors = ratings.factorize(self.worker_ids, self.task_ids, self.weights, seed=7)
+        mean = self.weights.mean()
+        random_state = np.random.RandomState(7)
+        random_state.normal(scale=0.1, size=(self.num_workers, ratings.RANK))
+        task_factors = random_state.normal(scale=0.1, size=(self.num_tasks, ratings.RANK))
+        residuals = self.matrix - mean
+        for _ in range(ratings.ITERATIONS):
+            worker_factors = dense_solve(residuals, task_factors, range(self.num_workers), ratings.REGULARIZATION)
+            task_factors = dense_solve(residuals.T, worker_factors, range(self.num_tasks), ratings.REGULARIZATION)
+        completed = mean + worker_factors.dot(task_factors.T)
+
+        self.assertEqual(factors.worker_ids, list(range(self.num_workers)))
+        np.testing.assert_allclose(factors.worker_factors, worker_factors, atol=1e-8)
+        np.testing.assert_allclose(factors.task_factors, task_factors, atol=1e-8)
+        np.testing.assert_allclose(factors.scores(), completed.mean(axis=1), atol=1e-8)
+
+    def test_update_only_changed_workers(self):
+        previous = ratings.factorize(self.worker_ids, self.task_ids, self.weights)
+        previous_worker_factors = previous.worker_factors.copy()
+        changed = [2, 5]
+        weights = self.weights.copy()
+        weights[np.in1d(self.worker_ids, changed)] = 3.0
+        factors = ratings.update(previous, self.worker_ids, self.task_ids, weights, changed)
+        np.testing.assert_array_equal(previous.worker_factors, previous_worker_factors)
+
+        matrix = np.full((self.num_workers, self.num_tasks), np.nan)
+        matrix[self.worker_ids, self.task_ids] = weights
+        residuals = matrix - previous.mean
+        worker_factors = previous.worker_factors.copy()
+        task_factors = previous.task_factors.copy()
+        changed_tasks = sorted(set(t for w, t in zip(self.worker_ids, self.task_ids) if w in changed))
+        for _ in range(ratings.WARM_ITERATIONS):
+            worker_factors[changed] = dense_solve(residuals, task_factors, changed, ratings.REGULARIZATION)
+            task_factors[changed_tasks] = dense_solve(residuals.T, worker_factors, changed_tasks,
+                                                      ratings.REGULARIZATION)
+
+        unchanged = [w for w in range(self.num_workers) if w not in changed]
+        np.testing.assert_array_equal(factors.worker_factors[unchanged], previous.worker_factors[unchanged])
+        np.testing.assert_allclose(factors.worker_factors, worker_factors, atol=1e-8)
+        np.testing.assert_allclose(factors.task_factors, task_factors, atol=1e-8)
+
+    def test_boomerang_scores(self):
+        scores = ratings.factorize(self.worker_ids, self.task_ids, self.weights).scores()
+        boomerang = ratings.boomerang_scores(scores, 0.75)
+        np.testing.assert_allclose(boomerang, dense_split(scores, 0.75))
+        self.assertAlmostEqual(boomerang.max(), 3)
+        self.assertAlmostEqual(boomerang.min(), 1)
+        # the ratings keep the order of the scores
+        self.assertEqual(list(np.argsort(-boomerang, kind='mergesort')), list(np.argsort(-scores, kind='mergesort')))
+
+    def test_saved_factors(self):
+        factors = ratings.factorize(self.worker_ids, self.task_ids, self.weights)
+        restored = ratings.RatingFactors.loads(factors.dumps())
+        np.testing.assert_allclose(restored.scores(), factors.scores())
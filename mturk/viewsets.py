@@ -2,20 +2,20 @@ import json
 
 from django.db import transaction
 from django.shortcuts import get_object_or_404
-from hashids import Hashids
 from rest_framework import mixins, status
 from rest_framework.decorators import detail_route, list_route
 from rest_framework.response import Response
 from rest_framework.viewsets import GenericViewSet, ViewSet
-from ws4redis.publisher import RedisPublisher
-from ws4redis.redis_store import RedisMessage
 
-from crowdsourcing import constants
+from crowdsourcing import constants, notifications, outbox
+from crowdsourcing.crypto import get_hasher
 from crowdsourcing.models import TaskWorker, TaskWorkerResult, MatchGroup, ProjectNotificationPreference
 from crowdsourcing.serializers.project import ProjectSerializer
 from crowdsourcing.serializers.task import (TaskSerializer,
                                             TaskWorkerResultSerializer, CollectiveRejectionSerializer)
-from crowdsourcing.tasks import update_worker_cache
+from crowdsourcing.tasks import update_worker_cache, record_task_duration
+from crowdsourcing.utils import mark_project_rollups_dirty, mark_worker_earnings_dirty, mark_worker_submitted, \
+    mark_mturk_hits_dirty
 from crowdsourcing.viewsets.task import is_final_review, update_ts_scores
 from csp import settings
 from mturk.models import MTurkAssignment, MTurkHIT, MTurkNotification, MTurkAccount
@@ -32,7 +32,7 @@ class MTurkAssignmentViewSet(mixins.CreateModelMixin, GenericViewSet):
     def create(self, request, *args, **kwargs):
         worker = get_or_create_worker(worker_id=request.data.get('workerId'))
         task_id = request.data.get('taskId', -1)
-        task_hash = Hashids(salt=settings.SECRET_KEY, min_length=settings.ID_HASH_MIN_LENGTH)
+        task_hash = get_hasher()
         task_id = task_hash.decode(task_id)
         if len(task_id) == 0:
             task_id = -1
@@ -62,6 +62,8 @@ class MTurkAssignmentViewSet(mixins.CreateModelMixin, GenericViewSet):
             if created:
                 task_worker.status = TaskWorker.STATUS_IN_PROGRESS
                 task_worker.save()
+                mark_project_rollups_dirty([mturk_hit.task.project_id])
+                mark_worker_earnings_dirty([(worker.id, mturk_hit.task.project_id)])
 
             # get or create notification preference
             preference, p_created = ProjectNotificationPreference.objects.get_or_create(
@@ -115,9 +117,17 @@ class MTurkAssignmentViewSet(mixins.CreateModelMixin, GenericViewSet):
 
                         in_progress_assignment.save()
 
+                first_submission = mturk_assignment.task_worker.status == TaskWorker.STATUS_IN_PROGRESS
                 mturk_assignment.task_worker.task_status = TaskWorker.STATUS_SUBMITTED
                 mturk_assignment.task_worker.status = TaskWorker.STATUS_SUBMITTED
                 mturk_assignment.task_worker.save()
+                mark_project_rollups_dirty([mturk_assignment.task_worker.task.project_id])
+                mark_worker_earnings_dirty([(mturk_assignment.task_worker.worker_id,
+                                             mturk_assignment.task_worker.task.project_id)])
+                mark_worker_submitted(mturk_assignment.task_worker.task.project.group_id,
+                                      mturk_assignment.task_worker.worker_id)
+                if first_submission:
+                    record_task_duration(mturk_assignment.task_worker.id)
 
                 mturk_assignment.status = TaskWorker.STATUS_SUBMITTED
                 mturk_assignment.save()
@@ -126,44 +136,44 @@ class MTurkAssignmentViewSet(mixins.CreateModelMixin, GenericViewSet):
 
                 task_data = task_worker.task.data
 
-                redis_publisher = RedisPublisher(facility='bot',
-                                                 users=[task_worker.task.project.owner])
                 task = task_worker.task
 
-                task_workers = TaskWorker.objects.filter(
-                    task__group_id=task_worker.task.group_id,
-                    status__in=[
-                        TaskWorker.STATUS_ACCEPTED,
-                        TaskWorker.STATUS_SUBMITTED
-                    ])
-
-                message = {
-                    "type": "REGULAR",
-                    "payload": {
-                        'project_id': task_worker.task.project_id,
-                        'project_key': ProjectSerializer().get_hash_id(task_worker.task.project),
-                        'task_id': task_worker.task_id,
-                        'task_group_id': task_worker.task.group_id,
-                        'taskworker_id': task_worker.id,
-                        'worker_id': task_worker.worker_id,
-                        'expected': max(task_workers.count(), task_worker.task.project.repetition),
-                    }
+                payload = {
+                    'project_id': task_worker.task.project_id,
+                    'project_key': ProjectSerializer().get_hash_id(task_worker.task.project),
+                    'task_id': task_worker.task_id,
+                    'task_group_id': task_worker.task.group_id,
+                    'taskworker_id': task_worker.id,
+                    'worker_id': task_worker.worker_id
                 }
 
-                if task.project.is_review:
-                    match_group = MatchGroup.objects.get(batch=task.batch)
-                    if is_final_review(task.batch_id):
-                        message = {
-                            "type": "REVIEW",
-                            "payload": {
-                                "match_group_id": match_group.id,
-                                'project_key': ProjectSerializer().get_hash_id(task_worker.task.project),
-                                "is_done": True
-                            }
-                        }
-                message = RedisMessage(json.dumps(message))
+                if not task.project.is_review and notifications.get_bot_stream(task.project.owner_id) is not None:
+                    outbox.stream(task.project.owner_id, payload)
+                else:
+                    task_workers = TaskWorker.objects.filter(
+                        task__group_id=task_worker.task.group_id,
+                        status__in=[
+                            TaskWorker.STATUS_ACCEPTED,
+                            TaskWorker.STATUS_SUBMITTED
+                        ])
+                    payload['expected'] = max(task_workers.count(), task_worker.task.project.repetition)
+                    message = {
+                        "type": "REGULAR",
+                        "payload": payload
+                    }
 
-                redis_publisher.publish_message(message)
+                    if task.project.is_review:
+                        match_group = MatchGroup.objects.get(batch=task.batch)
+                        if is_final_review(task.batch_id):
+                            message = {
+                                "type": "REVIEW",
+                                "payload": {
+                                    "match_group_id": match_group.id,
+                                    'project_key': ProjectSerializer().get_hash_id(task_worker.task.project),
+                                    "is_done": True
+                                }
+                            }
+                    notifications.publish('bot', json.dumps(message), users=[task_worker.task.project.owner])
                 update_worker_cache.delay([task_worker.worker_id], constants.TASK_SUBMITTED)
 
                 if task.project.is_review:
@@ -203,14 +213,15 @@ class MTurkAssignmentViewSet(mixins.CreateModelMixin, GenericViewSet):
 
         event_type = request.query_params.get('Event.1.EventType')
         if event_type in ['AssignmentReturned', 'AssignmentAbandoned']:
-            mturk_assignment = MTurkAssignment.objects.filter(hit__hit_id=hit_id, assignment_id=assignment_id,
-                                                              status=TaskWorker.STATUS_IN_PROGRESS).first()
+            mturk_assignment = MTurkAssignment.objects.select_related('hit__task') \
+                .filter(hit__hit_id=hit_id, assignment_id=assignment_id, status=TaskWorker.STATUS_IN_PROGRESS).first()
             if mturk_assignment is not None:
                 mturk_assignment.status = TaskWorker.STATUS_SKIPPED
                 mturk_assignment.save()
                 if mturk_assignment.task_worker is not None:
                     mturk_assignment.task_worker.status = TaskWorker.STATUS_SKIPPED
                     mturk_assignment.task_worker.save()
+                mark_mturk_hits_dirty([mturk_assignment.hit.task.group_id])
 
         # MTurkNotification.objects.create(event_type=event_type, hit_id=hit_id, hit_type_id=hit_type_id,
         #                                  assignment_id=assignment_id)
@@ -47,7 +47,7 @@
                             var conversation = chat.conversation;
                             conversation.status = chat.status;
                             conversation.status_id = chat.id;
-                            conversation.unread_count = 0;
+                            conversation.unread_count = conversation.unread_count || 0;
                             return conversation;
                         });
                     },
@@ -85,6 +85,7 @@
             Task.listMyTasks(project.id).then(
                 function success(response) {
                     self.tasks = response[0].tasks;
+                    listRemainingTasks(project, response[0].next);
                     self.selectedProject = project;
                     RatingService.listByTarget(project.owner.id, 'worker').then(
                         function success(response) {
@@ -103,6 +104,24 @@
             });
         }
 
+        function listRemainingTasks(project, pageUrl) {
+            if (!pageUrl) {
+                return;
+            }
+            Task.listMyTasks(project.id, pageUrl).then(
+                function success(response) {
+                    if (self.selectedProject !== project) {
+                        return;
+                    }
+                    self.tasks = self.tasks.concat(response[0].tasks);
+                    listRemainingTasks(project, response[0].next);
+                },
+                function error(response) {
+                    $mdToast.showSimple('Could fetch project tasks');
+                }
+            );
+        }
+
         function setRating(rating, weight) {
             if (rating && rating.hasOwnProperty('id') && rating.id) {
                 RatingService.updateRating(weight, rating).then(function success(resp) {
@@ -94,7 +94,8 @@
         self.relaunchTask = relaunchTask;
         self.relaunchAll = relaunchAll;
         self.done = done;
-        self.offset = 0;
+        self.tasksNext = null;
+        self.tasksPrevious = null;
         self.createRevisionInProgress = false;
         self.conflictsResolved = false;
         self.showInstructions = false;
@@ -230,9 +231,6 @@
                         self.project.deadline = convertDate(self.project.deadline);
                     }
                     getQualificationItems();
-                    if (!self.offset) {
-                        self.offset = 0;
-                    }
                     self.calculateTotalCost();
                     getSubmittedTasksCount();
                 },
@@ -296,17 +294,15 @@
             }
         }
 
-        function listTasks() {
-            Task.list(self.project.id, self.offset).then(
+        function listTasks(pageUrl) {
+            Task.list(self.project.id, pageUrl).then(
                 function success(response) {
                     if (response[0].tasks.length) {
                         self.project.headers = response[0].headers;
                         self.project.tasks = response[0].tasks;
+                        self.tasksNext = response[0].next;
+                        self.tasksPrevious = response[0].previous;
                     }
-                    else {
-                        self.offset -= 10;
-                    }
-
                 },
                 function error(response) {
                 }
@@ -315,19 +311,17 @@
         }
 
         function nextPage() {
-            if (self.project.tasks.length < 10) {
+            if (!self.tasksNext) {
                 return;
             }
-            self.offset += 10;
-            listTasks();
+            listTasks(self.tasksNext);
         }
 
         function previousPage() {
-            self.offset -= 10;
-            if (self.offset < 0) {
-                self.offset = 0;
+            if (!self.tasksPrevious) {
+                return;
             }
-            listTasks();
+            listTasks(self.tasksPrevious);
         }
 
 
@@ -52,9 +52,9 @@
             return HttpService.doRequest(settings);
         }
 
-        function list(project_id, offset) {
+        function list(project_id, pageUrl) {
             var settings = {
-                url: baseUrl + 'list-data/?project=' + project_id + '&offset=' + offset,
+                url: pageUrl || baseUrl + 'list-data/?project=' + project_id,
                 method: 'GET'
             };
             return HttpService.doRequest(settings);
@@ -205,9 +205,9 @@
             return HttpService.doRequest(settings);
         }
 
-        function listMyTasks(project_id) {
+        function listMyTasks(project_id, pageUrl) {
             var settings = {
-                url: taskWorkerBaseUrl + 'list-my-tasks/?project_id=' + project_id,
+                url: pageUrl || taskWorkerBaseUrl + 'list-my-tasks/?project_id=' + project_id,
                 method: 'GET'
             };
             return HttpService.doRequest(settings);